@@ -1,5 +1,6 @@
 import os
 import sys
+import time
 from flask import Flask
 from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import timedelta
@@ -20,15 +21,55 @@ def create_app():
     
     # Initialize services
     try:
-        from app.models.models import initialize_models
+        from app.models.models import ModelLoader
         from app.services.firebase_service import initialize_firebase
         
-        # Store models in app config for global access
-        u2net_session, model = initialize_models(app)
-        app.config['U2NET_SESSION'] = u2net_session
-        app.config['ML_MODEL'] = model
+        startup_start = time.perf_counter()
         
+        # Models load on a background thread while the rest of the app
+        # (including Firebase) initializes
+        loader = ModelLoader(app, on_ready=init_inference)
+        app.config['MODEL_LOADER'] = loader
+        load_mode = app.config['MODEL_LOAD_MODE']
+        if load_mode != 'lazy':
+            loader.start()
+        
+        from app.services.result_cache import create_result_cache, create_processed_image_store
+        app.config['RESULT_CACHE'] = create_result_cache(app)
+        app.config['PROCESSED_IMAGE_STORE'] = create_processed_image_store(app)
+        
+        from app.services.job_queue import create_job_queue, JobWorkers
+        from app.services.prediction import predict_from_bytes
+        app.config['JOB_QUEUE'] = create_job_queue(app)
+        if app.config['JOB_QUEUE'] is not None:
+            app.config['JOB_WORKER_THREADS'] = JobWorkers(
+                app, app.config['JOB_QUEUE'], predict_from_bytes, app.config['JOB_WORKERS']
+            )
+        
+        from app.services.admission import create_admission_controller
+        app.config['ADMISSION_CONTROLLER'] = create_admission_controller(app)
+        
+        if app.config['STREAMING_ENABLED']:
+            from app.services.streaming import create_stream_registry
+            app.config['STREAM_REGISTRY'] = create_stream_registry(app)
+        
+        firebase_start = time.perf_counter()
         initialize_firebase(app)
+        firebase_time = time.perf_counter() - firebase_start
+        
+        from app.auth.verification import create_token_verifier, SessionDenylist, csrf_token
+        app.config['TOKEN_VERIFIER'] = create_token_verifier(app)
+        app.config['SESSION_DENYLIST'] = SessionDenylist(app.config['AUTH_SESSION_DENYLIST_PATH'])
+        app.jinja_env.globals['csrf_token'] = csrf_token
+        
+        if load_mode == 'eager':
+            loader.wait()
+        
+        app.logger.info(
+            f"Startup timing - Firebase: {firebase_time:.3f}s, "
+            f"Models: {'ready' if loader.ready else load_mode}, "
+            f"Total: {time.perf_counter() - startup_start:.3f}s"
+        )
         app.logger.info("Application initialization completed successfully")
         
     except Exception as e:
@@ -45,8 +86,60 @@ def create_app():
     # Register error handlers
     register_error_handlers(app)
     
+    from app.utils.assets import init_assets
+    init_assets(app)
+    
+    if app.config['METRICS_ENABLED']:
+        from app.services.metrics import init_metrics
+        init_metrics(app)
+    
     return app
 
+def init_inference(app, u2net_session, model, infer):
+    """Publish the loaded models and build everything that depends on them."""
+    # Store models in app config for global access
+    app.config['U2NET_SESSION'] = u2net_session
+    
+    # The registry publishes ML_MODEL, ML_INFER and BATCH_PREDICTOR for the
+    # active classifier version
+    from app.models.registry import ModelRegistry
+    registry = ModelRegistry(app)
+    registry.register_initial(model, infer)
+    app.config['MODEL_REGISTRY'] = registry
+    if app.config['BATCH_PREDICTOR'] is not None:
+        app.logger.info(
+            f"Inference batching enabled - Max batch size: {app.config['INFERENCE_MAX_BATCH_SIZE']}, "
+            f"Max wait: {app.config['INFERENCE_MAX_WAIT_MS']}ms"
+        )
+    
+    candidate = app.config.get('MODEL_CANDIDATE_NAME')
+    if candidate and not app.config.get('INFERENCE_SERVER_ADDRESS'):
+        try:
+            registry.load(os.path.splitext(candidate)[0], candidate, app.config.get('MODEL_CANDIDATE_REPO_ID'))
+        except ValueError as e:
+            app.logger.error(f"Candidate model not loaded: {str(e)}")
+    
+    if app.config['PREPROCESS_WORKERS'] > 0:
+        from app.services.preprocess_pool import PreprocessPool
+        from app.models.sessions import OPENCV_BACKENDS, session_options
+        from app.services.metrics import observe_stages
+        # Sessions that pickle cheaply are sent to the workers as they are
+        send_session = app.config.get('INFERENCE_SERVER_ADDRESS') or app.config['BG_REMOVAL_BACKEND'] in OPENCV_BACKENDS
+        app.config['PREPROCESS_POOL'] = PreprocessPool(
+            app.config['PREPROCESS_WORKERS'],
+            app.config['PREPROCESS_QUEUE_LIMIT'],
+            u2net_model_path=app.config.get('U2NET_MODEL_PATH'),
+            u2net_session=u2net_session if send_session else None,
+            session_options=session_options(app.config),
+            bg_backend=app.config['BG_REMOVAL_BACKEND'],
+            on_timings=observe_stages,
+            timeout=app.config['PREPROCESS_TIMEOUT_SECONDS']
+        )
+        app.logger.info(
+            f"Preprocessing pool enabled - Workers: {app.config['PREPROCESS_WORKERS']}, "
+            f"Queue limit: {app.config['PREPROCESS_QUEUE_LIMIT']}"
+        )
+
 def register_error_handlers(app):
     from flask import jsonify
     import traceback
@@ -1,13 +1,29 @@
 from functools import wraps
-from flask import session, redirect, url_for, request, current_app
+from flask import session, redirect, url_for, request, current_app, abort
+from app.auth.verification import restore_session
 
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        # The signed Flask session needs no verification; the Firebase
+        # session cookie is only checked when that session is missing
+        if 'user_id' not in session and not restore_session(current_app):
             current_app.logger.warning(
                 f"Unauthorized access attempt to {request.endpoint} from {request.remote_addr}"
             )
             return redirect(url_for('auth.login'))
         return f(*args, **kwargs)
-    return decorated_function
\ No newline at end of file
+    return decorated_function
+
+def admin_required(f):
+    """Like login_required, for the users listed in MODEL_ADMIN_EMAILS."""
+    @wraps(f)
+    @login_required
+    def decorated_function(*args, **kwargs):
+        if session.get('email') not in current_app.config['MODEL_ADMIN_EMAILS']:
+            current_app.logger.warning(
+                f"Forbidden access attempt to {request.endpoint} by {session.get('email', 'Unknown')}"
+            )
+            abort(403)
+        return f(*args, **kwargs)
+    return decorated_function
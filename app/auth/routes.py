@@ -1,17 +1,24 @@
+from datetime import timedelta
 from flask import Blueprint, request, render_template, redirect, url_for, session, jsonify, current_app
 from firebase_admin import auth
+from app.auth.verification import start_session, valid_csrf_token, TokenVerificationError
 
 auth_bp = Blueprint('auth', __name__)
 
-# Read base64 images once at app startup
-with open("static/images/favicon.txt", "r") as f:
-    FAVICON_B64 = f.read().strip()  # Remove whitespace/newlines
-
-with open("static/images/imageO.txt", "r") as f:
-    IMAGEO_B64 = f.read().strip()  # Remove whitespace/newlines
-
-with open("static/images/placeholder.txt", "r") as f:
-    PLACEHOLDER_B64 = f.read().strip()  # Remove whitespace/newlines
+def set_session_cookie(response, id_token):
+    """Attach a Firebase session cookie so a later visit can restore the
+    session without signing in again. Login still succeeds without it."""
+    lifetime = current_app.config['AUTH_SESSION_COOKIE_SECONDS']
+    try:
+        cookie = auth.create_session_cookie(id_token, expires_in=timedelta(seconds=lifetime))
+    except Exception as e:
+        current_app.logger.warning(f"Could not create session cookie: {str(e)}")
+        return response
+    response.set_cookie(
+        current_app.config['AUTH_SESSION_COOKIE_NAME'], cookie, max_age=lifetime, httponly=True,
+        secure=current_app.config['SESSION_COOKIE_SECURE'], samesite='Lax'
+    )
+    return response
 
 @auth_bp.route('/signup', methods=['GET', 'POST'])
 def signup():
@@ -24,29 +31,43 @@ def login():
         id_token = request.form.get('idToken')
         if not id_token:
             current_app.logger.warning("Login attempt without ID token")
-            return render_template('login.html',  favicon_b64=FAVICON_B64, imageo_b64=IMAGEO_B64, placeholder_b64=PLACEHOLDER_B64, error="Missing ID token.")
+            return render_template('login.html', error="Missing ID token.")
             
         try:
-            decoded_token = auth.verify_id_token(id_token)
-            session['user_id'] = decoded_token['uid']
-            session['email'] = decoded_token.get('email')
-            session.permanent = True
+            decoded_token = current_app.config['TOKEN_VERIFIER'].verify_id_token(id_token)
+            start_session(decoded_token)
             
-            current_app.logger.info(f"User logged in successfully: {session.get('email', 'Unknown')}")
-            return redirect(url_for('main.home'))
+            current_app.logger.info("User logged in successfully: %s", session.get('email', 'Unknown'))
+            return set_session_cookie(redirect(url_for('main.home')), id_token)
             
         except Exception as e:
             current_app.logger.warning(f"Login failed: {str(e)}")
-            return render_template('login.html',  favicon_b64=FAVICON_B64, imageo_b64=IMAGEO_B64, placeholder_b64=PLACEHOLDER_B64, error=f"Invalid token: {str(e)}")
+            return render_template('login.html', error=f"Invalid token: {str(e)}")
             
-    return render_template('login.html', favicon_b64=FAVICON_B64, imageo_b64=IMAGEO_B64, placeholder_b64=PLACEHOLDER_B64)
+    return render_template('login.html')
 
-@auth_bp.route('/logout')
+@auth_bp.route('/logout', methods=['POST'])
 def logout():
     user_email = session.get('email', 'Unknown')
+    if not valid_csrf_token():
+        current_app.logger.warning(f"Logout without a valid CSRF token from {request.remote_addr}")
+        return jsonify({'error': 'Invalid CSRF token'}), 403
+
+    # Deleting the cookie only removes the browser's copy; the denylist
+    # stops any other copy of it from restoring a session
+    cookie = request.cookies.get(current_app.config['AUTH_SESSION_COOKIE_NAME'])
+    if cookie:
+        try:
+            claims = current_app.config['TOKEN_VERIFIER'].verify_session_cookie(cookie)
+            current_app.config['SESSION_DENYLIST'].add(cookie, claims['exp'])
+        except TokenVerificationError:
+            pass
+
     session.clear()
-    current_app.logger.info(f"User logged out: {user_email}")
-    return redirect(url_for('auth.login'))
+    current_app.logger.info("User logged out: %s", user_email)
+    response = redirect(url_for('auth.login'))
+    response.delete_cookie(current_app.config['AUTH_SESSION_COOKIE_NAME'])
+    return response
 
 @auth_bp.route('/sessionLogin', methods=['POST'])
 def session_login():
@@ -61,13 +82,11 @@ def session_login():
             current_app.logger.warning("Session login attempt without ID token")
             return jsonify({'error': 'ID token missing'}), 400
 
-        decoded_token = auth.verify_id_token(id_token)
-        session['user_id'] = decoded_token['uid']
-        session['email'] = decoded_token.get('email')
-        session.permanent = True
+        decoded_token = current_app.config['TOKEN_VERIFIER'].verify_id_token(id_token)
+        start_session(decoded_token)
         
-        current_app.logger.info(f"Session login successful: {session.get('email', 'Unknown')}")
-        return jsonify({'status': 'success'}), 200
+        current_app.logger.info("Session login successful: %s", session.get('email', 'Unknown'))
+        return set_session_cookie(jsonify({'status': 'success'}), id_token), 200
         
     except Exception as e:
         current_app.logger.warning(f"Session login failed: {str(e)}")
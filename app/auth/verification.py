@@ -0,0 +1,269 @@
+"""Local verification of Firebase ID tokens and session cookies.
+
+``firebase_admin.auth.verify_id_token`` downloads Google's public keys on
+every call. Here the keys are cached until their ``Cache-Control`` max-age
+runs out, so a verification is only a signature check plus claim checks.
+
+After login the app also issues a Firebase session cookie. When the Flask
+session is gone (expired, or the SECRET_KEY changed on deploy) a returning
+user's session cookie is verified locally and the session is restored,
+without another sign-in round trip. Restoring is rare, so that path also
+asks Firebase whether the user was disabled or their tokens revoked. Logout
+puts the cookie on a denylist shared by the workers, so a copy of it cannot
+restore a session afterwards, while the user's other devices stay signed in.
+
+``AUTH_PUBLIC_KEYS_FILE`` replaces the Google key sets with a local JSON
+file of ``{kid: PEM certificate or public key}``, for tests and load tests.
+``scripts/make_test_auth_keys.py`` writes such a file and mints tokens for it.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import secrets
+import threading
+import requests
+from google.auth import jwt
+from flask import session, request
+from firebase_admin import auth
+
+from app.services.metrics import AUTH_VERIFICATION_DURATION, AUTH_KEY_FETCHES
+
+ID_TOKEN_CERTS_URL = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+SESSION_COOKIE_CERTS_URL = 'https://www.googleapis.com/identitytoolkit/v3/relyingparty/publicKeys'
+ID_TOKEN_ISSUER = 'https://securetoken.google.com/{project_id}'
+SESSION_COOKIE_ISSUER = 'https://session.firebase.google.com/{project_id}'
+
+_MAX_AGE = re.compile(r'max-age=(\d+)')
+
+class TokenVerificationError(ValueError):
+    pass
+
+class PublicKeyCache:
+    """Google's ``{kid: certificate}`` key set, refetched when its
+    Cache-Control max-age expires. An unknown kid (keys were rotated early)
+    triggers a refetch, at most once per ``min_refetch_seconds``."""
+
+    def __init__(self, url, name, default_max_age=300, min_refetch_seconds=60, timeout=10):
+        self.url = url
+        self.name = name
+        self.default_max_age = default_max_age
+        self.min_refetch_seconds = min_refetch_seconds
+        self.timeout = timeout
+        self._keys = {}
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, key_id=None):
+        now = time.time()
+        keys = self._keys
+        if now < self._expires_at and (key_id is None or key_id in keys):
+            return keys
+
+        with self._lock:
+            now = time.time()
+            expired = now >= self._expires_at
+            unknown_kid = key_id is not None and key_id not in self._keys
+            if expired or (unknown_kid and now - self._fetched_at >= self.min_refetch_seconds):
+                self._fetch(now)
+            return self._keys
+
+    def _fetch(self, now):
+        response = requests.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        self._keys = response.json()
+        match = _MAX_AGE.search(response.headers.get('Cache-Control', ''))
+        max_age = int(match.group(1)) if match else self.default_max_age
+        self._fetched_at = now
+        self._expires_at = now + max_age
+        AUTH_KEY_FETCHES.labels(key_set=self.name).inc()
+
+    def stats(self):
+        return {
+            'keys': len(self._keys),
+            'expires_in': max(0, round(self._expires_at - time.time())),
+        }
+
+class StaticKeySet:
+    """Fixed key set read from a JSON file."""
+
+    def __init__(self, path):
+        with open(path) as f:
+            self._keys = json.load(f)
+
+    def get(self, key_id=None):
+        return self._keys
+
+    def stats(self):
+        return {'keys': len(self._keys), 'expires_in': None}
+
+class FirebaseTokenVerifier:
+    """Checks what the Firebase Admin SDK checks: RS256 signature by a known
+    key, audience, issuer, expiry, ``iat``/``auth_time`` not in the future
+    and a non-empty subject. Revocation is not checked; that needs a call
+    to Firebase, which is what this avoids. ``restore_session`` checks it
+    with ``session_revoked``."""
+
+    def __init__(self, project_id, id_token_keys, session_cookie_keys, clock_skew_seconds=5):
+        self.project_id = project_id
+        self.id_token_keys = id_token_keys
+        self.session_cookie_keys = session_cookie_keys
+        self.clock_skew_seconds = clock_skew_seconds
+
+    def verify_id_token(self, id_token):
+        return self._verify(id_token, self.id_token_keys, ID_TOKEN_ISSUER, 'id_token')
+
+    def verify_session_cookie(self, cookie):
+        return self._verify(cookie, self.session_cookie_keys, SESSION_COOKIE_ISSUER, 'session_cookie')
+
+    def _verify(self, token, keys, issuer, kind):
+        start = time.perf_counter()
+        result = 'invalid'
+        try:
+            claims = self._decode(token, keys, issuer.format(project_id=self.project_id))
+            result = 'valid'
+            return claims
+        except TokenVerificationError:
+            raise
+        except Exception as e:
+            raise TokenVerificationError(str(e)) from e
+        finally:
+            AUTH_VERIFICATION_DURATION.labels(kind=kind, result=result).observe(time.perf_counter() - start)
+
+    def _decode(self, token, keys, issuer):
+        if not self.project_id:
+            raise TokenVerificationError("Firebase project id is not configured")
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+
+        header = jwt.decode_header(token)
+        if header.get('alg') != 'RS256':
+            raise TokenVerificationError(f"Unexpected algorithm: {header.get('alg')}")
+        key_id = header.get('kid')
+        certs = keys.get(key_id)
+        if key_id not in certs:
+            raise TokenVerificationError(f"Unknown key id: {key_id}")
+
+        claims = jwt.decode(
+            token, certs={key_id: certs[key_id]}, audience=self.project_id,
+            clock_skew_in_seconds=self.clock_skew_seconds
+        )
+        if claims.get('iss') != issuer:
+            raise TokenVerificationError(f"Unexpected issuer: {claims.get('iss')}")
+        subject = claims.get('sub')
+        if not isinstance(subject, str) or not subject or len(subject) > 128:
+            raise TokenVerificationError("Invalid subject")
+        if claims.get('auth_time', 0) > time.time() + self.clock_skew_seconds:
+            raise TokenVerificationError("Token auth_time is in the future")
+
+        claims['uid'] = subject
+        return claims
+
+def create_token_verifier(app):
+    project_id = app.config.get('FIREBASE_PROJECT_ID')
+    keys_file = app.config.get('AUTH_PUBLIC_KEYS_FILE')
+    if keys_file:
+        id_token_keys = session_cookie_keys = StaticKeySet(keys_file)
+        app.logger.warning(f"Verifying tokens against local keys from {keys_file}")
+    else:
+        id_token_keys = PublicKeyCache(ID_TOKEN_CERTS_URL, 'id_token')
+        session_cookie_keys = PublicKeyCache(SESSION_COOKIE_CERTS_URL, 'session_cookie')
+    if not project_id:
+        app.logger.warning("Firebase project id unknown; token verification will fail")
+    return FirebaseTokenVerifier(
+        project_id, id_token_keys, session_cookie_keys, app.config['AUTH_CLOCK_SKEW_SECONDS']
+    )
+
+class SessionDenylist:
+    """Session cookies ended by logout, kept in a SQLite file shared by
+    every worker until the cookie would have expired anyway. Only a digest
+    of each cookie is stored."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS denied (digest TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+
+    def _connect(self):
+        # One connection per thread (and per process after a fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _digest(cookie):
+        return hashlib.sha256(cookie.encode('utf-8')).hexdigest()
+
+    def add(self, cookie, expires_at):
+        conn = self._connect()
+        conn.execute("DELETE FROM denied WHERE expires_at < ?", (time.time(),))
+        conn.execute(
+            "INSERT OR REPLACE INTO denied (digest, expires_at) VALUES (?, ?)", (self._digest(cookie), expires_at)
+        )
+
+    def __contains__(self, cookie):
+        return self._connect().execute(
+            "SELECT 1 FROM denied WHERE digest = ?", (self._digest(cookie),)
+        ).fetchone() is not None
+
+def csrf_token():
+    """The session's CSRF token, for forms that change state."""
+    if 'csrf_token' not in session:
+        session['csrf_token'] = secrets.token_urlsafe(32)
+    return session['csrf_token']
+
+def valid_csrf_token():
+    """Whether the request carries the session's CSRF token, as the
+    ``csrf_token`` form field or the ``X-CSRF-Token`` header."""
+    expected = session.get('csrf_token')
+    sent = request.form.get('csrf_token') or request.headers.get('X-CSRF-Token')
+    return bool(expected and sent) and secrets.compare_digest(expected, sent)
+
+def start_session(claims):
+    session['user_id'] = claims['uid']
+    session['email'] = claims.get('email')
+    session.permanent = True
+
+def session_revoked(claims):
+    """Whether the user is disabled or their tokens were revoked after this
+    cookie's sign-in, the check ``verify_session_cookie(check_revoked=True)``
+    makes. A failed lookup counts as revoked."""
+    try:
+        user = auth.get_user(claims['uid'])
+    except Exception as e:
+        raise TokenVerificationError(f"Could not check revocation: {str(e)}") from e
+    if user.disabled:
+        return True
+    valid_after = user.tokens_valid_after_timestamp
+    return bool(valid_after) and claims.get('auth_time', 0) * 1000 < valid_after
+
+def restore_session(app):
+    """Rebuild the Flask session from the Firebase session cookie, if the
+    request has a valid one. Returns whether a session was restored."""
+    cookie = request.cookies.get(app.config['AUTH_SESSION_COOKIE_NAME'])
+    if not cookie:
+        return False
+    if cookie in app.config['SESSION_DENYLIST']:
+        app.logger.info("Session cookie rejected: logged out")
+        return False
+    try:
+        claims = app.config['TOKEN_VERIFIER'].verify_session_cookie(cookie)
+        # Local test keys have no Firebase users to look up.
+        if not app.config.get('AUTH_PUBLIC_KEYS_FILE') and session_revoked(claims):
+            raise TokenVerificationError("Session cookie has been revoked")
+    except TokenVerificationError as e:
+        app.logger.info("Session cookie rejected: %s", e)
+        return False
+    start_session(claims)
+    app.logger.info("Session restored from session cookie: %s", session.get('email', 'Unknown'))
+    return True
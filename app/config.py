@@ -19,6 +19,8 @@ class Config:
     
     # File upload limits
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 50_000_000))  # checked from the header, before decoding
+    DECODE_MIN_SIDE = int(os.environ.get('DECODE_MIN_SIDE', 1024))  # JPEGs are decoded at reduced scale down to this shorter side
     
     # Production settings
     PROPAGATE_EXCEPTIONS = True
@@ -30,4 +32,199 @@ class Config:
     CLASSIFICATION_MODEL_REPO_ID = "iamSubha16/milk_adulterant_detector_model_v7"
     CLASSIFICATION_MODEL_NAME = "milk_adulterant_detector_model_v7.keras"
     BG_REMOVAL_MODEL_REPO_ID="iamSubha16/background_removal_model"
-    BG_REMOVAL_MODEL_NAME="u2net.onnx"
\ No newline at end of file
+    BG_REMOVAL_MODEL_NAME="u2net.onnx"
+    
+    # Inference micro-batching
+    INFERENCE_BATCHING_ENABLED = os.environ.get('INFERENCE_BATCHING_ENABLED', 'true').lower() == 'true'
+    INFERENCE_MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 8))
+    INFERENCE_MAX_WAIT_MS = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 10))
+    
+    # Inference engine: 'keras', 'tf_function' or 'onnx'
+    INFERENCE_ENGINE = os.environ.get('INFERENCE_ENGINE', 'tf_function')
+    INFERENCE_PARITY_CHECK = os.environ.get('INFERENCE_PARITY_CHECK', 'true').lower() == 'true'
+    INFERENCE_PARITY_TOLERANCE = float(os.environ.get('INFERENCE_PARITY_TOLERANCE', 1e-4))
+    CLASSIFIER_ONNX_PATH = os.environ.get('CLASSIFIER_ONNX_PATH')
+    MODEL_INPUT_SIZE = (224, 224)
+    
+    # Prediction result cache: 'memory', 'disk' (shared across workers) or 'none'
+    RESULT_CACHE_BACKEND = os.environ.get('RESULT_CACHE_BACKEND', 'memory')
+    RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    RESULT_CACHE_TTL_SECONDS = int(os.environ.get('RESULT_CACHE_TTL_SECONDS', 3600))
+    RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', os.path.join(os.environ["XDG_CACHE_HOME"], "imageo-results"))
+    
+    # Background removal: 'fast' runs u2net on a copy whose shorter side is
+    # BG_REMOVAL_WORKING_SIZE and crops from the original; 'full' runs rembg
+    # on the full-resolution frame
+    BG_REMOVAL_MODE = os.environ.get('BG_REMOVAL_MODE', 'fast')
+    BG_REMOVAL_WORKING_SIZE = int(os.environ.get('BG_REMOVAL_WORKING_SIZE', 320))
+    # Background removal backend: 'u2net', the smaller rembg models 'u2netp'
+    # and 'silueta', or OpenCV 'threshold' / 'grabcut' for controlled capture
+    # setups (sample centred on a plain surface)
+    BG_REMOVAL_BACKEND = os.environ.get('BG_REMOVAL_BACKEND', 'u2net')
+    BG_GRABCUT_ITERATIONS = int(os.environ.get('BG_GRABCUT_ITERATIONS', 3))
+    
+    # Preprocessing after background removal: 'fused' (single uint8 buffer)
+    # or 'legacy' (step-by-step PIL/NumPy chain). PREPROCESS_WORKING_SIZE > 0
+    # lets the fused pipeline downscale large crops before colour correction.
+    PREPROCESS_PIPELINE = os.environ.get('PREPROCESS_PIPELINE', 'fused')
+    PREPROCESS_WORKING_SIZE = int(os.environ.get('PREPROCESS_WORKING_SIZE', 0))
+    
+    # Preprocessing worker processes (0 runs the pipeline on the request
+    # thread). Requests beyond PREPROCESS_QUEUE_LIMIT queued or running jobs
+    # are rejected with 503.
+    PREPROCESS_WORKERS = int(os.environ.get('PREPROCESS_WORKERS', 0))
+    PREPROCESS_QUEUE_LIMIT = int(os.environ.get('PREPROCESS_QUEUE_LIMIT', 16))
+    PREPROCESS_TIMEOUT_SECONDS = float(os.environ.get('PREPROCESS_TIMEOUT_SECONDS', 30))
+    
+    # Processed images returned by URL (/predict?image=url). Kept in memory
+    # with a single worker, and in PROCESSED_IMAGE_STORE_DIR (shared by all
+    # workers on the host) when WEB_CONCURRENCY > 1
+    PROCESSED_IMAGE_STORE_DIR = os.environ.get('PROCESSED_IMAGE_STORE_DIR', os.path.join(os.environ["XDG_CACHE_HOME"], "imageo-processed-images"))
+    PROCESSED_IMAGE_STORE_MAX_BYTES = int(os.environ.get('PROCESSED_IMAGE_STORE_MAX_BYTES', 32 * 1024 * 1024))
+    PROCESSED_IMAGE_STORE_TTL_SECONDS = int(os.environ.get('PROCESSED_IMAGE_STORE_TTL_SECONDS', 600))
+    
+    # Processed image returned with a prediction, unless the request sets
+    # ?image_format=: 'jpeg', 'webp', 'thumbnail' (a small JPEG) or 'none'.
+    # Encoding runs on its own threads while the classifier runs.
+    RESPONSE_IMAGE_FORMAT = os.environ.get('RESPONSE_IMAGE_FORMAT', 'jpeg')
+    RESPONSE_JPEG_QUALITY = int(os.environ.get('RESPONSE_JPEG_QUALITY', 85))
+    RESPONSE_WEBP_QUALITY = int(os.environ.get('RESPONSE_WEBP_QUALITY', 80))
+    RESPONSE_THUMBNAIL_SIZE = int(os.environ.get('RESPONSE_THUMBNAIL_SIZE', 96))
+    RESPONSE_ENCODE_THREADS = int(os.environ.get('RESPONSE_ENCODE_THREADS', 2))
+    
+    # Batch prediction (/predict/batch)
+    BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 16))
+    BATCH_PREPROCESS_THREADS = int(os.environ.get('BATCH_PREPROCESS_THREADS', 4))
+    
+    # Live camera streams (/predict/stream). u2net reruns when the frame's
+    # 32x32 grey thumbnail differs from the masked one by more than
+    # STREAM_CHANGE_THRESHOLD (mean absolute difference, 0-255), or after
+    # STREAM_MAX_MASK_AGE reused frames. STREAM_SMOOTHING is the weight of
+    # the newest frame in the moving average. Open streams are shared by all
+    # workers through STREAM_STORE_PATH when WEB_CONCURRENCY > 1.
+    STREAMING_ENABLED = os.environ.get('STREAMING_ENABLED', 'true').lower() == 'true'
+    STREAM_CHANGE_THRESHOLD = float(os.environ.get('STREAM_CHANGE_THRESHOLD', 6.0))
+    STREAM_MAX_MASK_AGE = int(os.environ.get('STREAM_MAX_MASK_AGE', 30))
+    STREAM_SMOOTHING = float(os.environ.get('STREAM_SMOOTHING', 0.3))
+    STREAM_FRAME_WAIT_SECONDS = float(os.environ.get('STREAM_FRAME_WAIT_SECONDS', 10))
+    STREAM_MAX_STREAMS = int(os.environ.get('STREAM_MAX_STREAMS', 64))
+    STREAM_IDLE_SECONDS = int(os.environ.get('STREAM_IDLE_SECONDS', 60))
+    STREAM_MAX_PER_USER = int(os.environ.get('STREAM_MAX_PER_USER', 4))
+    STREAM_STORE_PATH = os.environ.get('STREAM_STORE_PATH', os.path.join(os.environ["XDG_CACHE_HOME"], "imageo-streams.sqlite3"))
+    
+    # Asynchronous prediction jobs (/predict/async): 'memory', 'sqlite'
+    # (shared by all workers on the host) or 'none'
+    JOB_QUEUE_BACKEND = os.environ.get('JOB_QUEUE_BACKEND', 'memory')
+    JOB_QUEUE_PATH = os.environ.get('JOB_QUEUE_PATH', os.path.join(os.environ["XDG_CACHE_HOME"], "imageo-jobs.sqlite3"))
+    JOB_QUEUE_MAX_DEPTH = int(os.environ.get('JOB_QUEUE_MAX_DEPTH', 100))
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_RESULT_TTL_SECONDS = int(os.environ.get('JOB_RESULT_TTL_SECONDS', 600))
+    JOB_MAX_WAIT_SECONDS = float(os.environ.get('JOB_MAX_WAIT_SECONDS', 30))
+    # sqlite: jobs running longer than this are assumed lost with their
+    # worker and queued again, up to JOB_MAX_ATTEMPTS runs
+    JOB_RUNNING_TIMEOUT_SECONDS = int(os.environ.get('JOB_RUNNING_TIMEOUT_SECONDS', 300))
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 2))
+    
+    # Model loading: 'eager' (load at startup, models in parallel), 'background'
+    # (serve immediately, /health reports 'warming' until loaded) or 'lazy'
+    # (load on the first prediction)
+    MODEL_LOAD_MODE = os.environ.get('MODEL_LOAD_MODE', 'eager')
+    MODEL_WARMUP_WAIT_SECONDS = float(os.environ.get('MODEL_WARMUP_WAIT_SECONDS', 60))
+    # Offline mode: load model files from LOCAL_MODEL_DIR or the local
+    # Hugging Face cache only, never from the network
+    MODEL_OFFLINE = os.environ.get('MODEL_OFFLINE', 'false').lower() == 'true'
+    LOCAL_MODEL_DIR = os.environ.get('LOCAL_MODEL_DIR')
+    
+    # Shared inference server (set by gunicorn.conf.py when
+    # INFERENCE_SERVER_MODE=shared): workers use the models in that process
+    # over a Unix socket instead of loading their own copies
+    INFERENCE_SERVER_ADDRESS = os.environ.get('INFERENCE_SERVER_ADDRESS')
+    INFERENCE_SERVER_AUTHKEY = os.environ.get('INFERENCE_SERVER_AUTHKEY', '')
+    INFERENCE_SERVER_CONNECT_TIMEOUT = float(os.environ.get('INFERENCE_SERVER_CONNECT_TIMEOUT', 300))
+    
+    # Runtime threading. Cores are split evenly between the processes that run
+    # models (WEB_CONCURRENCY gunicorn workers, or the single inference server
+    # when INFERENCE_SERVER_MODE=shared) and again between preprocessing
+    # workers. 0 means derive automatically.
+    CPU_CORES = int(os.environ.get('CPU_CORES', 0))
+    WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+    INFERENCE_SERVER_MODE = os.environ.get('INFERENCE_SERVER_MODE', 'per-worker')
+    ORT_INTRA_OP_THREADS = int(os.environ.get('ORT_INTRA_OP_THREADS', 0))
+    ORT_INTER_OP_THREADS = int(os.environ.get('ORT_INTER_OP_THREADS', 0))
+    # ONNX Runtime graph optimization: 'disable', 'basic', 'extended' or 'all'
+    ORT_GRAPH_OPTIMIZATION_LEVEL = os.environ.get('ORT_GRAPH_OPTIMIZATION_LEVEL', 'all')
+    ORT_ENABLE_CPU_MEM_ARENA = os.environ.get('ORT_ENABLE_CPU_MEM_ARENA', 'true').lower() == 'true'
+    ORT_ENABLE_MEM_PATTERN = os.environ.get('ORT_ENABLE_MEM_PATTERN', 'true').lower() == 'true'
+    TF_INTRA_OP_THREADS = int(os.environ.get('TF_INTRA_OP_THREADS', 0))
+    TF_INTER_OP_THREADS = int(os.environ.get('TF_INTER_OP_THREADS', 0))
+    
+    # INT8 model variants written by scripts/quantize_models.py: 'none'
+    # (float), 'dynamic' or 'static' (calibrated). Missing files fall back to
+    # the float models.
+    U2NET_QUANTIZATION = os.environ.get('U2NET_QUANTIZATION', 'none')
+    CLASSIFIER_QUANTIZATION = os.environ.get('CLASSIFIER_QUANTIZATION', 'none')
+    QUANTIZED_MODEL_DIR = os.environ.get('QUANTIZED_MODEL_DIR', os.path.join(os.environ["XDG_CACHE_HOME"], "imageo-quantized"))
+    
+    # Prometheus metrics at /metrics. Under gunicorn, workers share
+    # PROMETHEUS_MULTIPROC_DIR (set in gunicorn.conf.py) so the endpoint
+    # aggregates all of them. Scrapers need METRICS_TOKEN as a bearer token,
+    # or an address in METRICS_ALLOWED_IPS (loopback only by default).
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_ALLOWED_IPS = [ip.strip() for ip in os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip.strip()]
+    
+    # Logging: 'json' (one object per line, with request id and stage
+    # timings) or 'text'. Records go through a bounded queue to a listener
+    # thread; LOG_SAMPLE_RATE keeps that fraction of requests' routine INFO
+    # lines (warnings and errors are always kept).
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 1.0))
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+    
+    # Token verification. Google's public keys are cached per their
+    # Cache-Control, so ID tokens and session cookies are verified locally.
+    # FIREBASE_PROJECT_ID defaults to the project in FIREBASE_CREDS;
+    # AUTH_PUBLIC_KEYS_FILE swaps in a local key set (tests only).
+    FIREBASE_PROJECT_ID = os.environ.get('FIREBASE_PROJECT_ID')
+    AUTH_PUBLIC_KEYS_FILE = os.environ.get('AUTH_PUBLIC_KEYS_FILE')
+    AUTH_CLOCK_SKEW_SECONDS = int(os.environ.get('AUTH_CLOCK_SKEW_SECONDS', 5))
+    # Firebase session cookie issued at login; Firebase allows 5 minutes to 14 days
+    AUTH_SESSION_COOKIE_NAME = os.environ.get('AUTH_SESSION_COOKIE_NAME', '__session')
+    AUTH_SESSION_COOKIE_SECONDS = int(os.environ.get('AUTH_SESSION_COOKIE_SECONDS', 5 * 24 * 3600))
+    # Session cookies ended by logout, shared by all workers on the host
+    AUTH_SESSION_DENYLIST_PATH = os.environ.get('AUTH_SESSION_DENYLIST_PATH', os.path.join(os.environ["XDG_CACHE_HOME"], "imageo-session-denylist.sqlite3"))
+    
+    # Static assets are served with content-hashed URLs under this prefix
+    # and cached for a year (see app/utils/assets.py)
+    ASSET_URL_PREFIX = os.environ.get('ASSET_URL_PREFIX', '/assets')
+    
+    # Model versions (see app/models/registry.py). Users in MODEL_ADMIN_EMAILS
+    # can load, compare and activate classifier versions through /models.
+    # MODEL_VERSION_LABEL names the startup version (default: its file name);
+    # MODEL_CANDIDATE_NAME loads a second version at startup as the candidate.
+    MODEL_VERSION_LABEL = os.environ.get('MODEL_VERSION_LABEL')
+    MODEL_ADMIN_EMAILS = [email.strip() for email in os.environ.get('MODEL_ADMIN_EMAILS', '').split(',') if email.strip()]
+    MODEL_CANDIDATE_NAME = os.environ.get('MODEL_CANDIDATE_NAME')
+    MODEL_CANDIDATE_REPO_ID = os.environ.get('MODEL_CANDIDATE_REPO_ID')
+    MODEL_WARMUP_INFERENCES = int(os.environ.get('MODEL_WARMUP_INFERENCES', 3))
+    MODEL_DRAIN_TIMEOUT_SECONDS = float(os.environ.get('MODEL_DRAIN_TIMEOUT_SECONDS', 30))
+    # Candidate scoring: 'off', 'shadow' (the active version answers) or 'ab'
+    # (the candidate answers), for this fraction of classifications
+    MODEL_COMPARE_MODE = os.environ.get('MODEL_COMPARE_MODE', 'shadow')
+    MODEL_COMPARE_FRACTION = float(os.environ.get('MODEL_COMPARE_FRACTION', 0.1))
+    MODEL_COMPARE_MAX_PENDING = int(os.environ.get('MODEL_COMPARE_MAX_PENDING', 8))
+    
+    # Admission control for /predict and /predict/batch (see
+    # app/services/admission.py): 'memory' (limits per worker process),
+    # 'sqlite' (shared by all workers on the host) or 'none'
+    ADMISSION_BACKEND = os.environ.get('ADMISSION_BACKEND', 'memory')
+    ADMISSION_STORE_PATH = os.environ.get('ADMISSION_STORE_PATH', os.path.join(os.environ["XDG_CACHE_HOME"], "imageo-admission.sqlite3"))
+    ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 4))
+    ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 32))
+    ADMISSION_USER_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_USER_MAX_IN_FLIGHT', 2))
+    ADMISSION_USER_RATE = float(os.environ.get('ADMISSION_USER_RATE', 2.0))  # requests per second, 0 disables
+    ADMISSION_USER_BURST = int(os.environ.get('ADMISSION_USER_BURST', 10))
+    # Deadline assumed when the client sends no X-Request-Timeout header
+    ADMISSION_DEFAULT_TIMEOUT_SECONDS = float(os.environ.get('ADMISSION_DEFAULT_TIMEOUT_SECONDS', 30))
+    ADMISSION_LEASE_SECONDS = int(os.environ.get('ADMISSION_LEASE_SECONDS', 120))
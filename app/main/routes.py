@@ -1,72 +1,520 @@
-from flask import Blueprint, render_template, request, jsonify, session, current_app
+from flask import Blueprint, render_template, request, jsonify, session, current_app, Response, url_for
 from datetime import datetime
+import os
+import re
+import secrets
 import traceback
 import pytz
-from app.auth.decorators import login_required
-from app.services.prediction import predict_from_base64
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from app.auth.decorators import login_required, admin_required
+from app.services.prediction import predict_from_bytes, predict_batch, data_url_to_bytes, data_url_mime_type, require_models
+from app.services.streaming import process_frame, StreamNotFoundError
+from app.services.admission import admission_controlled, rate_limited, rejection_response, AdmissionRejected
+from app.utils.validators import parse_data_url, load_image_bytes
+from app.services.preprocess_pool import PoolSaturatedError
+from app.services.job_queue import QueueFullError
+from app.models.models import ModelsNotReadyError
+from app.models.registry import ModelVersionNotFoundError
+from app.services.metrics import record_error, render_metrics
 
 main_bp = Blueprint('main', __name__)
 
 local_tz = pytz.timezone("Asia/Kolkata")
-local_time = datetime.now(local_tz)
-
-# Read base64 images once at app startup
-with open("static/images/favicon.txt", "r") as f:
-    FAVICON_B64 = f.read().strip()  # Remove whitespace/newlines
-
-with open("static/images/imageO.txt", "r") as f:
-    IMAGEO_B64 = f.read().strip()  # Remove whitespace/newlines
 
-with open("static/images/placeholder.txt", "r") as f:
-    PLACEHOLDER_B64 = f.read().strip()  # Remove whitespace/newlines
+# secrets.token_urlsafe(16), as issued by prediction_response
+PROCESSED_IMAGE_TOKEN = re.compile(r'[A-Za-z0-9_-]{22}')
+local_time = datetime.now(local_tz)
 
 @main_bp.route('/')
 @login_required
 def home():
-    current_app.logger.info(f"Home page accessed by user: {session.get('email', 'Unknown')}")
-    return render_template('index.html', 
-                           favicon_b64=FAVICON_B64, 
-                           imageo_b64=IMAGEO_B64, 
-                           placeholder_b64=PLACEHOLDER_B64)
+    current_app.logger.info("Home page accessed by user: %s", session.get('email', 'Unknown'))
+    return render_template('index.html')
 
 @main_bp.route('/predict', methods=['POST'])
 @login_required
+@admission_controlled
 def predict():
     user_email = session.get('email', 'Unknown')
     
     try:
-        # Validate request
-        if not request.is_json:
-            current_app.logger.warning(f"Non-JSON request from {user_email}")
-            return jsonify({'error': 'Content-Type must be application/json'}), 400
-        
-        data = request.get_json()
-        if not data or 'image' not in data:
-            current_app.logger.warning(f"Invalid request data from {user_email}")
-            return jsonify({'error': 'No image provided in the request.'}), 400
+        image_data, mime_type, error_message = read_prediction_input()
+        if error_message:
+            current_app.logger.warning(f"Invalid request data from {user_email}: {error_message}")
+            return jsonify({'error': error_message}), 400
 
-        current_app.logger.info(f"Prediction request from user: {user_email}")
-
-        # Process prediction
-        predicted_class, cropped_image = predict_from_base64(data['image'])
+        current_app.logger.info("Prediction request from user: %s", user_email, extra={'sampled': True})
+        predicted_class, cropped_image = predict_from_bytes(image_data, mime_type, requested_image_format())
         
-        current_app.logger.info(f"Prediction successful for {user_email}: {predicted_class}")
+        current_app.logger.info("Prediction successful for %s: %s", user_email, predicted_class, extra={'sampled': True})
         
+        return prediction_response(predicted_class, cropped_image)
+
+    except PoolSaturatedError as e:
+        record_error('pool_saturated')
+        current_app.logger.warning(f"Prediction rejected for {user_email}: {str(e)}")
+        response = jsonify({'error': 'Server is busy. Please try again shortly.'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+    except FutureTimeoutError:
+        record_error('pool_timeout')
+        current_app.logger.warning(f"Prediction timed out in the preprocessing pool for {user_email}")
+        response = jsonify({'error': 'Server is busy. Please try again shortly.'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+    except ModelsNotReadyError as e:
+        return models_not_ready_response(user_email, e)
+
+    except ValueError as e:
+        record_error('validation')
+        current_app.logger.warning(f"Validation error for {user_email}: {str(e)}")
+        return jsonify({'error': f'Validation error: {str(e)}'}), 400
+    
+    except Exception as e:
+        record_error('internal')
+        current_app.logger.error(f"Prediction error for {user_email}: {str(e)}")
+        current_app.logger.error(traceback.format_exc())
+        return jsonify({'error': 'An error occurred during prediction. Please try again.'}), 500
+
+@main_bp.route('/predict/batch', methods=['POST'])
+@login_required
+@admission_controlled
+def predict_batch_route():
+    user_email = session.get('email', 'Unknown')
+    
+    try:
+        if request.mimetype == 'multipart/form-data':
+            uploads = request.files.getlist('images')
+            items = [(upload.read(), upload.mimetype, None) for upload in uploads]
+        elif request.is_json:
+            data = request.get_json()
+            images = data.get('images') if isinstance(data, dict) else None
+            if not isinstance(images, list):
+                current_app.logger.warning(f"Invalid batch request data from {user_email}")
+                return jsonify({'error': 'Request must contain an "images" list.'}), 400
+            items = [parse_batch_item(image) for image in images]
+        else:
+            current_app.logger.warning(f"Unsupported batch content type from {user_email}: {request.mimetype}")
+            return jsonify({'error': 'Content-Type must be application/json or multipart/form-data'}), 400
+
+        if not items:
+            return jsonify({'error': 'No images provided in the request.'}), 400
+
+        max_items = current_app.config['BATCH_MAX_ITEMS']
+        if len(items) > max_items:
+            return jsonify({'error': f'Too many images. Maximum is {max_items} per batch.'}), 400
+
+        current_app.logger.info("Batch prediction request from user: %s - Items: %d", user_email, len(items))
+
+        results = predict_batch(items, requested_image_format())
+
+        succeeded = sum(1 for result in results if result['status'] == 'success')
+        for result in results:
+            if result['status'] != 'success':
+                record_error('batch_item')
+        current_app.logger.info("Batch prediction for %s: %d/%d succeeded", user_email, succeeded, len(results))
+
         return jsonify({
-            'predicted_class': predicted_class,
-            'cropped_image': cropped_image,
+            'results': results,
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
             'status': 'success'
         }), 200
 
+    except ModelsNotReadyError as e:
+        return models_not_ready_response(user_email, e)
+
     except ValueError as e:
+        record_error('validation')
         current_app.logger.warning(f"Validation error for {user_email}: {str(e)}")
         return jsonify({'error': f'Validation error: {str(e)}'}), 400
+
+    except Exception as e:
+        record_error('internal')
+        current_app.logger.error(f"Batch prediction error for {user_email}: {str(e)}")
+        current_app.logger.error(traceback.format_exc())
+        return jsonify({'error': 'An error occurred during prediction. Please try again.'}), 500
+
+def models_not_ready_response(user_email, error):
+    record_error('models_not_ready')
+    current_app.logger.warning(f"Prediction unavailable for {user_email}: {str(error)}")
+    response = jsonify({'error': 'Models are still loading. Please try again shortly.'})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
+def parse_batch_item(base64_str):
+    try:
+        mime_type, image_data = parse_data_url(base64_str)
+        return image_data, mime_type, None
+    except ValueError as e:
+        return None, None, str(e)
+
+@main_bp.route('/predict/async', methods=['POST'])
+@login_required
+@rate_limited
+def predict_async():
+    user_email = session.get('email', 'Unknown')
+    job_queue = current_app.config.get('JOB_QUEUE')
+    if job_queue is None:
+        return jsonify({'error': 'Asynchronous prediction is disabled.'}), 404
     
+    try:
+        image_data, mime_type, error_message = read_prediction_input()
+        if error_message:
+            current_app.logger.warning(f"Invalid request data from {user_email}: {error_message}")
+            return jsonify({'error': error_message}), 400
+
+        current_app.config['JOB_WORKER_THREADS'].ensure_started()
+        job_id = job_queue.enqueue(image_data, mime_type, owner=session['user_id'])
+        current_app.logger.info("Prediction job %s queued for user: %s", job_id, user_email)
+
+        return jsonify({
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': url_for('main.prediction_job', job_id=job_id)
+        }), 202
+
+    except QueueFullError as e:
+        record_error('queue_full')
+        current_app.logger.warning(f"Prediction job rejected for {user_email}: {str(e)}")
+        response = jsonify({'error': 'Server is busy. Please try again shortly.'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    except ValueError as e:
+        record_error('validation')
+        current_app.logger.warning(f"Validation error for {user_email}: {str(e)}")
+        return jsonify({'error': f'Validation error: {str(e)}'}), 400
+
     except Exception as e:
-        current_app.logger.error(f"Prediction error for {user_email}: {str(e)}")
+        record_error('internal')
+        current_app.logger.error(f"Prediction job submission error for {user_email}: {str(e)}")
+        current_app.logger.error(traceback.format_exc())
+        return jsonify({'error': 'An error occurred while queueing the prediction. Please try again.'}), 500
+
+@main_bp.route('/predict/<job_id>')
+@login_required
+def prediction_job(job_id):
+    job_queue = current_app.config.get('JOB_QUEUE')
+    if job_queue is None:
+        return jsonify({'error': 'Asynchronous prediction is disabled.'}), 404
+
+    # ?wait=<seconds> long-polls until the job finishes or the wait expires
+    try:
+        wait = min(float(request.args.get('wait', 0)), current_app.config['JOB_MAX_WAIT_SECONDS'])
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+
+    current_app.config['JOB_WORKER_THREADS'].ensure_started()
+    job = job_queue.get(job_id, owner=session['user_id'], wait=max(wait, 0))
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    return jsonify(job), 200
+
+@main_bp.route('/predict/stream', methods=['POST'])
+@login_required
+@rate_limited
+def open_stream():
+    registry = current_app.config.get('STREAM_REGISTRY')
+    if registry is None:
+        return jsonify({'error': 'Streaming is disabled.'}), 404
+
+    stream_id = secrets.token_urlsafe(12)
+    registry.open(stream_id, session['user_id'])
+    current_app.logger.info("Stream %s opened by %s", stream_id, session.get('email', 'Unknown'))
+    return jsonify({
+        'stream_id': stream_id,
+        'frames_url': url_for('main.stream_frame', stream_id=stream_id),
+        'stream_url': url_for('main.close_stream', stream_id=stream_id),
+    }), 201
+
+@main_bp.route('/predict/stream/<stream_id>/frames', methods=['POST'])
+@login_required
+def stream_frame(stream_id):
+    """One camera frame as the raw body or a multipart ``image`` field,
+    numbered by the ``X-Frame-Seq`` header. Answers ``dropped`` when a newer
+    frame of the stream overtook it."""
+    user_email = session.get('email', 'Unknown')
+    registry = current_app.config.get('STREAM_REGISTRY')
+    if registry is None:
+        return jsonify({'error': 'Streaming is disabled.'}), 404
+
+    seq = request.headers.get('X-Frame-Seq')
+    if seq is not None:
+        if not seq.isdigit():
+            return jsonify({'error': 'X-Frame-Seq must be a non-negative integer'}), 400
+        seq = int(seq)
+
+    try:
+        image_data, mime_type = read_binary_image()
+        image, error_message = load_image_bytes(image_data, mime_type)
+        if error_message:
+            record_error('validation')
+            return jsonify({'error': f'Validation error: {error_message}'}), 400
+
+        require_models()
+        state, seq = registry.get(stream_id, session['user_id'], seq)
+        return jsonify(process_frame(registry, state, seq, image)), 200
+
+    except StreamNotFoundError:
+        return jsonify({'error': 'Stream not found'}), 404
+
+    except AdmissionRejected as e:
+        return rejection_response(e)
+
+    except ModelsNotReadyError as e:
+        return models_not_ready_response(user_email, e)
+
+    except Exception as e:
+        record_error('internal')
+        current_app.logger.error(f"Stream frame error for {user_email}: {str(e)}")
         current_app.logger.error(traceback.format_exc())
         return jsonify({'error': 'An error occurred during prediction. Please try again.'}), 500
 
+@main_bp.route('/predict/stream/<stream_id>', methods=['DELETE'])
+@login_required
+def close_stream(stream_id):
+    registry = current_app.config.get('STREAM_REGISTRY')
+    if registry is None:
+        return jsonify({'error': 'Streaming is disabled.'}), 404
+    try:
+        summary = registry.close(stream_id, session['user_id'])
+    except StreamNotFoundError:
+        return jsonify({'error': 'Stream not found'}), 404
+
+    current_app.logger.info(
+        "Stream %s closed - Frames: %d, Dropped: %d, Masks reused: %d",
+        stream_id, summary['frames'], summary['dropped'], summary['mask_reused']
+    )
+    return jsonify({'status': 'closed', **summary}), 200
+
+@main_bp.route('/models')
+@admin_required
+def list_models():
+    try:
+        require_models()
+    except ModelsNotReadyError as e:
+        return models_not_ready_response(session.get('email', 'Unknown'), e)
+    return jsonify({**current_app.config['MODEL_REGISTRY'].stats(), 'pid': os.getpid()}), 200
+
+def single_worker_required():
+    """Versions live in each worker process, so a change made through
+    /models would only reach the worker that handled it. Returns an error
+    response when more than one worker serves the app, else None."""
+    if current_app.config['WEB_CONCURRENCY'] > 1:
+        return jsonify({
+            'error': 'Model versions can only be changed at runtime with a single worker. '
+                     'Set MODEL_CANDIDATE_NAME (or the classifier settings) and restart instead.',
+            'pid': os.getpid(),
+        }), 409
+    return None
+
+@main_bp.route('/models', methods=['POST'])
+@admin_required
+def load_model_version():
+    """Load a classifier version in the background: JSON with ``filename``,
+    and optionally ``label``, ``repo_id`` and ``activate``."""
+    user_email = session.get('email', 'Unknown')
+    rejected = single_worker_required()
+    if rejected is not None:
+        return rejected
+
+    data = request.get_json(silent=True)
+    filename = data.get('filename') if isinstance(data, dict) else None
+    if not isinstance(filename, str) or not filename:
+        return jsonify({'error': 'Request must contain a model "filename".'}), 400
+
+    try:
+        require_models()
+        label = data.get('label') or os.path.splitext(filename)[0]
+        version = current_app.config['MODEL_REGISTRY'].load(
+            label, filename, data.get('repo_id'), activate=bool(data.get('activate'))
+        )
+    except ModelsNotReadyError as e:
+        return models_not_ready_response(user_email, e)
+    except ValueError as e:
+        return jsonify({'error': str(e), 'pid': os.getpid()}), 409
+
+    current_app.logger.info("Model version %s requested by %s", label, user_email)
+    return jsonify({**version.summary(), 'pid': os.getpid()}), 202
+
+@main_bp.route('/models/<label>/activate', methods=['POST'])
+@admin_required
+def activate_model_version(label):
+    user_email = session.get('email', 'Unknown')
+    rejected = single_worker_required()
+    if rejected is not None:
+        return rejected
+
+    try:
+        require_models()
+        version = current_app.config['MODEL_REGISTRY'].activate(label)
+    except ModelsNotReadyError as e:
+        return models_not_ready_response(user_email, e)
+    except ModelVersionNotFoundError:
+        return jsonify({'error': 'Model version not found', 'pid': os.getpid()}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e), 'pid': os.getpid()}), 409
+
+    current_app.logger.info("Model version %s activated by %s", label, user_email)
+    return jsonify({**version.summary(), 'pid': os.getpid()}), 200
+
+@main_bp.route('/models/<label>', methods=['DELETE'])
+@admin_required
+def discard_model_version(label):
+    user_email = session.get('email', 'Unknown')
+    rejected = single_worker_required()
+    if rejected is not None:
+        return rejected
+
+    try:
+        require_models()
+        version = current_app.config['MODEL_REGISTRY'].discard(label)
+    except ModelsNotReadyError as e:
+        return models_not_ready_response(user_email, e)
+    except ModelVersionNotFoundError:
+        return jsonify({'error': 'Model version not found', 'pid': os.getpid()}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e), 'pid': os.getpid()}), 409
+
+    current_app.logger.info("Model version %s discarded by %s", label, user_email)
+    return jsonify({**version.summary(), 'pid': os.getpid()}), 200
+
+@main_bp.route('/models/compare', methods=['PUT'])
+@admin_required
+def set_model_comparison():
+    """Set the candidate comparison: JSON with ``mode`` (off, shadow or ab)
+    and optionally ``fraction``."""
+    rejected = single_worker_required()
+    if rejected is not None:
+        return rejected
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request must be a JSON object.'}), 400
+
+    try:
+        require_models()
+        fraction = data.get('fraction')
+        registry = current_app.config['MODEL_REGISTRY']
+        registry.set_compare(data.get('mode', registry.mode), None if fraction is None else float(fraction))
+    except ModelsNotReadyError as e:
+        return models_not_ready_response(session.get('email', 'Unknown'), e)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    stats = registry.stats()
+    current_app.logger.info(
+        "Model comparison set to %s at %s by %s",
+        stats['compare_mode'], stats['compare_fraction'], session.get('email', 'Unknown')
+    )
+    return jsonify({**stats, 'pid': os.getpid()}), 200
+
+@main_bp.route('/predict/image/<token>')
+@login_required
+def processed_image(token):
+    # Tokens name files in the shared disk store, so only ours are looked up
+    store = current_app.config['PROCESSED_IMAGE_STORE']
+    image_bytes = store.get(token) if PROCESSED_IMAGE_TOKEN.fullmatch(token) else None
+    if image_bytes is None:
+        return jsonify({'error': 'Processed image not found or expired'}), 404
+
+    mime_type = 'image/webp' if image_bytes[:4] == b'RIFF' else 'image/jpeg'
+    response = Response(image_bytes, mimetype=mime_type)
+    response.headers['Cache-Control'] = 'private, max-age=600'
+    return response
+
+def read_prediction_input():
+    """Return (image bytes, mime type, error message) from a /predict body.
+
+    Binary uploads (multipart or raw bytes) skip base64 and JSON entirely;
+    JSON bodies carry a base64 data URL in ``image``.
+    """
+    if request.mimetype == 'multipart/form-data' or request.mimetype == 'application/octet-stream' \
+            or request.mimetype in current_app.config['ALLOWED_IMAGE_TYPES']:
+        image_data, mime_type = read_binary_image()
+        if not image_data:
+            return None, None, 'No image provided in the request.'
+        return image_data, mime_type, None
+
+    if request.is_json:
+        data = request.get_json()
+        if not data or 'image' not in data:
+            return None, None, 'No image provided in the request.'
+        mime_type, image_data = parse_data_url(data['image'])
+        return image_data, mime_type, None
+
+    return None, None, 'Content-Type must be application/json, multipart/form-data or application/octet-stream'
+
+def read_binary_image():
+    """Return (bytes, mime type) from a multipart ``image`` field or a raw
+    request body."""
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('image')
+        if upload is None:
+            return None, None
+        return upload.read(), upload.mimetype
+
+    mime_type = None if request.mimetype == 'application/octet-stream' else request.mimetype
+    return request.get_data(cache=False), mime_type
+
+def requested_image_format():
+    """The ``image_format`` query parameter (``jpeg``, ``webp``,
+    ``thumbnail`` or ``none``); ``image=none`` also means ``none``, so no
+    image is encoded at all."""
+    image_mode = request.args.get('image', 'inline')
+    image_format = request.args.get('image_format') or current_app.config['RESPONSE_IMAGE_FORMAT']
+    if image_mode == 'none':
+        return 'none'
+    if image_mode in ('bytes', 'url') and image_format == 'none':
+        raise ValueError(f"image={image_mode} needs an image_format other than none")
+    return image_format
+
+def prediction_response(predicted_class, cropped_image):
+    """Build the /predict response. The ``image`` query parameter selects how
+    the processed image is returned: ``inline`` (base64 data URL, default),
+    ``url`` (short-lived link), ``bytes`` (image body with the class in the
+    X-Predicted-Class header) or ``none``. ``cropped_image`` is None when
+    the request asked for no image."""
+    image_mode = request.args.get('image', 'inline')
+    body = {'predicted_class': predicted_class, 'status': 'success'}
+
+    if image_mode == 'bytes':
+        response = Response(data_url_to_bytes(cropped_image), mimetype=data_url_mime_type(cropped_image))
+        response.headers['X-Predicted-Class'] = predicted_class
+        return response, 200
+
+    if cropped_image is not None and image_mode == 'url':
+        token = secrets.token_urlsafe(16)
+        current_app.config['PROCESSED_IMAGE_STORE'].set(token, data_url_to_bytes(cropped_image))
+        body['cropped_image_url'] = url_for('main.processed_image', token=token)
+    elif cropped_image is not None and image_mode != 'none':
+        body['cropped_image'] = cropped_image
+
+    return jsonify(body), 200
+
+def metrics_authorized():
+    """A bearer token equal to METRICS_TOKEN, or a client address listed in
+    METRICS_ALLOWED_IPS."""
+    token = current_app.config['METRICS_TOKEN']
+    header = request.headers.get('Authorization', '')
+    if token and header.startswith('Bearer ') and secrets.compare_digest(header[len('Bearer '):], token):
+        return True
+    return request.remote_addr in current_app.config['METRICS_ALLOWED_IPS']
+
+@main_bp.route('/metrics')
+def metrics():
+    if not current_app.config['METRICS_ENABLED']:
+        return jsonify({'error': 'Metrics are disabled.'}), 404
+    if not metrics_authorized():
+        current_app.logger.warning(f"Unauthorized metrics scrape from {request.remote_addr}")
+        return jsonify({'error': 'Unauthorized'}), 401
+    body, content_type = render_metrics(current_app)
+    return Response(body, content_type=content_type)
+
 @main_bp.route('/health')
 def health_check():
     try:
@@ -78,7 +526,22 @@ def health_check():
         }
         
         # Check if models are loaded
-        if not current_app.config.get('ML_MODEL'):
+        loader = current_app.config['MODEL_LOADER']
+        if loader.state == 'pending':
+            # Lazy mode: models load on the first prediction
+            status['models'] = 'deferred'
+            return jsonify(status), 200
+        
+        if loader.state == 'warming':
+            status['status'] = 'warming'
+            return jsonify(status), 503
+        
+        if loader.state == 'failed':
+            status['status'] = 'unhealthy'
+            status['error'] = f'Model loading failed: {loader.error}'
+            return jsonify(status), 503
+        
+        if not current_app.config.get('ML_INFER'):
             status['status'] = 'unhealthy'
             status['error'] = 'ML model not loaded'
             return jsonify(status), 503
@@ -88,6 +551,52 @@ def health_check():
             status['error'] = 'u2net session not initialized'
             return jsonify(status), 503
         
+        status['startup_timings'] = {phase: round(seconds, 3) for phase, seconds in loader.timings.items()}
+        
+        client = current_app.config.get('INFERENCE_CLIENT')
+        if client is not None:
+            # The models live in the shared inference server; fail while it is down
+            try:
+                client.call('ping')
+            except (OSError, EOFError) as e:
+                status['status'] = 'unhealthy'
+                status['error'] = f'Inference server unreachable: {str(e)}'
+                return jsonify(status), 503
+        
+        registry = current_app.config.get('MODEL_REGISTRY')
+        if registry is not None:
+            stats = registry.stats()
+            status['model_versions'] = {
+                'active': stats['active'],
+                'candidate': stats['candidate'],
+                'compare_mode': stats['compare_mode'],
+                'agreement': stats['comparisons']['agreement'],
+            }
+        
+        predictor = current_app.config.get('BATCH_PREDICTOR')
+        if predictor is not None:
+            status['batching'] = predictor.stats()
+        
+        cache = current_app.config.get('RESULT_CACHE')
+        if cache is not None:
+            status['result_cache'] = cache.stats()
+        
+        pool = current_app.config.get('PREPROCESS_POOL')
+        if pool is not None:
+            status['preprocess_pool'] = pool.stats()
+        
+        job_queue = current_app.config.get('JOB_QUEUE')
+        if job_queue is not None:
+            status['job_queue'] = job_queue.stats()
+        
+        controller = current_app.config.get('ADMISSION_CONTROLLER')
+        if controller is not None:
+            status['admission'] = controller.stats()
+        
+        log_handler = current_app.extensions.get('log_queue_handler')
+        if log_handler is not None:
+            status['logging'] = {'queued': log_handler.queue.qsize(), 'dropped': log_handler.dropped}
+        
         return jsonify(status), 200
         
     except Exception as e:
@@ -1,75 +1,445 @@
 import os
+import time
 import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import tensorflow as tf
 from tensorflow.keras.applications.xception import preprocess_input
-from rembg.session_factory import new_session
 from huggingface_hub import hf_hub_download
+import numpy as np
 import onnxruntime as ort
-import os
 from dotenv import load_dotenv
+from app.models.sessions import (
+    OPENCV_BACKENDS, thread_policy, session_options, build_session_options, create_u2net_session, create_bg_session
+)
 
 load_dotenv() 
 
 # token = os.getenv("HF_TOKEN")
 
-def initialize_models(app):
+class ModelsNotReadyError(Exception):
+    """Raised when a prediction needs the models before they finished loading."""
+
+def initialize_models(app, timings=None):
+    """Load the u2net session and the classifier concurrently, then build the
+    inference callable. Per-phase durations are written to ``timings``."""
+    timings = {} if timings is None else timings
     try:
+        start = time.perf_counter()
 
-        # --------------------------------------------  BACKGROUND REMOVAL MODEL   --------------------------------------------
+        # Models already live in the shared inference server process
+        if app.config.get('INFERENCE_SERVER_ADDRESS'):
+            from app.services.inference_server import connect_inference_server
+            models = _timed(timings, 'inference_server', connect_inference_server, app)
+            timings['models_total'] = time.perf_counter() - start
+            return models
 
-        app.logger.info("Initializing u2net session...")
+        configure_tensorflow_threads(app)
 
-        # Cache directory for the model
-        cache_dir = os.path.expanduser("~/.u2net")
-        os.makedirs(cache_dir, exist_ok=True)
-        cached_model_path = os.path.join(cache_dir, "u2net.onnx")
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="model-load") as executor:
+            u2net_future = executor.submit(_timed, timings, 'u2net', load_u2net_session, app)
+            model_future = executor.submit(_timed, timings, 'classifier', load_classifier, app)
+            u2net_session = u2net_future.result()
+            model = model_future.result()
 
-        hf_token = os.environ.get("HF_TOKEN")
-        try:
-            # Try fetching the model from Hugging Face
-            hf_model_path = hf_hub_download(
-                repo_id=app.config['BG_REMOVAL_MODEL_REPO_ID'],
-                filename=app.config['BG_REMOVAL_MODEL_NAME'],
-                token=hf_token
-            )
-            shutil.copyfile(hf_model_path, cached_model_path)
+        infer = _timed(timings, 'inference_engine', build_inference_fn, app, model)
+        timings['models_total'] = time.perf_counter() - start
+        
+        return u2net_session, model, infer
+        
+    except Exception as e:
+        app.logger.error(f"Failed to initialize models: {str(e)}")
+        raise
+
+def configure_tensorflow_threads(app):
+    """Size TensorFlow's thread pools from the threading policy. Must run
+    before TensorFlow executes its first op; later calls are ignored."""
+    policy = thread_policy(app.config)
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(policy['tf_intra_op_threads'])
+        tf.config.threading.set_inter_op_parallelism_threads(policy['tf_inter_op_threads'])
+    except RuntimeError as e:
+        app.logger.warning(f"TensorFlow already initialized, keeping its thread pools: {str(e)}")
+        return
+
+    app.logger.info(
+        f"Thread policy - Cores: {policy['cores']}, Model processes: {policy['model_processes']}, "
+        f"TF intra/inter: {policy['tf_intra_op_threads']}/{policy['tf_inter_op_threads']}, "
+        f"ORT intra/inter: {policy['ort_intra_op_threads']}/{policy['ort_inter_op_threads']}"
+    )
+
+def _timed(timings, phase, fn, *args):
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        timings[phase] = time.perf_counter() - start
+
+def resolve_model_file(app, repo_id, filename):
+    """Return ``(path, source)`` for a model file: from LOCAL_MODEL_DIR when
+    present there (``local``), otherwise from the Hugging Face Hub, using
+    only its local cache when MODEL_OFFLINE is set (``hub``)."""
+    local_dir = app.config.get('LOCAL_MODEL_DIR')
+    if local_dir:
+        local_path = os.path.join(local_dir, filename)
+        if os.path.exists(local_path):
+            app.logger.info(f"Using local model file: {local_path}")
+            return local_path, 'local'
+        if app.config['MODEL_OFFLINE']:
+            app.logger.warning(f"{filename} not found in {local_dir}, trying the Hugging Face cache")
+
+    hub_path = hf_hub_download(
+        repo_id=repo_id,
+        filename=filename,
+        token=os.environ.get("HF_TOKEN"),
+        local_files_only=app.config['MODEL_OFFLINE']
+    )
+    return hub_path, 'hub'
+
+def file_checksum(path):
+    """SHA-256 of a file. Hugging Face stores LFS files as blobs named by
+    their SHA-256, so for those the name is used instead of rehashing."""
+    blob_name = os.path.basename(os.path.realpath(path))
+    if len(blob_name) == 64 and all(c in "0123456789abcdef" for c in blob_name):
+        return blob_name
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def copy_if_changed(app, source_path, target_path):
+    """Copy ``source_path`` to ``target_path`` unless the target already holds
+    the same content, tracked by a ``.sha256`` file next to the target."""
+    checksum = file_checksum(source_path)
+    checksum_path = f"{target_path}.sha256"
+
+    if os.path.exists(target_path) and os.path.exists(checksum_path):
+        with open(checksum_path) as f:
+            if f.read().strip() == checksum and os.path.getsize(target_path) == os.path.getsize(source_path):
+                app.logger.info(f"Cached model is up to date, skipping copy: {target_path}")
+                return
+
+    shutil.copyfile(source_path, target_path)
+    with open(checksum_path, "w") as f:
+        f.write(checksum)
+
+def quantized_model_path(config, filename, variant, extension):
+    """Where ``scripts/quantize_models.py`` writes the INT8 ``variant``
+    (``dynamic`` or ``static``) of a model file."""
+    base_name = os.path.splitext(filename)[0]
+    return os.path.join(config['QUANTIZED_MODEL_DIR'], f"{base_name}.int8-{variant}.{extension}")
+
+def load_quantized_u2net_session(app):
+    """Return the INT8 u2net session selected by U2NET_QUANTIZATION, or None
+    to use the float model."""
+    variant = app.config['U2NET_QUANTIZATION']
+    if variant == 'none':
+        return None
+
+    model_path = quantized_model_path(app.config, app.config['BG_REMOVAL_MODEL_NAME'], variant, 'onnx')
+    if not os.path.exists(model_path):
+        app.logger.warning(f"Quantized u2net not found at {model_path}, using the float model")
+        return None
+
+    u2net_session = create_u2net_session(model_path, session_options(app.config))
+    app.config['U2NET_MODEL_PATH'] = model_path
+    app.logger.info(f"u2net session initialized with {variant} INT8 model: {model_path}")
+    return u2net_session
+
+def load_bg_backend_session(app, backend):
+    """Session for a background removal backend other than u2net: the
+    smaller rembg models (from LOCAL_MODEL_DIR, otherwise rembg's own
+    download) or an OpenCV segmenter, which needs no model file."""
+    app.config['U2NET_MODEL_PATH'] = None
+
+    if backend in OPENCV_BACKENDS:
+        app.logger.info(f"Using OpenCV '{backend}' background removal")
+        return create_bg_session(backend, grabcut_iterations=app.config['BG_GRABCUT_ITERATIONS'])
+
+    app.logger.info(f"Initializing {backend} session...")
+    local_dir = app.config.get('LOCAL_MODEL_DIR')
+    model_path = os.path.join(local_dir, f"{backend}.onnx") if local_dir else None
+    if model_path and not os.path.exists(model_path):
+        model_path = None
+
+    u2net_session = create_bg_session(backend, model_path, session_options(app.config))
+    app.config['U2NET_MODEL_PATH'] = model_path
+    app.logger.info(f"{backend} session initialized" + (f" from {model_path}" if model_path else ""))
+    return u2net_session
+
+def load_u2net_session(app):
+
+    # --------------------------------------------  BACKGROUND REMOVAL MODEL   --------------------------------------------
+
+    backend = app.config['BG_REMOVAL_BACKEND']
+    if backend != 'u2net':
+        return load_bg_backend_session(app, backend)
+
+    app.logger.info("Initializing u2net session...")
+
+    u2net_session = load_quantized_u2net_session(app)
+    if u2net_session is not None:
+        return u2net_session
+
+    # Cache directory for the model
+    cache_dir = os.path.expanduser("~/.u2net")
+    os.makedirs(cache_dir, exist_ok=True)
+    cached_model_path = os.path.join(cache_dir, "u2net.onnx")
+
+    try:
+        # Try fetching the model from a local directory or Hugging Face
+        model_path, source = resolve_model_file(app, app.config['BG_REMOVAL_MODEL_REPO_ID'], app.config['BG_REMOVAL_MODEL_NAME'])
+        if source == 'hub':
+            copy_if_changed(app, model_path, cached_model_path)
+            model_path = cached_model_path
             app.logger.info(f"u2net model fetched from Hugging Face and cached at: {cached_model_path}")
-            
-            # Load ONNX session directly
-            u2net_session = new_session(model_path=cached_model_path)
+        
+        # Load ONNX session directly, with the configured SessionOptions
+        u2net_session = create_u2net_session(model_path, session_options(app.config))
+        app.config['U2NET_MODEL_PATH'] = model_path
+
+        app.logger.info("u2net session initialized with cached model")
+
+    except Exception as e:
+        if app.config['MODEL_OFFLINE']:
+            raise
+        # HF download failed, fallback to default automatic download
+        app.logger.warning(f"Failed to fetch u2net from Hugging Face: {str(e)}")
+        app.logger.info("Using default u2net model (will download automatically, slower startup)")
+        u2net_session = create_u2net_session(options=session_options(app.config))  # Default download inside rembg
+        app.config['U2NET_MODEL_PATH'] = None
+        app.logger.info("u2net session initialized with default model")
+
+    return u2net_session
+
+def load_classifier(app):
+
+    # -----------------------------------------------  CLASSIFICATION MODEL   -----------------------------------------------
+
+    app.logger.info("Loading milk adulterant detection model...")
+
+    model_path, _ = resolve_model_file(app, app.config['CLASSIFICATION_MODEL_REPO_ID'], app.config['CLASSIFICATION_MODEL_NAME'])
+    app.config['CLASSIFIER_MODEL_PATH'] = model_path
+
+    model = tf.keras.models.load_model(
+        model_path,
+        custom_objects={'preprocess_input': preprocess_input},
+        safe_mode=False
+    )
+
+    app.logger.info("Milk detection model loaded successfully")
+    return model
 
-            app.logger.info("u2net session initialized with HF cached model")
+class ModelLoader:
+    """Loads the models once, either on the calling thread's request
+    (``wait``) or in the background (``start``), and reports its state:
+    ``pending``, ``warming``, ``ready`` or ``failed``.
 
+    ``on_ready(app, u2net_session, model, infer)`` runs on the loading
+    thread once everything is loaded, before the state becomes ``ready``.
+    """
+
+    def __init__(self, app, on_ready=None):
+        self.app = app
+        self.on_ready = on_ready
+        self.state = 'pending'
+        self.error = None
+        self.timings = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self.state = 'warming'
+                self._thread = threading.Thread(target=self._load, name="model-loader", daemon=True)
+                self._thread.start()
+
+    def wait(self, timeout=None):
+        """Block until the models are loaded, starting the load if needed.
+        Raises ModelsNotReadyError on timeout or failure."""
+        if self.ready:
+            return
+        self.start()
+        if not self._done.wait(timeout):
+            raise ModelsNotReadyError("Models are still loading")
+        if self.state == 'failed':
+            raise ModelsNotReadyError(f"Model loading failed: {self.error}")
+
+    def _load(self):
+        try:
+            u2net_session, model, infer = initialize_models(self.app, self.timings)
+            if self.on_ready is not None:
+                self.on_ready(self.app, u2net_session, model, infer)
+            self.state = 'ready'
+            self.app.logger.info(
+                "Model loading completed - " +
+                ", ".join(f"{phase}: {seconds:.3f}s" for phase, seconds in self.timings.items())
+            )
         except Exception as e:
-            # HF download failed, fallback to default automatic download
-            app.logger.warning(f"Failed to fetch u2net from Hugging Face: {str(e)}")
-            app.logger.info("Using default u2net model (will download automatically, slower startup)")
-            u2net_session = new_session()  # Default download inside new_session
-            app.logger.info("u2net session initialized with default model")
-        
-        # -----------------------------------------------  CLASSIFICATION MODEL   -----------------------------------------------
-
-        app.logger.info("Loading milk adulterant detection model...")
-        # repo_id = "iamSubha16/milk_adulterant_detector_model_v7"
-        # filename = "milk_adulterant_detector_model_v7.keras"
-
-        token = os.environ.get("HF_TOKEN")
-        model_path = hf_hub_download(
-            repo_id=app.config['CLASSIFICATION_MODEL_REPO_ID'],
-            filename=app.config['CLASSIFICATION_MODEL_NAME'],
-            token=token
-        )
-
-        model = tf.keras.models.load_model(
-            model_path,
-            custom_objects={'preprocess_input': preprocess_input},
-            safe_mode=False
-        )
-
-        app.logger.info("Milk detection model loaded successfully")
-        
-        return u2net_session, model
-        
+            self.app.logger.exception("Model loading failed")
+            self.error = str(e)
+            self.state = 'failed'
+        finally:
+            self._done.set()
+
+def build_inference_fn(app, model):
+    """Return a callable mapping a float32 batch (N, H, W, 3) to model outputs.
+
+    The engine is chosen by ``INFERENCE_ENGINE``: ``keras`` uses
+    ``model.predict``, ``tf_function`` traces the model once with a fixed
+    input signature and ``onnx`` runs an exported graph in ONNX Runtime.
+    Non-Keras engines are checked against ``model.predict`` before use and
+    fall back to Keras if they disagree or fail to build.
+    """
+    engine = app.config['INFERENCE_ENGINE']
+
+    def keras_infer(batch):
+        return model.predict(batch, verbose=0)
+
+    if app.config['CLASSIFIER_QUANTIZATION'] != 'none':
+        infer = _build_tflite_infer(app)
+        if infer is not None:
+            return infer
+
+    if engine == 'keras':
+        app.logger.info("Using Keras model.predict inference engine")
+        return keras_infer
+
+    try:
+        if engine == 'tf_function':
+            infer = _build_tf_function_infer(app, model)
+        elif engine == 'onnx':
+            infer = _build_onnx_infer(app, model)
+        else:
+            raise ValueError(f"Unknown inference engine: {engine}")
+
+        if app.config['INFERENCE_PARITY_CHECK']:
+            check_inference_parity(app, model, infer)
+
+        app.logger.info(f"Using {engine} inference engine")
+        return infer
+
     except Exception as e:
-        app.logger.error(f"Failed to initialize models: {str(e)}")
-        raise
\ No newline at end of file
+        app.logger.warning(f"Inference engine '{engine}' unavailable, falling back to Keras: {str(e)}")
+        return keras_infer
+
+
+def _build_tf_function_infer(app, model):
+    height, width = app.config['MODEL_INPUT_SIZE']
+    signature = [tf.TensorSpec(shape=[None, height, width, 3], dtype=tf.float32, name="images")]
+
+    @tf.function(input_signature=signature)
+    def serve(images):
+        return model(images, training=False)
+
+    # Trace once up front so the first request does not pay for it
+    serve.get_concrete_function()
+
+    def infer(batch):
+        return serve(tf.convert_to_tensor(batch, dtype=tf.float32)).numpy()
+
+    return infer
+
+
+def _build_onnx_infer(app, model):
+    onnx_path = app.config.get('CLASSIFIER_ONNX_PATH')
+
+    if not onnx_path:
+        cache_dir = os.path.expanduser("~/.u2net")
+        os.makedirs(cache_dir, exist_ok=True)
+        base_name = os.path.splitext(app.config['CLASSIFICATION_MODEL_NAME'])[0]
+        # Keyed by content, so a republished file under the same name is re-exported
+        checksum = file_checksum(app.config['CLASSIFIER_MODEL_PATH'])
+        onnx_path = os.path.join(cache_dir, f"{base_name}.{checksum[:16]}.onnx")
+
+        if not os.path.exists(onnx_path):
+            app.logger.info(f"Exporting classifier to ONNX at: {onnx_path}")
+            height, width = app.config['MODEL_INPUT_SIZE']
+            # Requires tf2onnx; export errors are handled by the caller
+            model.export(
+                onnx_path,
+                format="onnx",
+                input_signature=[tf.TensorSpec(shape=[None, height, width, 3], dtype=tf.float32, name="images")]
+            )
+
+    options = session_options(app.config, intra_op_threads=thread_policy(app.config)['tf_intra_op_threads'])
+    session = ort.InferenceSession(onnx_path, sess_options=build_session_options(options), providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+
+    def infer(batch):
+        return session.run(None, {input_name: np.asarray(batch, dtype=np.float32)})[0]
+
+    return infer
+
+
+def _build_tflite_infer(app):
+    """INT8 TFLite classifier selected by CLASSIFIER_QUANTIZATION, or None
+    when it has not been exported. Quantized outputs are not expected to pass
+    the float parity check; their agreement with the float model is measured
+    by ``scripts/quantize_models.py`` instead."""
+    variant = app.config['CLASSIFIER_QUANTIZATION']
+    model_path = quantized_model_path(app.config, app.config['CLASSIFICATION_MODEL_NAME'], variant, 'tflite')
+    if not os.path.exists(model_path):
+        app.logger.warning(f"Quantized classifier not found at {model_path}, using the float model")
+        return None
+
+    interpreter = tf.lite.Interpreter(
+        model_path=model_path,
+        num_threads=thread_policy(app.config)['tf_intra_op_threads']
+    )
+    interpreter.allocate_tensors()
+    input_detail = interpreter.get_input_details()[0]
+    output_detail = interpreter.get_output_details()[0]
+    # The interpreter is not thread-safe and is exported for one image at a time
+    lock = threading.Lock()
+
+    def run_one(row):
+        if input_detail['dtype'] != np.float32:
+            scale, zero_point = input_detail['quantization']
+            row = np.round(row / scale + zero_point)
+        interpreter.set_tensor(input_detail['index'], row[np.newaxis].astype(input_detail['dtype']))
+        interpreter.invoke()
+        output = interpreter.get_tensor(output_detail['index'])[0]
+        if output_detail['dtype'] != np.float32:
+            scale, zero_point = output_detail['quantization']
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+    def infer(batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        with lock:
+            return np.stack([run_one(row) for row in batch])
+
+    app.logger.info(f"Using {variant} INT8 TFLite classifier: {model_path}")
+    return infer
+
+
+def check_inference_parity(app, model, infer, batch_size=4, seed=0):
+    """Compare ``infer`` against ``model.predict`` on random inputs.
+
+    Raises ValueError when the largest absolute difference exceeds
+    ``INFERENCE_PARITY_TOLERANCE``.
+    """
+    height, width = app.config['MODEL_INPUT_SIZE']
+    rng = np.random.default_rng(seed)
+    batch = rng.uniform(0, 255, size=(batch_size, height, width, 3)).astype(np.float32)
+
+    expected = np.asarray(model.predict(batch, verbose=0))
+    actual = np.asarray(infer(batch)).reshape(expected.shape)
+    max_diff = float(np.max(np.abs(expected - actual)))
+
+    tolerance = app.config['INFERENCE_PARITY_TOLERANCE']
+    if max_diff > tolerance:
+        raise ValueError(f"Parity check failed - Max abs diff: {max_diff:.6f} (tolerance {tolerance})")
+
+    app.logger.info(f"Inference parity check passed - Max abs diff: {max_diff:.6f}")
+    return max_diff
@@ -0,0 +1,423 @@
+"""Classifier versions, loaded and switched without downtime.
+
+The classifier loaded at startup becomes the first, ``active`` version.
+Further versions are loaded on a background thread while the active one
+keeps serving: the model is loaded, its inference engine built and then
+warmed up with MODEL_WARMUP_INFERENCES forward passes at batch size 1 and
+INFERENCE_MAX_BATCH_SIZE, so the first real request does not pay for
+graph tracing or memory allocation. A warm version is ``ready``.
+
+Activating a ready version is one assignment under the registry lock.
+Requests that started before it finish on the version they leased, which
+is ``draining`` until its last request returns and then ``retired``,
+dropping its model. A drain slower than MODEL_DRAIN_TIMEOUT_SECONDS is
+logged.
+
+While a ready version waits as the ``candidate``, MODEL_COMPARE_FRACTION of
+classifications are scored on both versions. In ``shadow`` mode the active
+version answers and the candidate runs afterwards on a background thread;
+in ``ab`` mode the candidate answers that fraction and the active version
+runs in the background. Either way the two outputs are compared and the
+agreement is counted, logged and reported by ``stats``. Comparisons never
+delay a response: when MODEL_COMPARE_MAX_PENDING are already queued, the
+comparison is skipped.
+
+Versions live in the worker process that loaded them, so /models only
+changes them when a single worker serves the app. To shadow a version in
+every worker, start the app with MODEL_CANDIDATE_NAME set.
+"""
+import os
+import time
+import random
+import threading
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app.services.metrics import MODEL_COMPARISONS, MODEL_VERSION_EVENTS
+
+COMPARE_MODES = ('off', 'shadow', 'ab')
+
+
+class ModelVersionNotFoundError(LookupError):
+    pass
+
+
+class ModelVersion:
+    """One classifier and its inference callables, with the number of
+    requests currently using it."""
+
+    def __init__(self, label, repo_id, filename):
+        self.label = label
+        self.repo_id = repo_id
+        self.filename = filename
+        self.state = 'loading'
+        self.error = None
+        self.model = None
+        self.infer = None
+        self.predictor = None
+        self.timings = {}
+        self.in_flight = 0
+        self.served = 0
+        self.created_at = time.time()
+        self.activated_at = None
+
+    def classify(self, img_array):
+        """Classifier output for one image array (H, W, C)."""
+        if self.predictor is not None:
+            return self.predictor.predict(img_array)[0]
+        return self.infer(img_array[np.newaxis])[0][0]
+
+    def classify_batch(self, batch):
+        return np.asarray(self.infer(batch))
+
+    def summary(self):
+        return {
+            'label': self.label,
+            'repo_id': self.repo_id,
+            'filename': self.filename,
+            'state': self.state,
+            'error': self.error,
+            'in_flight': self.in_flight,
+            'served': self.served,
+            'timings': {phase: round(seconds, 3) for phase, seconds in self.timings.items()},
+            'activated_at': self.activated_at,
+        }
+
+
+class ModelRegistry:
+    def __init__(self, app):
+        self.app = app
+        self.versions = {}
+        self.active = None
+        self.candidate = None
+        self.mode = app.config['MODEL_COMPARE_MODE']
+        self.fraction = app.config['MODEL_COMPARE_FRACTION']
+        if self.mode not in COMPARE_MODES:
+            raise ValueError(f"Unknown MODEL_COMPARE_MODE: {self.mode}")
+
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._compare_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-compare")
+        self._compare_slots = threading.BoundedSemaphore(app.config['MODEL_COMPARE_MAX_PENDING'])
+        self._comparisons = {'agree': 0, 'disagree': 0, 'error': 0, 'skipped': 0}
+        self._abs_diff_total = 0.0
+
+    # ------------------------------------------------------------------ versions
+
+    def register_initial(self, model, infer):
+        """Publish the classifier loaded at startup as the active version."""
+        config = self.app.config
+        filename = config['CLASSIFICATION_MODEL_NAME']
+        label = config.get('MODEL_VERSION_LABEL') or os.path.splitext(filename)[0]
+        version = ModelVersion(label, config['CLASSIFICATION_MODEL_REPO_ID'], filename)
+        version.model = model
+        version.infer = infer
+        version.predictor = self._build_predictor(infer)
+        with self._lock:
+            self.versions[label] = version
+            self._activate(version)
+        return version
+
+    def load(self, label, filename, repo_id=None, activate=False):
+        """Start loading a version in the background and return it. It
+        becomes the candidate once warm, or the active version when
+        ``activate`` is set. Raises ValueError for a duplicate label."""
+        if self.app.config.get('INFERENCE_SERVER_ADDRESS'):
+            raise ValueError("Model versions are fixed by the shared inference server")
+
+        repo_id = repo_id or self.app.config['CLASSIFICATION_MODEL_REPO_ID']
+        with self._lock:
+            existing = self.versions.get(label)
+            if existing is not None and existing.state not in ('failed', 'retired'):
+                raise ValueError(f"Model version already registered: {label}")
+            version = ModelVersion(label, repo_id, filename)
+            self.versions[label] = version
+
+        threading.Thread(
+            target=self._load_version, args=(version, activate), name=f"model-version-{label}", daemon=True
+        ).start()
+        self.app.logger.info(f"Loading model version {label} - {repo_id}/{filename}")
+        return version
+
+    def _load_version(self, version, activate):
+        from app.models.models import load_classifier, build_inference_fn, _timed
+
+        # The loaders read the model location from the config
+        view = SimpleNamespace(
+            config={
+                **self.app.config,
+                'CLASSIFICATION_MODEL_REPO_ID': version.repo_id,
+                'CLASSIFICATION_MODEL_NAME': version.filename,
+                # A pre-exported graph belongs to the initial model only
+                'CLASSIFIER_ONNX_PATH': None,
+            },
+            logger=self.app.logger,
+        )
+        try:
+            version.model = _timed(version.timings, 'classifier', load_classifier, view)
+            version.infer = _timed(version.timings, 'inference_engine', build_inference_fn, view, version.model)
+
+            version.state = 'warming'
+            _timed(version.timings, 'warmup', self._warm_up, version.infer)
+            version.predictor = self._build_predictor(version.infer)
+            if version.predictor is not None:
+                version.predictor.predict(np.zeros((*self.app.config['MODEL_INPUT_SIZE'], 3), dtype=np.float32))
+        except Exception as e:
+            version.state = 'failed'
+            version.error = str(e)
+            version.model = version.infer = None
+            MODEL_VERSION_EVENTS.labels(event='failed').inc()
+            self.app.logger.error(f"Model version {version.label} failed to load: {str(e)}")
+            return
+
+        with self._lock:
+            version.state = 'ready'
+            if activate:
+                self._activate(version)
+            else:
+                self.candidate = version
+        MODEL_VERSION_EVENTS.labels(event='loaded').inc()
+        self.app.logger.info(
+            f"Model version {version.label} ready - " +
+            ", ".join(f"{phase}: {seconds:.3f}s" for phase, seconds in version.timings.items())
+        )
+
+    def _warm_up(self, infer):
+        """Run MODEL_WARMUP_INFERENCES passes at batch size 1 and at the
+        largest batch, checking that the outputs are usable scores."""
+        config = self.app.config
+        height, width = config['MODEL_INPUT_SIZE']
+        rng = np.random.default_rng(0)
+        for batch_size in sorted({1, config['INFERENCE_MAX_BATCH_SIZE']}):
+            batch = rng.uniform(0, 255, size=(batch_size, height, width, 3)).astype(np.float32)
+            for _ in range(config['MODEL_WARMUP_INFERENCES']):
+                outputs = np.asarray(infer(batch))
+            if outputs.shape[0] != batch_size or not np.all(np.isfinite(outputs)):
+                raise ValueError(f"Warm-up produced unusable outputs of shape {outputs.shape}")
+
+    def _build_predictor(self, infer):
+        # With a shared inference server, batching happens there across workers
+        config = self.app.config
+        if not config['INFERENCE_BATCHING_ENABLED'] or config.get('INFERENCE_SERVER_ADDRESS'):
+            return None
+        from app.services.batching import BatchingPredictor
+        return BatchingPredictor(
+            infer,
+            max_batch_size=config['INFERENCE_MAX_BATCH_SIZE'],
+            max_wait_ms=config['INFERENCE_MAX_WAIT_MS'],
+            logger=self.app.logger
+        )
+
+    def activate(self, label):
+        """Make a ready version active. Requests already running finish on
+        the previous version, which is retired once they are done."""
+        with self._lock:
+            version = self._get(label)
+            if version is self.active:
+                return version
+            if version.state != 'ready':
+                raise ValueError(f"Model version {label} is {version.state}, not ready")
+            self._activate(version)
+        return version
+
+    def _activate(self, version):
+        # Called with the lock held
+        previous = self.active
+        self.active = version
+        version.state = 'active'
+        version.activated_at = time.time()
+        if self.candidate is version:
+            self.candidate = None
+
+        # Keep the flat config keys other services read (and the result
+        # cache's version tag) in step with the active version
+        config = self.app.config
+        config['ML_MODEL'] = version.model
+        config['ML_INFER'] = version.infer
+        config['BATCH_PREDICTOR'] = version.predictor
+        config['CLASSIFICATION_MODEL_REPO_ID'] = version.repo_id
+        config['CLASSIFICATION_MODEL_NAME'] = version.filename
+
+        MODEL_VERSION_EVENTS.labels(event='activated').inc()
+        self.app.logger.info(f"Model version {version.label} is now active")
+        if previous is not None:
+            previous.state = 'draining'
+            threading.Thread(
+                target=self._retire, args=(previous,), name=f"model-drain-{previous.label}", daemon=True
+            ).start()
+
+    def discard(self, label):
+        """Retire a version that is not active, e.g. a rejected candidate."""
+        with self._lock:
+            version = self._get(label)
+            if version is self.active:
+                raise ValueError(f"Model version {label} is active")
+            if self.candidate is version:
+                self.candidate = None
+            if version.state in ('ready', 'failed'):
+                version.state = 'draining'
+            elif version.state != 'draining':
+                raise ValueError(f"Model version {label} is {version.state}")
+        self._retire(version)
+        return version
+
+    def _retire(self, version):
+        # The model is only dropped once no request uses it; the timeout
+        # only decides when a slow drain is reported
+        deadline = time.monotonic() + self.app.config['MODEL_DRAIN_TIMEOUT_SECONDS']
+        warned = False
+        with self._lock:
+            while version.in_flight > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 and not warned:
+                    self.app.logger.warning(
+                        f"Model version {version.label} still has {version.in_flight} request(s) running "
+                        f"after {self.app.config['MODEL_DRAIN_TIMEOUT_SECONDS']}s, waiting for them"
+                    )
+                    warned = True
+                self._drained.wait(remaining if remaining > 0 else None)
+            if version.state != 'draining':
+                return
+            version.state = 'retired'
+            predictor = version.predictor
+            version.model = version.infer = version.predictor = None
+
+        if predictor is not None:
+            predictor.close()
+        MODEL_VERSION_EVENTS.labels(event='retired').inc()
+        self.app.logger.info(f"Model version {version.label} retired")
+
+    def _get(self, label):
+        version = self.versions.get(label)
+        if version is None:
+            raise ModelVersionNotFoundError(label)
+        return version
+
+    # ------------------------------------------------------------------ serving
+
+    def set_compare(self, mode, fraction=None):
+        if mode not in COMPARE_MODES:
+            raise ValueError(f"Unknown compare mode: {mode}")
+        if fraction is not None and not 0 <= fraction <= 1:
+            raise ValueError("Compare fraction must be between 0 and 1")
+        with self._lock:
+            self.mode = mode
+            if fraction is not None:
+                self.fraction = fraction
+
+    def _lease(self):
+        """Pick the version that answers and, for sampled requests, the one
+        scored alongside it. Both are counted in flight until released."""
+        with self._lock:
+            primary, secondary = self.active, None
+            candidate = self.candidate
+            if self.mode != 'off' and candidate is not None and random.random() < self.fraction:
+                if self.mode == 'ab':
+                    primary, secondary = candidate, self.active
+                else:
+                    secondary = candidate
+            primary.in_flight += 1
+            primary.served += 1
+            if secondary is not None:
+                secondary.in_flight += 1
+            return primary, secondary, primary is self.active
+
+    def _release(self, version):
+        with self._lock:
+            version.in_flight -= 1
+            if version.in_flight == 0:
+                self._drained.notify_all()
+
+    def classify(self, img_array):
+        """Classifier output for one image array, from the version the
+        request was routed to, and whether that was the active version.
+        Only answers of the active version may be cached: the result cache
+        key names the active version."""
+        primary, secondary, from_active = self._lease()
+        try:
+            output = primary.classify(img_array)
+        except Exception:
+            if secondary is not None:
+                self._release(secondary)
+            raise
+        finally:
+            self._release(primary)
+        if secondary is not None:
+            self._compare(primary, secondary, np.atleast_1d(output), secondary.classify, img_array)
+        return output, from_active
+
+    def classify_batch(self, batch):
+        """Outputs for a batch (N, H, W, 3), and whether the active version
+        produced them; the whole batch is sampled for comparison at once."""
+        primary, secondary, from_active = self._lease()
+        try:
+            outputs = primary.classify_batch(batch)
+        except Exception:
+            if secondary is not None:
+                self._release(secondary)
+            raise
+        finally:
+            self._release(primary)
+        if secondary is not None:
+            self._compare(primary, secondary, outputs[:, 0], secondary.classify_batch, batch)
+        return outputs, from_active
+
+    def _compare(self, primary, secondary, outputs, run, inputs):
+        if not self._compare_slots.acquire(blocking=False):
+            self._release(secondary)
+            self._record_comparison('skipped', len(outputs))
+            return
+        try:
+            self._compare_executor.submit(self._run_comparison, primary, secondary, outputs, run, inputs)
+        except Exception:
+            self._compare_slots.release()
+            self._release(secondary)
+            raise
+
+    def _run_comparison(self, primary, secondary, outputs, run, inputs):
+        try:
+            other = np.asarray(run(inputs), dtype=np.float32).reshape(len(outputs), -1)[:, 0]
+        except Exception as e:
+            self._record_comparison('error', len(outputs))
+            self.app.logger.warning(f"Comparison run on model version {secondary.label} failed: {str(e)}")
+            return
+        finally:
+            self._release(secondary)
+            self._compare_slots.release()
+
+        outputs = np.asarray(outputs, dtype=np.float32)
+        agree = (outputs > 0.5) == (other > 0.5)
+        diff = np.abs(outputs - other)
+        with self._lock:
+            self._abs_diff_total += float(diff.sum())
+        self._record_comparison('agree', int(agree.sum()))
+        self._record_comparison('disagree', int((~agree).sum()))
+        if not agree.all():
+            self.app.logger.info(
+                "Model versions disagree - %s: %s, %s: %s",
+                primary.label, np.round(outputs[~agree], 4).tolist(), secondary.label, np.round(other[~agree], 4).tolist()
+            )
+
+    def _record_comparison(self, result, count):
+        if count:
+            MODEL_COMPARISONS.labels(result=result).inc(count)
+            with self._lock:
+                self._comparisons[result] += count
+
+    def stats(self):
+        with self._lock:
+            compared = self._comparisons['agree'] + self._comparisons['disagree']
+            return {
+                'active': self.active.label if self.active else None,
+                'candidate': self.candidate.label if self.candidate else None,
+                'compare_mode': self.mode,
+                'compare_fraction': self.fraction,
+                'comparisons': {
+                    **self._comparisons,
+                    'agreement': round(self._comparisons['agree'] / compared, 4) if compared else None,
+                    'mean_abs_diff': round(self._abs_diff_total / compared, 6) if compared else None,
+                },
+                'versions': [version.summary() for version in self.versions.values()],
+            }
@@ -0,0 +1,196 @@
+import os
+import numpy as np
+import cv2
+import onnxruntime as ort
+from PIL import Image
+
+# Importable without TensorFlow, so preprocessing worker processes and the
+# inference server can build u2net sessions cheaply.
+
+# Background removal backends: rembg ONNX models, and classic OpenCV
+# segmentation for controlled capture setups (plain surface, sample centred)
+ONNX_BACKENDS = ('u2net', 'u2netp', 'silueta')
+OPENCV_BACKENDS = ('threshold', 'grabcut')
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+def thread_policy(config):
+    """Derive runtime thread counts from the cores available to each process
+    that runs models, so several gunicorn workers (and preprocessing pool
+    workers) do not oversubscribe the CPU. Explicit non-zero settings win."""
+    cores = config['CPU_CORES'] or os.cpu_count() or 1
+
+    # In shared mode only the inference server process runs the models
+    model_processes = 1 if config.get('INFERENCE_SERVER_MODE') == 'shared' else max(1, config['WEB_CONCURRENCY'])
+    cores_per_process = max(1, cores // model_processes)
+
+    # Each preprocessing pool worker holds its own u2net session
+    pool_workers = config['PREPROCESS_WORKERS']
+    u2net_cores = max(1, cores_per_process // pool_workers) if pool_workers > 0 else cores_per_process
+
+    return {
+        'cores': cores,
+        'model_processes': model_processes,
+        'cores_per_process': cores_per_process,
+        'ort_intra_op_threads': config['ORT_INTRA_OP_THREADS'] or u2net_cores,
+        'ort_inter_op_threads': config['ORT_INTER_OP_THREADS'] or 1,
+        'tf_intra_op_threads': config['TF_INTRA_OP_THREADS'] or cores_per_process,
+        'tf_inter_op_threads': config['TF_INTER_OP_THREADS'] or 1,
+    }
+
+def session_options(config, intra_op_threads=None):
+    """Picklable description of the ONNX Runtime SessionOptions to use."""
+    policy = thread_policy(config)
+    return {
+        'intra_op_num_threads': intra_op_threads or policy['ort_intra_op_threads'],
+        'inter_op_num_threads': policy['ort_inter_op_threads'],
+        'graph_optimization_level': config['ORT_GRAPH_OPTIMIZATION_LEVEL'],
+        'enable_cpu_mem_arena': config['ORT_ENABLE_CPU_MEM_ARENA'],
+        'enable_mem_pattern': config['ORT_ENABLE_MEM_PATTERN'],
+    }
+
+def build_session_options(options=None):
+    sess_opts = ort.SessionOptions()
+    if not options:
+        return sess_opts
+
+    sess_opts.intra_op_num_threads = options['intra_op_num_threads']
+    sess_opts.inter_op_num_threads = options['inter_op_num_threads']
+    sess_opts.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[options['graph_optimization_level']]
+    sess_opts.enable_cpu_mem_arena = options['enable_cpu_mem_arena']
+    sess_opts.enable_mem_pattern = options['enable_mem_pattern']
+    # Intra-op threads spin between ops by default; with several sessions per
+    # host that burns cores other processes need
+    sess_opts.add_session_config_entry("session.intra_op.allow_spinning", "0")
+    sess_opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    return sess_opts
+
+def create_u2net_session(model_path=None, options=None, model_name="u2net"):
+    """Build a rembg session with our SessionOptions.
+
+    ``rembg.new_session`` only honours OMP_NUM_THREADS, and its stock
+    ``u2net`` session ignores ``model_path``, so the session class is built
+    directly. An explicit file is loaded through rembg's ``u2net_custom``
+    session, which uses the same u2net pre/post-processing.
+    """
+    from rembg.sessions import sessions_class
+
+    if model_path:
+        model_name = "u2net_custom"
+
+    for session_class in sessions_class:
+        if session_class.name() == model_name:
+            break
+    else:
+        raise ValueError(f"Unknown rembg model: {model_name}")
+
+    kwargs = {'model_path': model_path} if model_path else {}
+    return session_class(model_name, build_session_options(options), **kwargs)
+
+class _OpenCVSession:
+    """Stands in for a rembg session: ``predict`` returns a single ``L``
+    mask the size of the input, so ``rembg.remove`` and the fast path
+    produce the same RGBA output as with u2net. Holds no native resources,
+    so it pickles cheaply into worker processes."""
+
+    # Segmentation runs on a copy no larger than this on its longer side
+    max_side = 320
+
+    def predict(self, img, *args, **kwargs):
+        rgb = np.asarray(img.convert("RGB"))
+        height, width = rgb.shape[:2]
+        scale = min(1.0, self.max_side / max(height, width))
+        if scale < 1.0:
+            rgb = cv2.resize(rgb, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+        mask = self.segment(rgb)
+        if mask.shape[:2] != (height, width):
+            mask = cv2.resize(mask, (width, height), interpolation=cv2.INTER_LINEAR)
+        return [Image.fromarray(mask, "L")]
+
+    def segment(self, rgb):
+        raise NotImplementedError
+
+    @staticmethod
+    def keep_center_component(mask):
+        """Keep the connected component nearest the image centre, with
+        holes filled."""
+        count, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        if count <= 1:
+            return mask
+
+        height, width = mask.shape
+        center = np.array([width / 2, height / 2])
+        label = labels[height // 2, width // 2]
+        if label == 0:
+            # Centre pixel is background: take the nearest sizeable component
+            sizes = stats[1:, cv2.CC_STAT_AREA]
+            candidates = np.flatnonzero(sizes >= 0.01 * height * width) + 1
+            if candidates.size == 0:
+                candidates = np.arange(1, count)
+            label = candidates[np.argmin(np.linalg.norm(centroids[candidates] - center, axis=1))]
+
+        component = np.where(labels == label, 255, 0).astype(np.uint8)
+        contours, _ = cv2.findContours(component, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        cv2.drawContours(component, contours, -1, 255, thickness=cv2.FILLED)
+        return component
+
+class ThresholdSession(_OpenCVSession):
+    """Otsu threshold on lightness. The class under the image centre is
+    taken as the sample, whichever side of the threshold it falls on."""
+
+    def segment(self, rgb):
+        lightness = cv2.cvtColor(rgb, cv2.COLOR_RGB2LAB)[:, :, 0]
+        lightness = cv2.GaussianBlur(lightness, (5, 5), 0)
+        _, mask = cv2.threshold(lightness, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+        height, width = mask.shape
+        center = mask[height * 2 // 5:height * 3 // 5, width * 2 // 5:width * 3 // 5]
+        if center.mean() < 128:
+            mask = cv2.bitwise_not(mask)
+
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+        return self.keep_center_component(mask)
+
+class GrabCutSession(_OpenCVSession):
+    """GrabCut seeded from the frame: the border is background, the centre
+    is foreground and everything in between is left for GrabCut to decide."""
+
+    def __init__(self, iterations=3):
+        self.iterations = iterations
+
+    def segment(self, rgb):
+        height, width = rgb.shape[:2]
+        mask = np.full((height, width), cv2.GC_PR_BGD, dtype=np.uint8)
+        border_y, border_x = max(1, height // 20), max(1, width // 20)
+        mask[:border_y, :] = cv2.GC_BGD
+        mask[-border_y:, :] = cv2.GC_BGD
+        mask[:, :border_x] = cv2.GC_BGD
+        mask[:, -border_x:] = cv2.GC_BGD
+        mask[height // 4:height * 3 // 4, width // 4:width * 3 // 4] = cv2.GC_PR_FGD
+        mask[height * 2 // 5:height * 3 // 5, width * 2 // 5:width * 3 // 5] = cv2.GC_FGD
+
+        bgd_model = np.zeros((1, 65), np.float64)
+        fgd_model = np.zeros((1, 65), np.float64)
+        cv2.grabCut(rgb[:, :, ::-1].copy(), mask, None, bgd_model, fgd_model, self.iterations, cv2.GC_INIT_WITH_MASK)
+
+        foreground = np.where((mask == cv2.GC_FGD) | (mask == cv2.GC_PR_FGD), 255, 0).astype(np.uint8)
+        return self.keep_center_component(foreground)
+
+def create_bg_session(backend, model_path=None, options=None, grabcut_iterations=3):
+    """Session for BG_REMOVAL_BACKEND. ONNX backends load ``model_path``
+    when given, otherwise rembg's own download of that model."""
+    if backend == 'threshold':
+        return ThresholdSession()
+    if backend == 'grabcut':
+        return GrabCutSession(grabcut_iterations)
+    if backend in ONNX_BACKENDS:
+        return create_u2net_session(model_path, options, model_name=backend)
+    raise ValueError(f"Unknown background removal backend: {backend}")
@@ -0,0 +1,404 @@
+"""Admission control for the prediction endpoints.
+
+/predict and /predict/batch are checked before their body is read, so a
+rejected upload is never buffered:
+
+1. Per-user token bucket: ADMISSION_USER_RATE requests per second with
+   bursts of ADMISSION_USER_BURST. An empty bucket answers 429, with
+   Retry-After set to when the next token arrives.
+2. Per-user concurrency: at most ADMISSION_USER_MAX_IN_FLIGHT requests of
+   one user run at once; more answer 429.
+3. Global concurrency: at most ADMISSION_MAX_IN_FLIGHT requests run at
+   once. Beyond that a request waits for a slot (up to ADMISSION_MAX_QUEUE
+   waiters), unless the estimated time to finish - its queue position times
+   the moving average service time, plus its own service time - exceeds the
+   client's deadline (the ``X-Request-Timeout`` header in seconds, default
+   ADMISSION_DEFAULT_TIMEOUT_SECONDS). Such requests answer 503 right away
+   instead of timing out after holding a connection.
+
+Live stream frames only take a slot (2 and 3, without the token bucket)
+once their stream lets them run, so frames dropped by the stream never
+hold one. Stream opens and /predict/async only spend a token: queued jobs
+are bounded by the job queue instead.
+
+Counters and buckets live in a store. The ``memory`` store limits each
+worker process on its own. The ``sqlite`` store shares them between every
+worker on the host; its in-flight leases expire after
+ADMISSION_LEASE_SECONDS so a crashed worker cannot hold slots forever.
+Another store (e.g. Redis, for several hosts) only needs ``take_token``,
+``acquire``, ``release`` and ``in_flight``.
+"""
+import os
+import math
+import time
+import uuid
+import sqlite3
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from collections import Counter
+
+from flask import current_app, request, session, jsonify
+
+from app.services.metrics import observe_stages, ADMISSION_DECISIONS
+
+GLOBAL_KEY = 'global'
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is not admitted. ``status`` is 429 for limits
+    of the user's own making and 503 for overload."""
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class MemoryAdmissionStore:
+    """Token buckets and in-flight counts for this process."""
+
+    backend = 'memory'
+    max_buckets = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> (tokens, updated_at)
+        self._in_flight = Counter()
+        self._leases = {}
+
+    def take_token(self, key, rate, burst):
+        """Take one token from ``key``'s bucket. Returns 0 when taken,
+        otherwise the seconds until one is available."""
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                waited = 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                waited = (1 - tokens) / rate
+            if len(self._buckets) > self.max_buckets:
+                self._prune(now, rate, burst)
+            return waited
+
+    def _prune(self, now, rate, burst):
+        # A bucket that has refilled is the same as a missing one
+        for key, (tokens, updated_at) in list(self._buckets.items()):
+            if tokens + (now - updated_at) * rate >= burst:
+                del self._buckets[key]
+
+    def acquire(self, limits, lease_seconds=None):
+        """Take one slot under every ``{key: limit}`` at once. Returns
+        ``(lease_id, None)``, or ``(None, key)`` for the first full key."""
+        with self._lock:
+            for key, limit in limits.items():
+                if self._in_flight[key] >= limit:
+                    return None, key
+            lease_id = uuid.uuid4().hex
+            for key in limits:
+                self._in_flight[key] += 1
+            self._leases[lease_id] = list(limits)
+            return lease_id, None
+
+    def release(self, lease_id):
+        with self._lock:
+            for key in self._leases.pop(lease_id, ()):
+                self._in_flight[key] -= 1
+                if not self._in_flight[key]:
+                    del self._in_flight[key]
+
+    def in_flight(self, key):
+        with self._lock:
+            return self._in_flight[key]
+
+
+class SQLiteAdmissionStore:
+    """Token buckets and in-flight leases in a SQLite file shared by every
+    gunicorn worker on the host."""
+
+    backend = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                " id TEXT NOT NULL, key TEXT NOT NULL, expires_at REAL NOT NULL, PRIMARY KEY (id, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS leases_key ON leases (key, expires_at)")
+
+    def _connect(self):
+        # One connection per thread (and per process after a fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take_token(self, key, rate, burst):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated_at = row if row is not None else (burst, now)
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                waited = 0.0
+            else:
+                waited = (1 - tokens) / rate
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)", (key, tokens, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return waited
+
+    def acquire(self, limits, lease_seconds=120):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM leases WHERE expires_at < ?", (now,))
+            for key, limit in limits.items():
+                if conn.execute("SELECT COUNT(*) FROM leases WHERE key = ?", (key,)).fetchone()[0] >= limit:
+                    conn.execute("COMMIT")
+                    return None, key
+            lease_id = uuid.uuid4().hex
+            conn.executemany(
+                "INSERT INTO leases (id, key, expires_at) VALUES (?, ?, ?)",
+                [(lease_id, key, now + lease_seconds) for key in limits]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return lease_id, None
+
+    def release(self, lease_id):
+        self._connect().execute("DELETE FROM leases WHERE id = ?", (lease_id,))
+
+    def in_flight(self, key):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM leases WHERE key = ? AND expires_at >= ?", (key, time.time())
+        ).fetchone()[0]
+
+
+class AdmissionController:
+    def __init__(self, store, max_in_flight=4, user_max_in_flight=2, user_rate=2.0, user_burst=10,
+                 max_queue=32, default_timeout=30.0, lease_seconds=120, poll_interval=0.05):
+        self.store = store
+        self.max_in_flight = int(max_in_flight)
+        self.user_max_in_flight = int(user_max_in_flight)
+        self.user_rate = float(user_rate)
+        self.user_burst = float(user_burst)
+        self.max_queue = int(max_queue)
+        self.default_timeout = float(default_timeout)
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+
+        self._condition = threading.Condition()
+        self._waiting = 0
+        self._service_time = None  # moving average, seconds
+        self._decisions = Counter()
+
+    def check_rate(self, user_id):
+        """Take a token from ``user_id``'s bucket. Raises AdmissionRejected
+        when it is empty."""
+        if self.user_rate > 0:
+            wait = self.store.take_token(f"rate:{user_id}", self.user_rate, self.user_burst)
+            if wait > 0:
+                self._reject(429, 'rate_limited', wait)
+
+    def admit(self, user_id, timeout=None, rate_limited=True):
+        """Return a lease id for a request of ``user_id`` that must finish
+        within ``timeout`` seconds, waiting for a global slot if needed.
+        Raises AdmissionRejected."""
+        start = time.monotonic()
+        timeout = self.default_timeout if timeout is None else timeout
+
+        if rate_limited:
+            self.check_rate(user_id)
+
+        user_key = f"user:{user_id}"
+        limits = {GLOBAL_KEY: self.max_in_flight, user_key: self.user_max_in_flight}
+        lease_id, full = self.store.acquire(limits, self.lease_seconds)
+        if lease_id is not None:
+            self._record('admitted')
+            return lease_id
+        if full == user_key:
+            self._reject(429, 'user_concurrency', self._service_time or 1)
+
+        with self._condition:
+            ahead = self._waiting
+            if ahead >= self.max_queue:
+                self._reject(503, 'queue_full', self.estimated_wait(ahead) or 1)
+            estimate = self.estimated_wait(ahead)
+            if estimate is not None and estimate + self._service_time > timeout:
+                self._reject(503, 'deadline', estimate)
+            self._waiting += 1
+
+        # Give up once there is no longer time to run the request
+        deadline = start + timeout - (self._service_time or 0)
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._reject(503, 'deadline', self.estimated_wait(self._waiting) or 1)
+                with self._condition:
+                    # Woken by a release in this process; other processes'
+                    # releases are seen on the next poll
+                    self._condition.wait(min(remaining, self.poll_interval))
+                lease_id, _ = self.store.acquire(limits, self.lease_seconds)
+                if lease_id is not None:
+                    self._record('queued')
+                    observe_stages({'admission_wait': time.monotonic() - start})
+                    return lease_id
+        finally:
+            with self._condition:
+                self._waiting -= 1
+
+    def release(self, lease_id, elapsed):
+        self.store.release(lease_id)
+        with self._condition:
+            self._service_time = elapsed if self._service_time is None else 0.8 * self._service_time + 0.2 * elapsed
+            self._condition.notify()
+
+    def estimated_wait(self, ahead):
+        """Seconds until a request with ``ahead`` waiters before it gets a
+        slot, or None before any request has finished."""
+        if self._service_time is None:
+            return None
+        return (ahead + 1) * self._service_time / self.max_in_flight
+
+    def _reject(self, status, reason, retry_after):
+        self._record(reason)
+        raise AdmissionRejected(status, reason, retry_after)
+
+    def _record(self, decision):
+        ADMISSION_DECISIONS.labels(decision=decision).inc()
+        with self._condition:
+            self._decisions[decision] += 1
+
+    def stats(self):
+        in_flight = self.store.in_flight(GLOBAL_KEY)
+        with self._condition:
+            return {
+                'backend': self.store.backend,
+                'in_flight': in_flight,
+                'max_in_flight': self.max_in_flight,
+                'waiting': self._waiting,
+                'max_queue': self.max_queue,
+                'service_time_seconds': None if self._service_time is None else round(self._service_time, 3),
+                'decisions': dict(self._decisions),
+            }
+
+
+def request_timeout():
+    """The client's deadline from ``X-Request-Timeout`` (seconds), if valid."""
+    try:
+        timeout = float(request.headers.get('X-Request-Timeout', ''))
+    except ValueError:
+        return None
+    return timeout if timeout > 0 else None
+
+
+@contextmanager
+def admitted(user_id, rate_limited=True):
+    """Hold an admission slot for ``user_id`` around a block. Raises
+    AdmissionRejected; does nothing when admission control is off."""
+    controller = current_app.config.get('ADMISSION_CONTROLLER')
+    if controller is None:
+        yield
+        return
+
+    lease_id = controller.admit(user_id, request_timeout(), rate_limited)
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        controller.release(lease_id, time.monotonic() - start)
+
+
+def admission_controlled(f):
+    """Admit the request before the view reads its body. Must come after
+    login_required."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            with admitted(session['user_id']):
+                return f(*args, **kwargs)
+        except AdmissionRejected as e:
+            return rejection_response(e)
+    return decorated_function
+
+
+def rate_limited(f):
+    """Only the per-user token bucket, for endpoints that queue work rather
+    than run it. Must come after login_required."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        controller = current_app.config.get('ADMISSION_CONTROLLER')
+        if controller is not None:
+            try:
+                controller.check_rate(session['user_id'])
+            except AdmissionRejected as e:
+                return rejection_response(e)
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def rejection_response(error):
+    current_app.logger.warning(
+        f"Request to {request.endpoint} from {session.get('email', 'Unknown')} not admitted: {error.reason}"
+    )
+    if error.status == 429:
+        message = 'Too many requests. Please slow down.'
+    else:
+        message = 'Server is busy. Please try again shortly.'
+    response = jsonify({'error': message, 'reason': error.reason})
+    response.headers['Retry-After'] = str(max(1, math.ceil(error.retry_after)))
+    # The unread upload is not drained; the connection is closed instead
+    response.headers['Connection'] = 'close'
+    return response, error.status
+
+
+def create_admission_controller(app):
+    backend = app.config['ADMISSION_BACKEND']
+    if backend == 'none':
+        return None
+    if backend == 'memory':
+        store = MemoryAdmissionStore()
+    elif backend == 'sqlite':
+        store = SQLiteAdmissionStore(app.config['ADMISSION_STORE_PATH'])
+    else:
+        raise ValueError(f"Unknown admission backend: {backend}")
+
+    controller = AdmissionController(
+        store,
+        max_in_flight=app.config['ADMISSION_MAX_IN_FLIGHT'],
+        user_max_in_flight=app.config['ADMISSION_USER_MAX_IN_FLIGHT'],
+        user_rate=app.config['ADMISSION_USER_RATE'],
+        user_burst=app.config['ADMISSION_USER_BURST'],
+        max_queue=app.config['ADMISSION_MAX_QUEUE'],
+        default_timeout=app.config['ADMISSION_DEFAULT_TIMEOUT_SECONDS'],
+        lease_seconds=app.config['ADMISSION_LEASE_SECONDS'],
+    )
+    app.logger.info(
+        f"Admission control enabled - Backend: {backend}, Max in flight: {controller.max_in_flight}, "
+        f"Per user: {controller.user_max_in_flight} in flight, {controller.user_rate}/s (burst {controller.user_burst:g})"
+    )
+    return controller
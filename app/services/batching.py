@@ -0,0 +1,153 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class BatchingPredictor:
+    """Collects single-image inference requests from concurrent request
+    threads and runs them through the model as one batched forward pass.
+
+    A batch is flushed when it reaches ``max_batch_size`` items or when the
+    oldest queued item has waited ``max_wait_ms`` milliseconds, whichever
+    comes first. Each caller gets back the row of the output that belongs
+    to its input.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=10.0, logger=None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+
+        self.predict_fn = predict_fn
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait = max(float(max_wait_ms), 0.0) / 1000.0
+        self.logger = logger
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+
+        self._batch_sizes = Counter()
+        self._batches = 0
+        self._requests = 0
+        self._busy_time = 0.0
+
+    def submit(self, img_array):
+        """Queue one preprocessed image array (H, W, C) and return a Future
+        that resolves to the model output row for that image. Raises
+        RuntimeError once the predictor is closed."""
+        if self._closed:
+            raise RuntimeError("BatchingPredictor is closed")
+        array = np.asarray(img_array, dtype=np.float32)
+        self._ensure_started()
+        future = Future()
+        # Checked under the lock, so nothing is queued behind close()'s sentinel
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("BatchingPredictor is closed")
+            self._queue.put((array, future))
+        return future
+
+    def predict(self, img_array, timeout=None):
+        return self.submit(img_array).result(timeout=timeout)
+
+    def close(self):
+        """Stop accepting requests and stop the worker thread once the
+        requests already queued are done."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+
+    def stats(self):
+        with self._lock:
+            batches = self._batches
+            requests = self._requests
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'batches': batches,
+                'requests': requests,
+                'mean_batch_size': round(requests / batches, 3) if batches else 0.0,
+                'batch_size_histogram': {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                'queue_depth': self._queue.qsize(),
+                'busy_seconds': round(self._busy_time, 3),
+            }
+
+    def _ensure_started(self):
+        # The worker thread is started lazily (and restarted after a fork) so
+        # a predictor created in a gunicorn master never hands a dead thread
+        # to its forked workers.
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                self._queue = queue.Queue()
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+            self._thread.start()
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size and batch[-1] is not None:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    # Window closed: still take whatever is already waiting
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            closing = batch[-1] is None
+            if closing:
+                batch.pop()
+            batch = [(array, future) for array, future in batch if future.set_running_or_notify_cancel()]
+            if batch:
+                self._process(batch)
+            if closing:
+                return
+
+    def _process(self, batch):
+        start = time.perf_counter()
+        try:
+            inputs = np.stack([array for array, _ in batch])
+            outputs = np.asarray(self.predict_fn(inputs))
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Batched inference failed for {len(batch)} request(s): {str(e)}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for i, (_, future) in enumerate(batch):
+            future.set_result(outputs[i])
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._batch_sizes[len(batch)] += 1
+            self._batches += 1
+            self._requests += len(batch)
+            self._busy_time += elapsed
+
+        if self.logger:
+            self.logger.debug("Batched inference - Size: %d - Duration: %.3fs", len(batch), elapsed)
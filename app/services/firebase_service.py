@@ -17,6 +17,8 @@ def initialize_firebase(app):
         creds_dict = json.loads(decoded)
         
         app.logger.info("Firebase credentials decoded successfully")
+        if not app.config.get('FIREBASE_PROJECT_ID'):
+            app.config['FIREBASE_PROJECT_ID'] = creds_dict.get('project_id')
         
         cred = credentials.Certificate(creds_dict)
         firebase_admin.initialize_app(cred)
@@ -0,0 +1,176 @@
+"""Dedicated inference process shared by every gunicorn worker.
+
+TensorFlow and ONNX Runtime thread pools do not survive ``fork``, so the
+models cannot be loaded in the gunicorn master and inherited by workers.
+Instead a single process started by ``gunicorn.conf.py`` holds the u2net
+session and the classifier, and workers reach it over a local Unix socket.
+The model weights are held in memory once per host instead of once per
+worker. Classification requests from all workers also share a single
+micro-batcher.
+"""
+import os
+import time
+import logging
+import threading
+from multiprocessing.connection import Listener, Client
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceServerError(Exception):
+    """Raised on the client when the inference server reports a failure."""
+
+
+def serve(address, authkey):
+    """Load the models and answer requests on ``address`` until killed."""
+    from flask import Flask
+    from app.config import Config
+    from app.utils.logging_config import setup_logging
+    from app.models.models import initialize_models
+    from app.services.batching import BatchingPredictor
+
+    app = Flask('app')
+    app.config.from_object(Config)
+    # This process owns the models; never point it back at itself
+    app.config['INFERENCE_SERVER_ADDRESS'] = None
+    setup_logging(app)
+
+    timings = {}
+    u2net_session, model, infer = initialize_models(app, timings)
+    predictor = BatchingPredictor(
+        infer,
+        max_batch_size=app.config['INFERENCE_MAX_BATCH_SIZE'],
+        max_wait_ms=app.config['INFERENCE_MAX_WAIT_MS'],
+        logger=app.logger
+    )
+    app.logger.info(
+        "Inference server ready - " +
+        ", ".join(f"{phase}: {seconds:.3f}s" for phase, seconds in timings.items())
+    )
+
+    def classify(batch):
+        futures = [predictor.submit(row) for row in batch]
+        return np.stack([future.result() for future in futures])
+
+    handlers = {
+        'ping': lambda: 'pong',
+        'classify': classify,
+        'u2net_predict': lambda img, args, kwargs: u2net_session.predict(img, *args, **kwargs),
+        'stats': predictor.stats,
+    }
+
+    if os.path.exists(address):
+        os.remove(address)
+    listener = Listener(address, family='AF_UNIX', authkey=authkey)
+    app.logger.info(f"Inference server listening on {address}")
+
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            app.logger.warning(f"Inference server rejected a connection: {str(e)}")
+            continue
+        threading.Thread(target=_handle_connection, args=(conn, handlers, app.logger), daemon=True).start()
+
+
+def _handle_connection(conn, handlers, log):
+    with conn:
+        while True:
+            try:
+                method, args = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                conn.send(('ok', handlers[method](*args)))
+            except Exception as e:
+                log.error(f"Inference server request '{method}' failed: {str(e)}")
+                conn.send(('error', str(e)))
+
+
+class InferenceClient:
+    """Client side of the inference server. Keeps one connection per thread
+    (and per process), reconnecting after a failure."""
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def call(self, method, *args):
+        try:
+            conn = self._connection()
+            conn.send((method, args))
+            status, value = conn.recv()
+        except (EOFError, OSError):
+            self._local.conn = None
+            raise
+        if status == 'error':
+            raise InferenceServerError(value)
+        return value
+
+    def wait_until_ready(self, timeout):
+        """Poll the server until it answers, for at most ``timeout`` seconds."""
+        deadline = time.time() + timeout
+        while True:
+            try:
+                return self.call('ping')
+            except (OSError, EOFError):
+                self._local.conn = None
+                if time.time() >= deadline:
+                    raise
+                time.sleep(0.5)
+
+    def classify(self, batch):
+        return self.call('classify', np.asarray(batch, dtype=np.float32))
+
+    def stats(self):
+        return self.call('stats')
+
+
+class RemoteU2netSession:
+    """Stands in for a rembg session: ``rembg.remove`` only calls
+    ``session.predict``, which is forwarded to the inference server."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def predict(self, img, *args, **kwargs):
+        return self.client.call('u2net_predict', img, args, kwargs)
+
+    def __getstate__(self):
+        # Connections are per process; pool workers reconnect on first use
+        return {'address': self.client.address, 'authkey': self.client.authkey}
+
+    def __setstate__(self, state):
+        self.client = InferenceClient(state['address'], state['authkey'])
+
+
+def connect_inference_server(app):
+    """Return ``(u2net_session, model, infer)`` backed by the inference server,
+    mirroring ``initialize_models``. ``model`` is None: the weights live in
+    the server process."""
+    address = app.config['INFERENCE_SERVER_ADDRESS']
+    client = InferenceClient(address, app.config['INFERENCE_SERVER_AUTHKEY'].encode('utf-8'))
+
+    app.logger.info(f"Connecting to inference server at {address}...")
+    client.wait_until_ready(app.config['INFERENCE_SERVER_CONNECT_TIMEOUT'])
+    app.logger.info("Connected to inference server")
+
+    app.config['INFERENCE_CLIENT'] = client
+
+    # OpenCV backends are cheaper to run locally than to forward
+    from app.models.sessions import OPENCV_BACKENDS, create_bg_session
+    backend = app.config['BG_REMOVAL_BACKEND']
+    if backend in OPENCV_BACKENDS:
+        return create_bg_session(backend, grabcut_iterations=app.config['BG_GRABCUT_ITERATIONS']), None, client.classify
+    return RemoteU2netSession(client), None, client.classify
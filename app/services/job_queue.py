@@ -0,0 +1,374 @@
+import os
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import threading
+import logging
+import traceback
+from collections import deque
+
+from app.services.metrics import record_error
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue already holds its maximum number of jobs."""
+
+
+def _public_job(job):
+    """Job fields safe to return to clients (no image payload)."""
+    now = time.time()
+    public = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'created_at': job['created_at'],
+        'age_seconds': round(now - job['created_at'], 3),
+    }
+    if job.get('started_at'):
+        public['wait_seconds'] = round(job['started_at'] - job['created_at'], 3)
+    if job['status'] == DONE:
+        public['result'] = job['result']
+    elif job['status'] == FAILED:
+        public['error'] = job['error']
+    return public
+
+
+class MemoryJobQueue:
+    """In-process job queue. Jobs are only visible to the worker process that
+    accepted them, so clients must poll the same process (single gunicorn
+    worker, or sticky routing)."""
+
+    backend = 'memory'
+
+    def __init__(self, max_depth=100, result_ttl=600):
+        self.max_depth = max_depth
+        self.result_ttl = result_ttl
+        self._jobs = {}
+        self._pending = queue.Queue()
+        self._cond = threading.Condition()
+        self._waits = deque(maxlen=200)
+
+    def enqueue(self, image_data, mime_type=None, owner=None):
+        with self._cond:
+            self._expire()
+            if self._pending.qsize() >= self.max_depth:
+                raise QueueFullError(f"Job queue is full ({self.max_depth} jobs)")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'id': job_id, 'status': QUEUED, 'owner': owner,
+                'image_data': image_data, 'mime_type': mime_type,
+                'result': None, 'error': None,
+                'created_at': time.time(), 'started_at': None, 'finished_at': None,
+            }
+            # Inside the lock, so concurrent enqueues cannot pass max_depth
+            self._pending.put(job_id)
+        return job_id
+
+    def claim(self, timeout=1.0):
+        try:
+            job_id = self._pending.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job['status'] = RUNNING
+            job['started_at'] = time.time()
+            self._waits.append(job['started_at'] - job['created_at'])
+            return dict(job)
+
+    def complete(self, job_id, result):
+        self._finish(job_id, DONE, result=result)
+
+    def fail(self, job_id, error):
+        self._finish(job_id, FAILED, error=error)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(status=status, result=result, error=error, finished_at=time.time(), image_data=None)
+            self._cond.notify_all()
+
+    def get(self, job_id, owner=None, wait=0):
+        deadline = time.time() + wait
+        with self._cond:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or (owner is not None and job['owner'] != owner):
+                    return None
+                remaining = deadline - time.time()
+                if job['status'] in (DONE, FAILED) or remaining <= 0:
+                    return _public_job(job)
+                self._cond.wait(remaining)
+
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['finished_at'] and job['finished_at'] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self):
+        with self._cond:
+            now = time.time()
+            queued = [job for job in self._jobs.values() if job['status'] == QUEUED]
+            waits = list(self._waits)
+            return {
+                'backend': self.backend,
+                'depth': len(queued),
+                'running': sum(1 for job in self._jobs.values() if job['status'] == RUNNING),
+                'oldest_queued_age_seconds': round(max((now - job['created_at'] for job in queued), default=0.0), 3),
+                'mean_wait_seconds': round(sum(waits) / len(waits), 3) if waits else 0.0,
+                'max_wait_seconds': round(max(waits), 3) if waits else 0.0,
+                'max_depth': self.max_depth,
+            }
+
+
+class SQLiteJobQueue:
+    """Job queue in a local SQLite file shared by every gunicorn worker on
+    the host. Any worker may accept, run or report a job. The same
+    enqueue/claim/complete/fail/get/stats interface can be backed by Redis
+    for multi-host deployments.
+
+    A job still running after ``running_timeout`` seconds is taken to be
+    lost with its worker (a crash, or gunicorn recycling it) and is queued
+    again, up to ``max_attempts`` runs in total; after that it fails."""
+
+    backend = 'sqlite'
+
+    def __init__(self, path, max_depth=100, result_ttl=600, poll_interval=0.05, running_timeout=300, max_attempts=2):
+        self.path = path
+        self.max_depth = max_depth
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.running_timeout = running_timeout
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, status TEXT NOT NULL, owner TEXT,"
+                " image_data BLOB, mime_type TEXT, result TEXT, error TEXT,"
+                " created_at REAL NOT NULL, started_at REAL, finished_at REAL,"
+                " attempts INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+
+    def _connect(self):
+        # One connection per thread (and per process after a fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def enqueue(self, image_data, mime_type=None, owner=None):
+        conn = self._connect()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (now - self.result_ttl,))
+            depth = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+            if depth >= self.max_depth:
+                raise QueueFullError(f"Job queue is full ({self.max_depth} jobs)")
+            conn.execute(
+                "INSERT INTO jobs (id, status, owner, image_data, mime_type, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, owner, sqlite3.Binary(image_data), mime_type, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return job_id
+
+    def claim(self, timeout=1.0):
+        conn = self._connect()
+        deadline = time.time() + timeout
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._recover_stale(conn)
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    started_at = time.time()
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                        (RUNNING, started_at, row['id'])
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+            if row is not None:
+                job = dict(row)
+                job.update(status=RUNNING, started_at=started_at, attempts=job['attempts'] + 1)
+                return job
+            if time.time() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def _recover_stale(self, conn):
+        # Called inside claim's transaction
+        now = time.time()
+        cutoff = now - self.running_timeout
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ?, image_data = NULL"
+            " WHERE status = ? AND started_at < ? AND attempts >= ?",
+            (FAILED, 'The job was interrupted. Please try again.', now, RUNNING, cutoff, self.max_attempts)
+        )
+        requeued = conn.execute(
+            "UPDATE jobs SET status = ?, started_at = NULL WHERE status = ? AND started_at < ?",
+            (QUEUED, RUNNING, cutoff)
+        ).rowcount
+        if requeued:
+            logger.warning(f"Requeued {requeued} job(s) running for more than {self.running_timeout}s")
+
+    def complete(self, job_id, result):
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, finished_at = ?, image_data = NULL WHERE id = ?",
+            (DONE, json.dumps(result), time.time(), job_id)
+        )
+
+    def fail(self, job_id, error):
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ?, image_data = NULL WHERE id = ?",
+            (FAILED, error, time.time(), job_id)
+        )
+
+    def get(self, job_id, owner=None, wait=0):
+        conn = self._connect()
+        deadline = time.time() + wait
+        while True:
+            row = conn.execute(
+                "SELECT id, status, owner, result, error, created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+            if row is None or (owner is not None and row['owner'] != owner):
+                return None
+            job = dict(row)
+            if job['result'] is not None:
+                job['result'] = json.loads(job['result'])
+            if job['status'] in (DONE, FAILED) or time.time() >= deadline:
+                return _public_job(job)
+            time.sleep(self.poll_interval * 4)
+
+    def stats(self):
+        conn = self._connect()
+        now = time.time()
+        depth, oldest = conn.execute(
+            "SELECT COUNT(*), MIN(created_at) FROM jobs WHERE status = ?", (QUEUED,)
+        ).fetchone()
+        running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (RUNNING,)).fetchone()[0]
+        mean_wait, max_wait = conn.execute(
+            "SELECT AVG(started_at - created_at), MAX(started_at - created_at) FROM"
+            " (SELECT started_at, created_at FROM jobs WHERE started_at IS NOT NULL ORDER BY started_at DESC LIMIT 200)"
+        ).fetchone()
+        return {
+            'backend': self.backend,
+            'depth': depth,
+            'running': running,
+            'oldest_queued_age_seconds': round(now - oldest, 3) if oldest else 0.0,
+            'mean_wait_seconds': round(mean_wait or 0.0, 3),
+            'max_wait_seconds': round(max_wait or 0.0, 3),
+            'max_depth': self.max_depth,
+        }
+
+
+class JobWorkers:
+    """Threads that drain the job queue by running ``predict_fn`` inside an
+    app context. Started lazily, and again after a fork."""
+
+    def __init__(self, app, job_queue, predict_fn, workers=2):
+        self.app = app
+        self.job_queue = job_queue
+        self.predict_fn = predict_fn
+        self.workers = workers
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._threads = [
+                threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._pid = pid
+
+    def _run(self):
+        while True:
+            try:
+                job = self.job_queue.claim(timeout=1.0)
+            except Exception as e:
+                self.app.logger.error(f"Job queue claim failed: {str(e)}")
+                time.sleep(1.0)
+                continue
+            if job is None:
+                continue
+
+            with self.app.app_context():
+                try:
+                    predicted_class, cropped_image = self.predict_fn(job['image_data'], job['mime_type'])
+                    self.job_queue.complete(job['id'], {'predicted_class': predicted_class, 'cropped_image': cropped_image})
+                    self.app.logger.info(
+                        "Job %s completed - Class: %s - Wait: %.3fs, Age: %.3fs",
+                        job['id'], predicted_class, job['started_at'] - job['created_at'], time.time() - job['created_at']
+                    )
+                except ValueError as e:
+                    record_error('validation')
+                    self.job_queue.fail(job['id'], f'Validation error: {str(e)}')
+                except Exception as e:
+                    record_error('internal')
+                    self.app.logger.error(f"Job {job['id']} failed: {str(e)}")
+                    self.app.logger.error(traceback.format_exc())
+                    self.job_queue.fail(job['id'], 'An error occurred during prediction.')
+
+
+def create_job_queue(app):
+    backend = app.config['JOB_QUEUE_BACKEND']
+    max_depth = app.config['JOB_QUEUE_MAX_DEPTH']
+    result_ttl = app.config['JOB_RESULT_TTL_SECONDS']
+
+    if backend == 'none':
+        return None
+    if backend == 'memory':
+        job_queue = MemoryJobQueue(max_depth, result_ttl)
+    elif backend == 'sqlite':
+        job_queue = SQLiteJobQueue(
+            app.config['JOB_QUEUE_PATH'], max_depth, result_ttl,
+            running_timeout=app.config['JOB_RUNNING_TIMEOUT_SECONDS'],
+            max_attempts=app.config['JOB_MAX_ATTEMPTS']
+        )
+    else:
+        raise ValueError(f"Unknown job queue backend: {backend}")
+
+    app.logger.info(f"Async job queue enabled - Backend: {backend}, Workers: {app.config['JOB_WORKERS']}")
+    return job_queue
@@ -0,0 +1,140 @@
+"""Prometheus metrics, served at /metrics.
+
+Under gunicorn, ``gunicorn.conf.py`` sets PROMETHEUS_MULTIPROC_DIR before any
+worker starts. prometheus_client then keeps every worker's values in files
+there, and /metrics aggregates all workers no matter which one answers the
+scrape. Without it (``flask run``, a single process) the default registry
+is used.
+"""
+import os
+import time
+from flask import request, g
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+# Seconds; covers JPEG header parsing (~1ms) up to slow u2net calls on large frames
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HTTP_REQUESTS = Counter(
+    'imageo_http_requests_total', 'HTTP requests by endpoint and status',
+    ['method', 'endpoint', 'status']
+)
+HTTP_REQUEST_DURATION = Histogram(
+    'imageo_http_request_duration_seconds', 'HTTP request latency by endpoint',
+    ['endpoint'], buckets=LATENCY_BUCKETS
+)
+HTTP_IN_FLIGHT = Gauge(
+    'imageo_http_requests_in_flight', 'Requests currently being handled',
+    multiprocess_mode='livesum'
+)
+STAGE_DURATION = Histogram(
+    'imageo_pipeline_stage_duration_seconds',
+    'Prediction pipeline latency by stage (decode, background_removal, each preprocessing step, inference, encoding)',
+    ['stage'], buckets=LATENCY_BUCKETS
+)
+PREDICTIONS = Counter('imageo_predictions_total', 'Completed predictions by class', ['predicted_class'])
+PREDICTION_ERRORS = Counter('imageo_prediction_errors_total', 'Failed or rejected predictions by type', ['type'])
+RESULT_CACHE_LOOKUPS = Counter('imageo_result_cache_lookups_total', 'Result cache lookups by result', ['result'])
+QUEUE_DEPTH = Gauge(
+    'imageo_queue_depth', 'Work waiting in a queue: jobs, preprocessing pool, inference batcher',
+    ['queue'], multiprocess_mode='livemax'
+)
+PREPROCESS_POOL_IN_FLIGHT = Gauge(
+    'imageo_preprocess_pool_in_flight', 'Jobs queued or running in the preprocessing pools',
+    multiprocess_mode='livesum'
+)
+
+AUTH_VERIFICATION_DURATION = Histogram(
+    'imageo_auth_verification_duration_seconds', 'Local Firebase token verification latency',
+    ['kind', 'result'], buckets=LATENCY_BUCKETS
+)
+AUTH_KEY_FETCHES = Counter('imageo_auth_key_fetches_total', 'Firebase public key downloads by key set', ['key_set'])
+STREAM_FRAMES = Counter(
+    'imageo_stream_frames_total', 'Live stream frames: mask_computed, mask_reused or dropped', ['outcome']
+)
+ADMISSION_DECISIONS = Counter(
+    'imageo_admission_decisions_total',
+    'Admission decisions: admitted, queued, rate_limited, user_concurrency, queue_full, deadline', ['decision']
+)
+MODEL_VERSION_EVENTS = Counter(
+    'imageo_model_version_events_total', 'Model version lifecycle: loaded, failed, activated, retired', ['event']
+)
+MODEL_COMPARISONS = Counter(
+    'imageo_model_comparisons_total', 'Images scored on two model versions: agree, disagree, error, skipped',
+    ['result']
+)
+
+
+def observe_stages(timings):
+    """Record a ``{stage: seconds}`` dict from the pipeline."""
+    for stage, seconds in timings.items():
+        STAGE_DURATION.labels(stage=stage).observe(seconds)
+
+
+def record_error(error_type):
+    PREDICTION_ERRORS.labels(type=error_type).inc()
+
+
+def refresh_gauges(app):
+    """Sample queue depths from this process's services. Called after each
+    request and on every scrape."""
+    job_queue = app.config.get('JOB_QUEUE')
+    if job_queue is not None and job_queue.backend == 'memory':
+        QUEUE_DEPTH.labels(queue='jobs').set(job_queue.stats()['depth'])
+
+    pool = app.config.get('PREPROCESS_POOL')
+    if pool is not None:
+        stats = pool.stats()
+        PREPROCESS_POOL_IN_FLIGHT.set(stats['in_flight'])
+        QUEUE_DEPTH.labels(queue='preprocess_pool').set(max(0, stats['in_flight'] - stats['workers']))
+
+    predictor = app.config.get('BATCH_PREDICTOR')
+    if predictor is not None:
+        QUEUE_DEPTH.labels(queue='inference_batcher').set(predictor.stats()['queue_depth'])
+
+    controller = app.config.get('ADMISSION_CONTROLLER')
+    if controller is not None:
+        QUEUE_DEPTH.labels(queue='admission').set(controller.stats()['waiting'])
+
+
+def render_metrics(app):
+    """Return ``(body, content_type)`` for a scrape."""
+    refresh_gauges(app)
+
+    # Shared backends report the same depth from every worker, so only the
+    # scraping worker reads them
+    job_queue = app.config.get('JOB_QUEUE')
+    if job_queue is not None and job_queue.backend != 'memory':
+        QUEUE_DEPTH.labels(queue='jobs').set(job_queue.stats()['depth'])
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def init_metrics(app):
+    """Count requests, their latency and how many are in flight."""
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+
+    @app.after_request
+    def record_request_metrics(response):
+        # The URL rule, not the path, keeps job ids and tokens out of the labels
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_REQUESTS.labels(method=request.method, endpoint=endpoint, status=str(response.status_code)).inc()
+        if hasattr(g, 'metrics_start'):
+            HTTP_REQUEST_DURATION.labels(endpoint=endpoint).observe(time.perf_counter() - g.metrics_start)
+        refresh_gauges(app)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(_error):
+        if g.pop('metrics_start', None) is not None:
+            HTTP_IN_FLIGHT.dec()
@@ -1,54 +1,350 @@
 import time
+import json
 import base64
+import numpy as np
 import tensorflow as tf
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from io import BytesIO
+from PIL import Image
 from flask import current_app
-from app.services.image_processing import preprocess_image_from_base64
+from app.services.image_processing import pipeline_options, preprocess_image, preprocess_image_bytes
+from app.services.result_cache import build_cache_key
+from app.services.preprocess_pool import PoolSaturatedError
+from app.services.metrics import observe_stages, PREDICTIONS, RESULT_CACHE_LOOKUPS
+from app.utils.validators import parse_data_url, load_image_bytes
+
+# Processed image returned with a prediction; 'none' skips encoding
+RESPONSE_IMAGE_FORMATS = ('jpeg', 'webp', 'thumbnail', 'none')
+DEFAULT_ENCODING = {'format': 'JPEG', 'mime_type': 'image/jpeg', 'quality': 85, 'max_side': None}
 
 def predict_from_base64(base64_str):
+    """Predict from a ``data:image/...;base64,`` URL sent as JSON."""
+    mime_type, image_data = parse_data_url(base64_str)
+    return predict_from_bytes(image_data, mime_type)
+
+def predict_from_bytes(image_data, mime_type=None, image_format=None):
+    """Predict from raw image bytes. Validation only reads the image header;
+    the pixels are decoded exactly once, in the preprocessing pipeline.
+
+    ``image_format`` picks the returned image (see RESPONSE_IMAGE_FORMATS,
+    default RESPONSE_IMAGE_FORMAT). It is encoded on a separate thread while
+    the classifier runs. Returns ``(class, data URL or None)``."""
+    require_models()
+    image_format = image_format or current_app.config['RESPONSE_IMAGE_FORMAT']
+    encoding = response_image_options(current_app.config, image_format)
     try:
         start_time = time.time()
         
+        # Validate input
+        image, error_msg = load_image_bytes(image_data, mime_type)
+        if image is None:
+            raise ValueError(error_msg)
+        validation_time = time.time() - start_time
+        
+        # Serve repeated submissions of the same capture from the cache
+        cache = current_app.config.get('RESULT_CACHE')
+        cache_key = None
+        if cache is not None:
+            cache_key = build_cache_key(image_data, current_app.config, image_format)
+            cached = _cache_get(cache, cache_key)
+            RESULT_CACHE_LOOKUPS.labels(result='miss' if cached is None else 'hit').inc()
+            if cached is not None:
+                current_app.logger.info(
+                    "Prediction served from cache - Class: %s - Total: %.3fs",
+                    cached['predicted_class'], time.time() - start_time
+                )
+                return cached['predicted_class'], cached['cropped_image']
+        
         # Preprocess the image
-        processed_img = preprocess_image_from_base64(base64_str)
+        stages = {'validation': validation_time}
+        processed_img = preprocess_image_data(image_data, image, timings=stages)
         preprocessing_time = time.time() - start_time
         
-        # Prepare for prediction
-        prediction_start = time.time()
-        img_array = tf.keras.preprocessing.image.img_to_array(processed_img)
-        img_array = tf.expand_dims(img_array, 0)
-
+        # Encode the response image while the classifier runs
+        encode_future = None
+        if encoding is not None:
+            encode_future = _get_thread_executor(
+                current_app.config['RESPONSE_ENCODE_THREADS'], 'encode'
+            ).submit(_encode_timed, processed_img, encoding)
+        
         # Perform prediction
-        model = current_app.config['ML_MODEL']
-        prediction = model.predict(img_array, verbose=0)[0][0]
-        class_index = 1 if prediction > 0.5 else 0
-        predicted_class = current_app.config['CLASS_NAMES'][class_index]
+        prediction_start = time.time()
+        prediction, cacheable = classify(processed_img)
+        predicted_class = class_name(prediction)
         
         prediction_time = time.time() - prediction_start
 
-        # Encode processed image back to base64
-        encoding_start = time.time()
-        buffered = BytesIO()
-        processed_img.save(buffered, format="JPEG", quality=85, optimize=True)
-        cropped_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-        cropped_base64 = f"data:image/jpeg;base64,{cropped_base64}"
-        encoding_time = time.time() - encoding_start
+        # Usually already done; only encoding that outlasted inference adds latency
+        cropped_base64, encoding_time, encoding_wait = None, 0.0, 0.0
+        if encode_future is not None:
+            wait_start = time.time()
+            cropped_base64, encoding_time = encode_future.result()
+            encoding_wait = time.time() - wait_start
         
         total_time = time.time() - start_time
         
+        # Stages inside preprocessing were recorded where they ran
+        request_stages = {
+            'validation': validation_time,
+            'preprocessing': preprocessing_time,
+            'inference': prediction_time,
+            'encoding': encoding_time,
+            'encoding_wait': encoding_wait,
+            'total': total_time,
+        }
+        observe_stages(request_stages)
+        PREDICTIONS.labels(predicted_class=predicted_class).inc()
+        stages.update(request_stages)
+        
         # Log performance metrics
         current_app.logger.info(
-            f"Prediction completed - Class: {predicted_class} - "
-            f"Preprocessing: {preprocessing_time:.3f}s, "
-            f"Prediction: {prediction_time:.3f}s, "
-            f"Encoding: {encoding_time:.3f}s, "
-            f"Total: {total_time:.3f}s"
+            "Prediction completed - Class: %s - Preprocessing: %.3fs, Prediction: %.3fs, "
+            "Encoding: %.3fs (%s, waited %.3fs), Total: %.3fs",
+            predicted_class, preprocessing_time, prediction_time, encoding_time, image_format, encoding_wait, total_time,
+            extra={
+                'sampled': True,
+                'predicted_class': predicted_class,
+                'stages': {stage: round(seconds, 4) for stage, seconds in stages.items()},
+            }
         )
 
+        if cache_key is not None and cacheable:
+            _cache_set(cache, cache_key, {'predicted_class': predicted_class, 'cropped_image': cropped_base64})
+
         return predicted_class, cropped_base64
 
+    except (PoolSaturatedError, FutureTimeoutError):
+        # Load shedding; the caller answers 503 and logs it
+        raise
     except Exception as e:
         current_app.logger.error(f"Prediction failed: {str(e)}")
         current_app.logger.error(traceback.format_exc())
-        raise
\ No newline at end of file
+        raise
+
+def predict_batch(items, image_format=None):
+    """Predict a list of ``(image_data, mime_type, error)`` items.
+
+    Items are validated and preprocessed in parallel and all valid images are
+    classified in a single batched forward pass, while their response images
+    are encoded. Every item gets its own result dict, so one bad image never
+    fails the rest of the batch.
+    """
+    require_models()
+    image_format = image_format or current_app.config['RESPONSE_IMAGE_FORMAT']
+    encoding = response_image_options(current_app.config, image_format)
+    start_time = time.time()
+    results = [None] * len(items)
+    cache = current_app.config.get('RESULT_CACHE')
+    cache_keys = {}
+    pending = {}
+
+    # Validate, consult the cache and start preprocessing for each item
+    for index, (image_data, mime_type, error) in enumerate(items):
+        if error is None:
+            image, error = load_image_bytes(image_data, mime_type)
+        if error is not None:
+            results[index] = _batch_error(index, ValueError(error))
+            continue
+
+        if cache is not None:
+            cache_keys[index] = build_cache_key(image_data, current_app.config, image_format)
+            cached = _cache_get(cache, cache_keys[index])
+            RESULT_CACHE_LOOKUPS.labels(result='miss' if cached is None else 'hit').inc()
+            if cached is not None:
+                results[index] = _batch_success(index, cached['predicted_class'], cached['cropped_image'])
+                continue
+
+        try:
+            pending[index] = submit_preprocessing(image_data, image)
+        except Exception as e:
+            results[index] = _batch_error(index, e)
+
+    processed = {}
+    for index, future in pending.items():
+        try:
+            processed[index] = future.result(timeout=current_app.config['PREPROCESS_TIMEOUT_SECONDS'])
+        except Exception as e:
+            results[index] = _batch_error(index, e)
+    preprocessing_time = time.time() - start_time
+
+    encode_futures = {}
+    if encoding is not None:
+        executor = _get_thread_executor(current_app.config['RESPONSE_ENCODE_THREADS'], 'encode')
+        encode_futures = {
+            index: executor.submit(encode_processed_image, image, encoding) for index, image in processed.items()
+        }
+
+    # One forward pass for every successfully preprocessed image
+    prediction_start = time.time()
+    if processed:
+        indices = list(processed)
+        batch = np.stack([tf.keras.preprocessing.image.img_to_array(processed[i]) for i in indices])
+        try:
+            predictions, cacheable = current_app.config['MODEL_REGISTRY'].classify_batch(batch)
+        except Exception as e:
+            for index in indices:
+                results[index] = _batch_error(index, e)
+            predictions, cacheable = [], False
+
+        for index, prediction in zip(indices, predictions):
+            predicted_class = class_name(prediction[0])
+            PREDICTIONS.labels(predicted_class=predicted_class).inc()
+            try:
+                cropped_base64 = encode_futures[index].result() if index in encode_futures else None
+            except Exception as e:
+                results[index] = _batch_error(index, e)
+                continue
+            results[index] = _batch_success(index, predicted_class, cropped_base64)
+            if index in cache_keys and cacheable:
+                _cache_set(cache, cache_keys[index], {'predicted_class': predicted_class, 'cropped_image': cropped_base64})
+    prediction_time = time.time() - prediction_start
+    observe_stages({'batch_preprocessing': preprocessing_time, 'batch_inference': prediction_time})
+
+    failed = sum(1 for result in results if result['status'] != 'success')
+    current_app.logger.info(
+        "Batch prediction completed - Items: %d, Classified: %d, Failed: %d - "
+        "Preprocessing: %.3fs, Prediction: %.3fs, Total: %.3fs",
+        len(items), len(processed), failed, preprocessing_time, prediction_time, time.time() - start_time
+    )
+    return results
+
+def require_models():
+    """Wait for the models when they are still loading in the background
+    (or start loading them in lazy mode). Raises ModelsNotReadyError."""
+    current_app.config['MODEL_LOADER'].wait(timeout=current_app.config['MODEL_WARMUP_WAIT_SECONDS'])
+
+def _batch_success(index, predicted_class, cropped_image):
+    result = {'index': index, 'status': 'success', 'predicted_class': predicted_class}
+    if cropped_image is not None:
+        result['cropped_image'] = cropped_image
+    return result
+
+def _batch_error(index, error):
+    if isinstance(error, ValueError):
+        message = f'Validation error: {str(error)}'
+    else:
+        current_app.logger.error(f"Batch item {index} failed: {str(error)}")
+        message = 'An error occurred during prediction.'
+    return {'index': index, 'status': 'error', 'error': message}
+
+def classify(processed_img):
+    """Classifier output for one preprocessed image, from the model version
+    the registry routes it to, batched with concurrent requests when
+    enabled. Returns ``(output, cacheable)``; outputs of an A/B candidate
+    must not be cached."""
+    img_array = tf.keras.preprocessing.image.img_to_array(processed_img)
+    return current_app.config['MODEL_REGISTRY'].classify(img_array)
+
+def class_name(prediction):
+    class_index = 1 if prediction > 0.5 else 0
+    return current_app.config['CLASS_NAMES'][class_index]
+
+def response_image_options(config, image_format):
+    """Encoder settings for one of RESPONSE_IMAGE_FORMATS, or None for
+    ``none``. Raises ValueError for an unknown format."""
+    if image_format not in RESPONSE_IMAGE_FORMATS:
+        raise ValueError(f"image_format must be one of: {', '.join(RESPONSE_IMAGE_FORMATS)}")
+    if image_format == 'none':
+        return None
+    if image_format == 'webp':
+        return {'format': 'WEBP', 'mime_type': 'image/webp', 'quality': config['RESPONSE_WEBP_QUALITY'], 'max_side': None}
+    max_side = config['RESPONSE_THUMBNAIL_SIZE'] if image_format == 'thumbnail' else None
+    return {'format': 'JPEG', 'mime_type': 'image/jpeg', 'quality': config['RESPONSE_JPEG_QUALITY'], 'max_side': max_side}
+
+def encode_processed_image(processed_img, encoding=None):
+    """Encode to a data URL. Thread-safe; PIL releases the GIL while
+    encoding, so this overlaps with inference."""
+    encoding = encoding or DEFAULT_ENCODING
+    if encoding['max_side']:
+        processed_img = processed_img.copy()
+        processed_img.thumbnail((encoding['max_side'], encoding['max_side']), Image.Resampling.LANCZOS)
+
+    buffered = BytesIO()
+    if encoding['format'] == 'WEBP':
+        processed_img.save(buffered, format="WEBP", quality=encoding['quality'], method=4)
+    else:
+        processed_img.save(buffered, format="JPEG", quality=encoding['quality'], optimize=True)
+    cropped_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+    return f"data:{encoding['mime_type']};base64,{cropped_base64}"
+
+def _encode_timed(processed_img, encoding):
+    start = time.time()
+    return encode_processed_image(processed_img, encoding), time.time() - start
+
+def submit_preprocessing(image_data, image=None, output_size=(224, 224)):
+    """Start preprocessing one image and return a Future for the result: in
+    the process pool when configured, otherwise on a shared thread pool."""
+    options = pipeline_options(current_app.config, output_size)
+    pool = current_app.config.get('PREPROCESS_POOL')
+    if pool is not None:
+        return pool.submit(image_data, options)
+
+    executor = _get_thread_executor(current_app.config['BATCH_PREPROCESS_THREADS'], 'preprocess')
+    u2net_session = current_app.config['U2NET_SESSION']
+    if image is not None:
+        return executor.submit(_preprocess_observed, preprocess_image, image, u2net_session, options)
+    return executor.submit(_preprocess_observed, preprocess_image_bytes, image_data, u2net_session, options)
+
+def _preprocess_observed(preprocess_fn, source, u2net_session, options, timings=None):
+    timings = {} if timings is None else timings
+    processed = preprocess_fn(source, u2net_session, options, timings)
+    observe_stages(timings)
+    return processed
+
+# Separate pools, so encodes never queue behind batch preprocessing
+_thread_executors = {}
+_thread_executor_lock = threading.Lock()
+
+def _get_thread_executor(max_workers, name):
+    with _thread_executor_lock:
+        if name not in _thread_executors:
+            _thread_executors[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        return _thread_executors[name]
+
+def preprocess_image_data(image_data, image=None, output_size=(224, 224), timings=None):
+    """Preprocess one image. Per-stage seconds are added to ``timings``
+    when a dict is given."""
+    timings = {} if timings is None else timings
+    try:
+        options = pipeline_options(current_app.config, output_size)
+        
+        # Image processing pipeline, in the worker pool when one is configured.
+        # Workers receive the encoded bytes and decode them themselves.
+        pool = current_app.config.get('PREPROCESS_POOL')
+        if pool is not None:
+            future = pool.submit(image_data, options)
+            processed = future.result(timeout=pool.timeout)
+            timings.update(getattr(future, 'timings', {}))
+            return processed
+        if image is not None:
+            return _preprocess_observed(preprocess_image, image, current_app.config['U2NET_SESSION'], options, timings)
+        return _preprocess_observed(preprocess_image_bytes, image_data, current_app.config['U2NET_SESSION'], options, timings)
+
+    except (PoolSaturatedError, FutureTimeoutError):
+        raise
+    except Exception as e:
+        current_app.logger.error(f"Image preprocessing failed: {str(e)}")
+        raise
+
+def data_url_to_bytes(data_url):
+    return base64.b64decode(data_url.split(',', 1)[1])
+
+def data_url_mime_type(data_url):
+    return data_url[len('data:'):].split(';', 1)[0]
+
+def _cache_get(cache, key):
+    # Cache failures must never fail a prediction
+    try:
+        value = cache.get(key)
+        return json.loads(value) if value is not None else None
+    except Exception as e:
+        current_app.logger.warning(f"Result cache read failed: {str(e)}")
+        return None
+
+def _cache_set(cache, key, result):
+    try:
+        cache.set(key, json.dumps(result).encode('utf-8'))
+    except Exception as e:
+        current_app.logger.warning(f"Result cache write failed: {str(e)}")
@@ -0,0 +1,176 @@
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.services.image_processing import preprocess_image_bytes
+
+logger = logging.getLogger(__name__)
+
+# Per-process u2net session, created once by the pool initializer
+_worker_session = None
+
+
+class PoolSaturatedError(Exception):
+    """Raised when the preprocessing pool already holds its maximum number of
+    queued and running jobs."""
+
+
+def _init_worker(u2net_model_path, u2net_session=None, session_options=None, bg_backend='u2net'):
+    global _worker_session
+    from app.models.sessions import create_bg_session
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s in %(module)s [pid %(process)d]: %(message)s')
+    if u2net_session is not None:
+        # Picklable session (the shared inference server proxy, or an
+        # OpenCV backend)
+        _worker_session = u2net_session
+    else:
+        _worker_session = create_bg_session(bg_backend, u2net_model_path, session_options)
+    logger.info("Preprocessing worker ready")
+
+
+def _run_job(image_data, options):
+    # Stage timings travel back with the result; metrics live in the parent
+    timings = {}
+    processed = preprocess_image_bytes(image_data, _worker_session, options, timings)
+    return processed, timings
+
+
+class PreprocessPool:
+    """Runs the image pipeline in a pool of worker processes, each holding
+    its own u2net session, so CPU-bound work stays off the request threads
+    and outside their GIL.
+
+    At most ``queue_limit`` jobs may be queued or running at once; beyond
+    that ``submit`` raises PoolSaturatedError so the caller can shed load.
+    ``on_timings``, when given, receives each job's ``{stage: seconds}``,
+    which is also left on the returned future as ``timings``. If a worker
+    process dies, the jobs it broke fail and the next submit starts a new
+    pool.
+    """
+
+    def __init__(self, workers, queue_limit, u2net_model_path=None, timeout=None, u2net_session=None,
+                 session_options=None, bg_backend='u2net', on_timings=None):
+        self.workers = int(workers)
+        self.queue_limit = int(queue_limit)
+        self.u2net_model_path = u2net_model_path
+        self.u2net_session = u2net_session
+        self.session_options = session_options
+        self.bg_backend = bg_backend
+        self.on_timings = on_timings
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        # Bumped whenever the executor is replaced, so late callbacks of
+        # the old one do not touch the new one's count
+        self._generation = 0
+        self._in_flight = 0
+        self._rejected = 0
+        self._completed = 0
+
+    def _get_executor(self):
+        # Created lazily, and again after a fork, so a pool built in a
+        # gunicorn master is never shared with its workers.
+        pid = os.getpid()
+        if self._executor is None or self._pid != pid:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.u2net_model_path, self.u2net_session, self.session_options, self.bg_backend)
+            )
+            self._pid = pid
+            self._generation += 1
+            self._in_flight = 0
+        return self._executor
+
+    def _discard_broken(self, executor):
+        """A worker process died (u2net OOM, segfault) and took the executor
+        with it. Drop it so the next submit builds a fresh pool."""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            logger.error("Preprocessing worker died; rebuilding the pool")
+            self._executor = None
+            self._generation += 1
+            self._in_flight = 0
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, image_data, options, retry=True):
+        with self._lock:
+            executor = self._get_executor()
+            if self._in_flight >= self.queue_limit:
+                self._rejected += 1
+                raise PoolSaturatedError(
+                    f"Preprocessing queue is full ({self._in_flight}/{self.queue_limit} jobs)"
+                )
+            self._in_flight += 1
+            generation = self._generation
+
+        try:
+            job = executor.submit(_run_job, image_data, options)
+        except BrokenProcessPool:
+            # A worker died since the last job finished; try once on a fresh pool
+            self._discard_broken(executor)
+            if retry:
+                return self.submit(image_data, options, retry=False)
+            raise
+        except Exception:
+            self._release(generation)
+            raise
+
+        job.add_done_callback(lambda done: self._release(generation))
+        # Callers get the processed image alone, as from the in-thread path
+        future = Future()
+        job.add_done_callback(lambda done: self._unwrap(done, future, executor))
+        return future
+
+    def run(self, image_data, options):
+        return self.submit(image_data, options).result(timeout=self.timeout)
+
+    def _unwrap(self, job, future, executor):
+        try:
+            processed, timings = job.result()
+        except BrokenProcessPool as e:
+            self._discard_broken(executor)
+            future.set_exception(e)
+            return
+        except BaseException as e:
+            future.set_exception(e)
+            return
+
+        if self.on_timings is not None:
+            try:
+                self.on_timings(timings)
+            except Exception as e:
+                logger.warning(f"Recording preprocessing timings failed: {str(e)}")
+        future.timings = timings
+        future.set_result(processed)
+
+    def _release(self, generation):
+        with self._lock:
+            if generation == self._generation:
+                self._in_flight -= 1
+            self._completed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_limit': self.queue_limit,
+                'in_flight': self._in_flight,
+                'completed': self._completed,
+                'rejected': self._rejected,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._generation += 1
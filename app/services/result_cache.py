@@ -0,0 +1,269 @@
+import os
+import time
+import struct
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Config keys whose values change what /predict returns for the same image.
+# They are folded into every cache key so a model or pipeline change never
+# serves stale results.
+VERSION_CONFIG_KEYS = (
+    'CLASSIFICATION_MODEL_REPO_ID',
+    'CLASSIFICATION_MODEL_NAME',
+    'BG_REMOVAL_MODEL_REPO_ID',
+    'BG_REMOVAL_MODEL_NAME',
+    'BG_REMOVAL_BACKEND',
+    'BG_GRABCUT_ITERATIONS',
+    'U2NET_QUANTIZATION',
+    'CLASSIFIER_QUANTIZATION',
+    'INFERENCE_ENGINE',
+    'PREPROCESS_PIPELINE',
+    'BG_REMOVAL_MODE',
+    'BG_REMOVAL_WORKING_SIZE',
+    'PREPROCESS_WORKING_SIZE',
+    'DECODE_MIN_SIDE',
+    'CLASS_NAMES',
+)
+
+
+def model_version_tag(config):
+    return "|".join(f"{key}={config.get(key)}" for key in VERSION_CONFIG_KEYS)
+
+
+def build_cache_key(image_data, config, extra=""):
+    """Content-addressed key: SHA-256 of the decoded image bytes plus the
+    model/pipeline version tag."""
+    digest = hashlib.sha256()
+    digest.update(model_version_tag(config).encode('utf-8'))
+    digest.update(extra.encode('utf-8'))
+    digest.update(b"\0")
+    digest.update(image_data)
+    return digest.hexdigest()
+
+
+class MemoryResultCache:
+    """In-process LRU cache of byte values with a TTL and a total size cap."""
+
+    def __init__(self, max_bytes, ttl_seconds=None):
+        self.max_bytes = int(max_bytes)
+        self.ttl = ttl_seconds
+        self._entries = OrderedDict()  # key -> (created_at, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            created_at, value = entry
+            if self.ttl and time.time() - created_at > self.ttl:
+                self._discard(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (time.time(), value)
+            self._bytes += len(value)
+
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def _discard(self, key):
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+class DiskResultCache:
+    """File-per-entry cache shared by every worker process on the host.
+
+    Each file starts with its creation timestamp (used for the TTL); the file
+    mtime is refreshed on every hit and drives LRU eviction. Writes go
+    through a temporary file and ``os.replace`` so readers in other workers
+    never see a partial entry. Hit/miss counters are per process.
+    """
+
+    _HEADER = struct.Struct("<d")
+
+    def __init__(self, directory, max_bytes, ttl_seconds=None):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.ttl = ttl_seconds
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._approx_bytes = self._scan()[1]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            self._count_miss()
+            return None
+
+        if len(raw) < self._HEADER.size:
+            self._count_miss()
+            return None
+
+        (created_at,) = self._HEADER.unpack_from(raw)
+        if self.ttl and time.time() - created_at > self.ttl:
+            self._remove(path)
+            self._count_miss()
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        with self._lock:
+            self.hits += 1
+        return raw[self._HEADER.size:]
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self._HEADER.pack(time.time()))
+                f.write(value)
+            os.replace(tmp_path, path)
+        except Exception:
+            self._remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._approx_bytes += len(value) + self._HEADER.size
+            over_budget = self._approx_bytes > self.max_bytes
+
+        if over_budget:
+            self._evict()
+
+    def _count_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _scan(self):
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith(".tmp-"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        return entries, total
+
+    def _evict(self):
+        # Other workers write to the same directory, so re-measure before
+        # evicting and trim to 90% of the cap to avoid evicting on every set.
+        entries, total = self._scan()
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
+            evicted += 1
+
+        with self._lock:
+            self._approx_bytes = total
+            self.evictions += evicted
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'disk',
+                'directory': self.directory,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'bytes': self._approx_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+def create_result_cache(app):
+    backend = app.config['RESULT_CACHE_BACKEND']
+    max_bytes = app.config['RESULT_CACHE_MAX_BYTES']
+    ttl = app.config['RESULT_CACHE_TTL_SECONDS']
+
+    if backend == 'none':
+        app.logger.info("Result cache disabled")
+        return None
+    if backend == 'memory':
+        cache = MemoryResultCache(max_bytes, ttl)
+    elif backend == 'disk':
+        cache = DiskResultCache(app.config['RESULT_CACHE_DIR'], max_bytes, ttl)
+    else:
+        raise ValueError(f"Unknown result cache backend: {backend}")
+
+    app.logger.info(f"Result cache enabled - Backend: {backend}, Max size: {max_bytes} bytes, TTL: {ttl}s")
+    return cache
+
+
+def create_processed_image_store(app):
+    """Store behind /predict/image/<token>. The image may be fetched from any
+    worker, so several workers share a disk store."""
+    max_bytes = app.config['PROCESSED_IMAGE_STORE_MAX_BYTES']
+    ttl = app.config['PROCESSED_IMAGE_STORE_TTL_SECONDS']
+    if app.config['WEB_CONCURRENCY'] > 1:
+        return DiskResultCache(app.config['PROCESSED_IMAGE_STORE_DIR'], max_bytes, ttl)
+    return MemoryResultCache(max_bytes, ttl)
@@ -0,0 +1,459 @@
+"""Live camera streams (/predict/stream).
+
+A client opens a stream and then posts camera frames to it, each with a
+sequence number (``X-Frame-Seq``), keeping a few requests in flight rather
+than waiting for each answer. Only the newest frame matters, so stale
+frames are dropped wherever they are noticed:
+
+- the client ignores answers older than the newest one it has shown, and
+  aborts requests for frames older than it;
+- the server answers ``dropped`` without decoding a frame when a newer
+  one of the same stream has already arrived, at any worker. Within a
+  worker that runs several request threads (GUNICORN_THREADS > 1), a frame
+  waiting for its turn is also dropped as soon as a newer one arrives.
+
+With a single sync worker, frames reach the server in order and one at a
+time, so in practice only the client drops them.
+
+Background removal is the expensive stage, so its mask is reused while the
+scene is stable. A 32x32 grey thumbnail of each frame is compared with the
+one from the frame the mask was computed on, and u2net only reruns when
+they differ by more than STREAM_CHANGE_THRESHOLD (mean absolute difference,
+0-255). It also reruns after STREAM_MAX_MASK_AGE reused frames, or when the
+frame size changes. Classifier outputs are smoothed with an exponential
+moving average, so one bad frame does not flip the answer.
+
+Which streams are open, who owns them, their newest sequence number and
+their counters live in a store: in memory with one worker, in a SQLite file
+shared by every worker otherwise. Only opening a stream adds it, and each
+user holds at most STREAM_MAX_PER_USER. The mask and the moving average are
+a cache in the worker process; a worker that sees its first frame of an
+open stream starts them afresh, which costs one u2net run.
+"""
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+from flask import current_app
+
+from app.services.image_processing import foreground_mask, apply_foreground_mask, fused_preprocess
+from app.services.prediction import classify, class_name
+from app.services.metrics import observe_stages, STREAM_FRAMES
+from app.services.admission import admitted
+
+SIGNATURE_SIZE = (32, 32)
+COUNTERS = ('frames', 'dropped', 'mask_reused')
+
+
+class StreamNotFoundError(LookupError):
+    pass
+
+
+def frame_signature(image):
+    return np.asarray(image.resize(SIGNATURE_SIZE, Image.Resampling.BILINEAR).convert("L"), dtype=np.int16)
+
+
+class StreamState:
+    """The part of a stream kept in the worker process: whose turn it is,
+    the reusable mask and the moving average."""
+
+    def __init__(self, stream_id, owner):
+        self.stream_id = stream_id
+        self.owner = owner
+        self.last_seen = time.time()
+
+        # One frame runs at a time; newer arrivals wake and drop older waiters
+        self.latest_frame = 0
+        self.busy = False
+        self.condition = threading.Condition()
+
+        # Mask from the last u2net run, with the frame it was computed on
+        self.mask = None
+        self.mask_signature = None
+        self.mask_frame_size = None
+        self.mask_age = 0
+
+        self.probability = None
+
+    def acquire(self, frame, timeout):
+        """Wait for ``frame``'s turn. Returns False when a newer frame
+        arrived first or ``timeout`` passed."""
+        with self.condition:
+            self.latest_frame = max(self.latest_frame, frame)
+            self.last_seen = time.time()
+            self.condition.notify_all()
+
+            deadline = time.monotonic() + timeout
+            while self.busy and frame == self.latest_frame:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            if self.busy or frame != self.latest_frame:
+                return False
+            self.busy = True
+            return True
+
+    def release(self):
+        with self.condition:
+            self.busy = False
+            self.condition.notify_all()
+
+    def smooth(self, probability, alpha):
+        if self.probability is None:
+            self.probability = probability
+        else:
+            self.probability = alpha * probability + (1 - alpha) * self.probability
+        return self.probability
+
+
+class MemoryStreamStore:
+    """Open streams of this process, least recently used first."""
+
+    backend = 'memory'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = OrderedDict()  # id -> {'owner', 'latest_seq', 'last_seen', counters}
+
+    def open(self, stream_id, owner, max_streams, max_per_owner, idle_seconds):
+        now = time.time()
+        with self._lock:
+            self._expire(now - idle_seconds)
+            owned = [key for key, row in self._streams.items() if row['owner'] == owner]
+            for key in owned[:max(len(owned) - max_per_owner + 1, 0)]:
+                del self._streams[key]
+            self._streams[stream_id] = {'owner': owner, 'latest_seq': 0, 'last_seen': now, **dict.fromkeys(COUNTERS, 0)}
+            while len(self._streams) > max_streams:
+                self._streams.popitem(last=False)
+
+    def touch(self, stream_id, owner, seq, idle_seconds):
+        now = time.time()
+        with self._lock:
+            self._expire(now - idle_seconds)
+            row = self._streams.get(stream_id)
+            if row is None or row['owner'] != owner:
+                raise StreamNotFoundError(stream_id)
+            if seq is None:
+                seq = row['latest_seq'] + 1
+            row['latest_seq'] = max(row['latest_seq'], seq)
+            row['last_seen'] = now
+            self._streams.move_to_end(stream_id)
+            return seq
+
+    def latest_seq(self, stream_id):
+        with self._lock:
+            row = self._streams.get(stream_id)
+            return None if row is None else row['latest_seq']
+
+    def record(self, stream_id, counter):
+        with self._lock:
+            row = self._streams.get(stream_id)
+            if row is None:
+                return {}
+            row[counter] += 1
+            return {key: row[key] for key in COUNTERS}
+
+    def close(self, stream_id, owner):
+        with self._lock:
+            row = self._streams.get(stream_id)
+            if row is None or row['owner'] != owner:
+                raise StreamNotFoundError(stream_id)
+            del self._streams[stream_id]
+            return {key: row[key] for key in COUNTERS}
+
+    def count(self):
+        with self._lock:
+            return len(self._streams)
+
+    def _expire(self, cutoff):
+        while self._streams:
+            oldest = next(iter(self._streams.values()))
+            if oldest['last_seen'] >= cutoff:
+                break
+            self._streams.popitem(last=False)
+
+
+class SQLiteStreamStore:
+    """Open streams in a SQLite file shared by every gunicorn worker on the
+    host, so a frame can be checked wherever it lands."""
+
+    backend = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS streams ("
+                " id TEXT PRIMARY KEY, owner TEXT NOT NULL, latest_seq INTEGER NOT NULL DEFAULT 0,"
+                " last_seen REAL NOT NULL, frames INTEGER NOT NULL DEFAULT 0,"
+                " dropped INTEGER NOT NULL DEFAULT 0, mask_reused INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS streams_owner ON streams (owner, last_seen)")
+            conn.execute("CREATE INDEX IF NOT EXISTS streams_last_seen ON streams (last_seen)")
+
+    def _connect(self):
+        # One connection per thread (and per process after a fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def open(self, stream_id, owner, max_streams, max_per_owner, idle_seconds):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM streams WHERE last_seen < ?", (now - idle_seconds,))
+            conn.execute(
+                "DELETE FROM streams WHERE id IN ("
+                " SELECT id FROM streams WHERE owner = ? ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+                (owner, max(max_per_owner - 1, 0))
+            )
+            conn.execute(
+                "DELETE FROM streams WHERE id IN ("
+                " SELECT id FROM streams ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+                (max(max_streams - 1, 0),)
+            )
+            conn.execute("INSERT INTO streams (id, owner, last_seen) VALUES (?, ?, ?)", (stream_id, owner, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def touch(self, stream_id, owner, seq, idle_seconds):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT owner, latest_seq FROM streams WHERE id = ? AND last_seen >= ?", (stream_id, now - idle_seconds)
+            ).fetchone()
+            if row is None or row[0] != owner:
+                conn.execute("COMMIT")
+                raise StreamNotFoundError(stream_id)
+            if seq is None:
+                seq = row[1] + 1
+            conn.execute(
+                "UPDATE streams SET latest_seq = MAX(latest_seq, ?), last_seen = ? WHERE id = ?", (seq, now, stream_id)
+            )
+            conn.execute("COMMIT")
+        except StreamNotFoundError:
+            raise
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return seq
+
+    def latest_seq(self, stream_id):
+        row = self._connect().execute("SELECT latest_seq FROM streams WHERE id = ?", (stream_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def record(self, stream_id, counter):
+        if counter not in COUNTERS:
+            raise ValueError(f"Unknown stream counter: {counter}")
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"UPDATE streams SET {counter} = {counter} + 1 WHERE id = ?", (stream_id,))
+            row = conn.execute("SELECT frames, dropped, mask_reused FROM streams WHERE id = ?", (stream_id,)).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return {} if row is None else dict(zip(COUNTERS, row))
+
+    def close(self, stream_id, owner):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT owner, frames, dropped, mask_reused FROM streams WHERE id = ?", (stream_id,)
+            ).fetchone()
+            if row is None or row[0] != owner:
+                conn.execute("COMMIT")
+                raise StreamNotFoundError(stream_id)
+            conn.execute("DELETE FROM streams WHERE id = ?", (stream_id,))
+            conn.execute("COMMIT")
+        except StreamNotFoundError:
+            raise
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return dict(zip(COUNTERS, row[1:]))
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM streams").fetchone()[0]
+
+
+class StreamRegistry:
+    """Open streams in ``store``, plus this worker's StreamState for the
+    ones it has served, least recently used first. Idle streams expire; a
+    new stream beyond ``max_streams``, or beyond ``max_per_owner`` for its
+    user, closes the oldest one, so one user cannot push out everyone
+    else's."""
+
+    def __init__(self, store, max_streams=64, idle_seconds=60, max_per_owner=4):
+        self.store = store
+        self.max_streams = max_streams
+        self.idle_seconds = idle_seconds
+        self.max_per_owner = max_per_owner
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open(self, stream_id, owner):
+        self.store.open(stream_id, owner, self.max_streams, self.max_per_owner, self.idle_seconds)
+
+    def get(self, stream_id, owner, seq=None):
+        """Register frame ``seq`` (the next one when None) of an open stream.
+        Returns ``(state, seq)``; raises StreamNotFoundError for a stream
+        that was never opened, has expired or belongs to someone else."""
+        seq = self.store.touch(stream_id, owner, seq, self.idle_seconds)
+        with self._lock:
+            self._expire()
+            state = self._states.get(stream_id)
+            if state is None or state.owner != owner:
+                state = StreamState(stream_id, owner)
+                self._states[stream_id] = state
+                while len(self._states) > self.max_streams:
+                    self._states.popitem(last=False)
+            self._states.move_to_end(stream_id)
+            return state, seq
+
+    def is_stale(self, stream_id, seq):
+        """Whether a newer frame than ``seq`` has arrived at any worker."""
+        latest = self.store.latest_seq(stream_id)
+        return latest is not None and latest > seq
+
+    def record(self, stream_id, counter):
+        """Count a frame outcome. Returns the stream's counters."""
+        return self.store.record(stream_id, counter)
+
+    def close(self, stream_id, owner):
+        """Close a stream and return its counters."""
+        counters = self.store.close(stream_id, owner)
+        with self._lock:
+            self._states.pop(stream_id, None)
+        return {'stream_id': stream_id, **counters}
+
+    def _expire(self):
+        cutoff = time.time() - self.idle_seconds
+        while self._states:
+            oldest = next(iter(self._states.values()))
+            if oldest.last_seen >= cutoff:
+                break
+            self._states.popitem(last=False)
+
+    def stats(self):
+        return {
+            'backend': self.store.backend,
+            'streams': self.store.count(),
+            'max_streams': self.max_streams,
+            'max_per_owner': self.max_per_owner,
+        }
+
+
+def create_stream_registry(app):
+    """Frames of one stream may reach any worker, so several workers share
+    a SQLite store."""
+    if app.config['WEB_CONCURRENCY'] > 1:
+        store = SQLiteStreamStore(app.config['STREAM_STORE_PATH'])
+    else:
+        store = MemoryStreamStore()
+    return StreamRegistry(
+        store, app.config['STREAM_MAX_STREAMS'], app.config['STREAM_IDLE_SECONDS'], app.config['STREAM_MAX_PER_USER']
+    )
+
+
+def process_frame(registry, state, seq, image):
+    """Classify frame ``seq`` (an opened, not yet decoded image) of a
+    stream. Returns the result dict, or a ``dropped`` status when a newer
+    frame arrived first; dropped frames are never decoded. Raises
+    AdmissionRejected when the server has no slot for it."""
+    config = current_app.config
+    if not state.acquire(seq, config['STREAM_FRAME_WAIT_SECONDS']):
+        return _dropped(registry, state, seq)
+    try:
+        if registry.is_stale(state.stream_id, seq):
+            return _dropped(registry, state, seq)
+        # Only a frame that runs takes an admission slot
+        with admitted(state.owner, rate_limited=False):
+            # Waiting for the slot may have let a newer frame arrive
+            if registry.is_stale(state.stream_id, seq):
+                return _dropped(registry, state, seq)
+            return _classify_frame(registry, state, seq, image, config)
+    finally:
+        state.release()
+
+
+def _dropped(registry, state, seq):
+    STREAM_FRAMES.labels(outcome='dropped').inc()
+    registry.record(state.stream_id, 'dropped')
+    return {'status': 'dropped', 'frame': seq, 'latest_frame': registry.store.latest_seq(state.stream_id)}
+
+
+def _classify_frame(registry, state, frame, image, config):
+    timings = {}
+    start = time.perf_counter()
+    rgb = image.convert("RGB")
+    signature = frame_signature(rgb)
+    timings['stream_decode'] = time.perf_counter() - start
+
+    change = None
+    if state.mask is not None and state.mask_frame_size == rgb.size:
+        change = float(np.abs(signature - state.mask_signature).mean())
+    reuse = (
+        change is not None
+        and change <= config['STREAM_CHANGE_THRESHOLD']
+        and state.mask_age < config['STREAM_MAX_MASK_AGE']
+    )
+
+    start = time.perf_counter()
+    if reuse:
+        state.mask_age += 1
+    else:
+        state.mask = foreground_mask(rgb, config['U2NET_SESSION'], config['BG_REMOVAL_WORKING_SIZE'])
+        state.mask_signature = signature
+        state.mask_frame_size = rgb.size
+        state.mask_age = 0
+        timings['stream_background_removal'] = time.perf_counter() - start
+    STREAM_FRAMES.labels(outcome='mask_reused' if reuse else 'mask_computed').inc()
+    if reuse:
+        registry.record(state.stream_id, 'mask_reused')
+
+    start = time.perf_counter()
+    processed = fused_preprocess(
+        apply_foreground_mask(rgb, state.mask), config['MODEL_INPUT_SIZE'], config['PREPROCESS_WORKING_SIZE']
+    )
+    timings['stream_preprocess'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    probability, _ = classify(processed)
+    probability = float(probability)
+    timings['stream_inference'] = time.perf_counter() - start
+    observe_stages(timings)
+
+    smoothed = state.smooth(probability, config['STREAM_SMOOTHING'])
+    counters = registry.record(state.stream_id, 'frames')
+    return {
+        'status': 'success',
+        'frame': frame,
+        'predicted_class': class_name(smoothed),
+        'confidence': round(max(smoothed, 1 - smoothed), 4),
+        'frame_class': class_name(probability),
+        'frame_confidence': round(max(probability, 1 - probability), 4),
+        'mask_reused': reuse,
+        'scene_change': None if change is None else round(change, 2),
+        'dropped_frames': counters.get('dropped', 0),
+        'timings_ms': {stage.replace('stream_', ''): round(seconds * 1000, 1) for stage, seconds in timings.items()},
+    }
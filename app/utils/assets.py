@@ -0,0 +1,114 @@
+"""Content-hashed static assets.
+
+Every file under the static folder is registered once at startup under a
+URL that contains a hash of its bytes (``images/imageO.3f2a9c1b7d4e.png``),
+so it can be cached by browsers and proxies forever: a changed file gets a
+new URL. Templates link assets with ``asset_url('images/imageO.png')``.
+
+Compressible files also get gzip (and brotli, when the ``brotli`` package
+is installed) variants, built once at startup and only kept when smaller.
+Responses carry the hash as a strong ETag, so revalidations get a 304.
+"""
+import os
+import gzip
+import hashlib
+import mimetypes
+from flask import Response, request, abort, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Already-compressed formats are served as they are
+COMPRESSIBLE_TYPES = {
+    'text/css', 'text/javascript', 'application/javascript', 'application/json',
+    'image/svg+xml', 'image/vnd.microsoft.icon', 'image/x-icon',
+}
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+class StaticAsset:
+    def __init__(self, path, data):
+        self.path = path
+        self.digest = hashlib.sha256(data).hexdigest()[:12]
+        root, extension = os.path.splitext(path)
+        self.hashed_path = f"{root}.{self.digest}{extension}"
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.variants = {'identity': data}
+
+        if self.mimetype in COMPRESSIBLE_TYPES:
+            compressed = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed['br'] = brotli.compress(data, quality=11)
+            for encoding, body in compressed.items():
+                if len(body) < len(data):
+                    self.variants[encoding] = body
+
+    def negotiate(self, accept_encodings):
+        """Pick the smallest variant the client accepts."""
+        candidates = [encoding for encoding in self.variants if encoding == 'identity' or encoding in accept_encodings]
+        return min(candidates, key=lambda encoding: len(self.variants[encoding]))
+
+class AssetRegistry:
+    """Maps logical paths to hashed URLs and serves the hashed files."""
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self.by_path = {}
+        self.by_hashed_path = {}
+        for root, _, files in os.walk(static_folder):
+            for name in sorted(files):
+                full_path = os.path.join(root, name)
+                path = os.path.relpath(full_path, static_folder).replace(os.sep, '/')
+                with open(full_path, 'rb') as f:
+                    asset = StaticAsset(path, f.read())
+                self.by_path[path] = asset
+                self.by_hashed_path[asset.hashed_path] = asset
+
+    def url_path(self, path):
+        asset = self.by_path.get(path)
+        if asset is None:
+            raise KeyError(f"Unknown static asset: {path}")
+        return asset.hashed_path
+
+    def response(self, hashed_path):
+        asset = self.by_hashed_path.get(hashed_path)
+        if asset is None:
+            abort(404)
+
+        # Each variant has its own ETag, as the bytes differ
+        encoding = asset.negotiate(request.accept_encodings)
+        etag = asset.digest if encoding == 'identity' else f"{asset.digest}-{encoding}"
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+            if encoding != 'identity':
+                response.content_encoding = encoding
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def stats(self):
+        return {
+            'assets': len(self.by_path),
+            'bytes': sum(len(asset.variants['identity']) for asset in self.by_path.values()),
+            'brotli': brotli is not None,
+        }
+
+def init_assets(app):
+    """Build the registry, serve it under /assets/ and give templates
+    ``asset_url``."""
+    registry = AssetRegistry(app.static_folder)
+    app.extensions['assets'] = registry
+
+    def asset_url(path):
+        return url_for('asset', hashed_path=registry.url_path(path))
+
+    app.add_url_rule(
+        f"{app.config['ASSET_URL_PREFIX']}/<path:hashed_path>", 'asset', registry.response
+    )
+    app.jinja_env.globals['asset_url'] = asset_url
+    app.logger.info(f"Registered {len(registry.by_path)} static assets (brotli: {brotli is not None})")
+    return registry
@@ -1,11 +1,119 @@
 import os
+import re
 import sys
+import json
+import uuid
+import queue
+import atexit
+import random
 import logging
-from logging.handlers import RotatingFileHandler
-from flask import request, g
+from datetime import datetime
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from flask import request, g, has_request_context
 import time
 
+# Attributes every LogRecord has; anything else was passed with ``extra=``
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Client-supplied X-Request-ID values that are copied into the logs as is
+_REQUEST_ID = re.compile(r'[A-Za-z0-9._-]{1,64}')
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line. Fields passed with ``extra=`` (for example
+    ``stages``) are included as they are."""
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created).astimezone().isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'line': record.lineno,
+            'pid': record.process,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key != 'sampled':
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the current request id, and drop sampled INFO
+    records of requests that were not picked for sampling. Runs on the
+    calling thread, before the record is queued."""
+
+    def __init__(self, sample_rate=1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        in_request = has_request_context()
+        record.request_id = g.get('request_id', '-') if in_request else '-'
+
+        if getattr(record, 'sampled', False) and record.levelno <= logging.INFO and self.sample_rate < 1.0:
+            # Whole requests are kept or dropped, so a kept request's lines stay together
+            keep = g.get('log_sampled') if in_request else None
+            if keep is None:
+                keep = random.random() < self.sample_rate
+            return keep
+        return True
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Never blocks the caller: when the queue is full the record is dropped
+    and counted instead."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # QueueHandler.prepare merges the arguments into the message and
+        # formats any traceback, so that the record can be pickled. The
+        # listener is a thread of this process, so the record is queued as
+        # it is and all formatting happens on the listener thread. Log
+        # arguments must therefore not be mutated after the call.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class StoppableQueueListener(QueueListener):
+    """Remembers whether it is running, since ``stop()`` fails when called
+    twice."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.running = False
+
+    def start(self):
+        super().start()
+        self.running = True
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            super().stop()
+
+def _stop_listener(listener):
+    # Flushes queued records at exit
+    listener.stop()
+
+def request_id_from(headers):
+    """The incoming ``X-Request-ID`` when it is a short token, else a new id."""
+    request_id = headers.get('X-Request-ID', '')
+    if _REQUEST_ID.fullmatch(request_id):
+        return request_id
+    return uuid.uuid4().hex[:16]
+
 def setup_logging(app):
+    """Route ``app.logger`` through a queue. The request thread only
+    enqueues records; a listener thread formats them and does the file and
+    console I/O. ``LOG_FORMAT`` selects ``json`` or the ``text`` format."""
     # Remove default handlers to prevent duplicate logs
     if app.logger.hasHandlers():
         app.logger.handlers.clear()
@@ -13,46 +121,62 @@ def setup_logging(app):
     # Create logs directory if it doesn't exist
     if not os.path.exists('logs'):
         os.mkdir('logs')
-    
+
     # Set up file handler with rotation
     file_handler = RotatingFileHandler(
         'logs/milk_detector.log',
         maxBytes=10240000,  # 10MB
         backupCount=10
     )
-    
-    # Create formatter with local time
-    formatter = logging.Formatter(
-        '[%(asctime)s] %(levelname)s in %(module)s [%(pathname)s:%(lineno)d]: %(message)s'
-    )
-    formatter.converter = time.localtime  # use local time
+
+    if app.config.get('LOG_FORMAT', 'json') == 'json':
+        formatter = JsonFormatter()
+    else:
+        # Create formatter with local time
+        formatter = logging.Formatter(
+            '[%(asctime)s] %(levelname)s in %(module)s [%(pathname)s:%(lineno)d] [%(request_id)s]: %(message)s'
+        )
+        formatter.converter = time.localtime  # use local time
     file_handler.setFormatter(formatter)
-    file_handler.setLevel(logging.INFO)
-    
+
     # Set up console handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(formatter)
-    console_handler.setLevel(logging.INFO)
-    
+
+    # Handlers run on the listener thread, off the request path
+    log_queue = queue.Queue(app.config.get('LOG_QUEUE_SIZE', 10000))
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter(app.config.get('LOG_SAMPLE_RATE', 1.0)))
+    listener = StoppableQueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    app.extensions['log_listener'] = listener
+    app.extensions['log_queue_handler'] = queue_handler
+
     # Configure app logger
-    app.logger.addHandler(file_handler)
-    app.logger.addHandler(console_handler)
-    app.logger.setLevel(logging.INFO)
-    
+    app.logger.addHandler(queue_handler)
+    app.logger.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+
     # Set up request logging
     @app.before_request
     def log_request_info():
         g.start_time = time.time()
+        g.request_id = request_id_from(request.headers)
+        g.log_sampled = random.random() < app.config.get('LOG_SAMPLE_RATE', 1.0)
         app.logger.info(
-            f"Request started - {request.method} {request.url} - "
-            f"IP: {request.remote_addr} - User-Agent: {request.headers.get('User-Agent', 'Unknown')}"
+            "Request started - %s %s - IP: %s - User-Agent: %s",
+            request.method, request.url, request.remote_addr, request.headers.get('User-Agent', 'Unknown'),
+            extra={'sampled': True}
         )
-    
+
     @app.after_request
     def log_response_info(response):
         duration = time.time() - g.start_time if hasattr(g, 'start_time') else 0
         app.logger.info(
-            f"Request completed - {request.method} {request.url} - "
-            f"Status: {response.status_code} - Duration: {duration:.3f}s"
+            "Request completed - %s %s - Status: %s - Duration: %.3fs",
+            request.method, request.url, response.status_code, duration,
+            extra={'sampled': True, 'status': response.status_code, 'duration': round(duration, 4)}
         )
+        if 'request_id' in g:
+            response.headers['X-Request-ID'] = g.request_id
         return response
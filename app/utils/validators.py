@@ -1,29 +1,60 @@
 import base64
-from PIL import Image
-from io import BytesIO
+import binascii
 from flask import current_app
+from app.services.image_processing import open_image
+
+def parse_data_url(base64_str):
+    """Split a ``data:image/...;base64,`` URL into its MIME type and decoded
+    bytes. Raises ValueError for anything that is not a supported image."""
+    if not base64_str or not isinstance(base64_str, str):
+        raise ValueError("Invalid base64 string")
+
+    if not base64_str.startswith('data:image/'):
+        raise ValueError("Invalid image format")
+
+    # Extract MIME type
+    mime_type = base64_str.split(',')[0].split(':')[1].split(';')[0]
+    if mime_type not in current_app.config['ALLOWED_IMAGE_TYPES']:
+        raise ValueError(f"Unsupported image type: {mime_type}")
 
-def validate_base64_image(base64_str):
     try:
-        if not base64_str or not isinstance(base64_str, str):
-            return False, "Invalid base64 string"
-        
-        if not base64_str.startswith('data:image/'):
-            return False, "Invalid image format"
-        
-        # Extract MIME type
-        mime_type = base64_str.split(',')[0].split(':')[1].split(';')[0]
-        if mime_type not in current_app.config['ALLOWED_IMAGE_TYPES']:
-            return False, f"Unsupported image type: {mime_type}"
-        
-        # Decode base64 data
         image_data = base64.b64decode(base64_str.split(',')[-1])
-        if len(image_data) == 0:
-            return False, "Empty image data"
-        
-        # Validate with PIL
-        Image.open(BytesIO(image_data))
-        return True, None
-        
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Invalid image data: {str(e)}")
+
+    return mime_type, image_data
+
+def load_image_bytes(image_data, mime_type=None):
+    """Validate image bytes from their header and return the opened (not yet
+    decoded) image, as ``(image, None)`` or ``(None, error_message)``."""
+    try:
+        if not image_data:
+            return None, "Empty image data"
+
+        if mime_type and mime_type != 'application/octet-stream' \
+                and mime_type not in current_app.config['ALLOWED_IMAGE_TYPES']:
+            return None, f"Unsupported image type: {mime_type}"
+
+        image = open_image(
+            image_data,
+            current_app.config['MAX_IMAGE_PIXELS'],
+            current_app.config['DECODE_MIN_SIDE']
+        )
+        return image, None
+
+    except ValueError as e:
+        return None, str(e)
+    except Exception as e:
+        return None, f"Invalid image data: {str(e)}"
+
+def validate_image_bytes(image_data, mime_type=None):
+    image, error_msg = load_image_bytes(image_data, mime_type)
+    return image is not None, error_msg
+
+def validate_base64_image(base64_str):
+    try:
+        mime_type, image_data = parse_data_url(base64_str)
+        return validate_image_bytes(image_data, mime_type)
+
     except Exception as e:
-        return False, f"Invalid image data: {str(e)}"
\ No newline at end of file
+        return False, str(e)
@@ -0,0 +1,107 @@
+"""Gunicorn configuration.
+
+    gunicorn -c gunicorn.conf.py run:app
+
+With INFERENCE_SERVER_MODE=shared the master starts one inference process
+(app/services/inference_server.py) before forking the workers. That process
+holds the only copy of the u2net session and the classifier, and the workers
+talk to it over a Unix socket. Without it, every worker loads its own models.
+A watchdog thread in the master restarts the process if it dies, at most
+once per INFERENCE_SERVER_RESTART_SECONDS; workers reconnect on their next
+call.
+
+The app is deliberately not preloaded into the master: TensorFlow and ONNX
+Runtime thread pools do not survive fork, so weights loaded there could not
+be used safely by the workers.
+"""
+import os
+import time
+import shutil
+import secrets
+import threading
+import multiprocessing
+import multiprocessing.connection
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 7860)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+
+inference_server_mode = os.environ.get('INFERENCE_SERVER_MODE', 'per-worker')
+inference_server_restart_seconds = float(os.environ.get('INFERENCE_SERVER_RESTART_SECONDS', 10))
+_inference_process = None
+_stopping = threading.Event()
+
+# prometheus_client reads this when it is first imported, so it must be set
+# before any worker loads the app. Workers write their metrics here and
+# /metrics aggregates them.
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/imageo-metrics')
+
+
+def on_starting(server):
+    # Values left by a previous run would be added to this one's
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+    if inference_server_mode != 'shared':
+        return
+
+    # Workers inherit these through the environment when they fork
+    address = os.environ.setdefault('INFERENCE_SERVER_ADDRESS', '/tmp/imageo-inference.sock')
+    authkey = os.environ.setdefault('INFERENCE_SERVER_AUTHKEY', secrets.token_hex(16))
+
+    _start_inference_process(server, address, authkey)
+    threading.Thread(
+        target=_supervise_inference_process, args=(server, address, authkey), name='imageo-inference-watchdog',
+        daemon=True
+    ).start()
+
+
+def _start_inference_process(server, address, authkey):
+    global _inference_process
+    from app.services.inference_server import serve
+
+    _inference_process = multiprocessing.get_context('spawn').Process(
+        target=serve, args=(address, authkey.encode('utf-8')), name='imageo-inference', daemon=True
+    )
+    _inference_process.start()
+    # Workers forked later would inherit multiprocessing's record of this
+    # child, and its exit handler in any worker that stops normally would
+    # terminate the process every other worker uses. The watchdog and
+    # on_exit manage it instead.
+    multiprocessing.process._children.discard(_inference_process)
+    server.log.info(f"Started shared inference server (pid {_inference_process.pid}) on {address}")
+
+
+def _inference_process_exited(timeout=0):
+    # The arbiter's SIGCHLD handler reaps every child, this one included, so
+    # is_alive() and exitcode never see it exit. The sentinel pipe closes
+    # when the process does, whoever reaps it.
+    return bool(multiprocessing.connection.wait([_inference_process.sentinel], timeout))
+
+
+def _supervise_inference_process(server, address, authkey):
+    # Workers fail their inference calls (and /health) until it is back
+    last_start = time.monotonic()
+    while not _stopping.is_set():
+        if not _inference_process_exited(timeout=1) or _stopping.is_set():
+            continue
+        server.log.error(f"Shared inference server (pid {_inference_process.pid}) exited")
+        # Back off so a server that dies while loading does not restart in a loop
+        delay = inference_server_restart_seconds - (time.monotonic() - last_start)
+        if delay > 0 and _stopping.wait(delay):
+            return
+        _start_inference_process(server, address, authkey)
+        last_start = time.monotonic()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    _stopping.set()
+    if _inference_process is not None and not _inference_process_exited():
+        _inference_process.terminate()
+        _inference_process_exited(timeout=10)
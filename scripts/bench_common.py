@@ -0,0 +1,175 @@
+"""Helpers shared by benchmark_pipeline.py and load_test.py: fixture images,
+latency summaries, run metadata and comparison against a previous report."""
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import subprocess
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+
+# Phone-camera-like sizes, smallest to largest
+DEFAULT_RESOLUTIONS = ['640x480', '1280x960', '2048x1536', '4032x3024']
+
+
+def parse_resolution(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def make_fixture(width, height, seed=0, quality=90):
+    """JPEG of a milk-like sample centred on a plain, slightly noisy surface.
+    Deterministic for a given size and seed."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+
+    surface = np.array([70, 72, 80], dtype=np.float32) + rng.uniform(-10, 10, size=3)
+    frame = np.empty((height, width, 3), dtype=np.float32)
+    frame[:] = surface
+    frame += (yy / height * 20)[..., None]
+
+    radius = min(width, height) * rng.uniform(0.25, 0.35)
+    cx = width / 2 + rng.uniform(-0.05, 0.05) * width
+    cy = height / 2 + rng.uniform(-0.05, 0.05) * height
+    inside = ((xx - cx) ** 2 + (yy - cy) ** 2) <= radius ** 2
+    tint = np.array([235, 232, 220], dtype=np.float32) - rng.uniform(0, 25, size=3)
+    frame[inside] = tint
+
+    frame += rng.normal(0, 4, size=frame.shape)
+    buffer = BytesIO()
+    Image.fromarray(np.clip(frame, 0, 255).astype(np.uint8)).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def fixture_set(resolutions, variants=1):
+    """``{"WxH": [jpeg bytes, ...]}`` with ``variants`` different images per
+    resolution (distinct bytes, so the result cache does not absorb them)."""
+    fixtures = {}
+    for resolution in resolutions:
+        width, height = parse_resolution(resolution)
+        fixtures[resolution] = [make_fixture(width, height, seed) for seed in range(variants)]
+    return fixtures
+
+
+def load_image_folder(directory):
+    images = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                with open(os.path.join(root, name), 'rb') as f:
+                    images.append(f.read())
+    return {os.path.basename(os.path.normpath(directory)): images}
+
+
+def latency_summary(seconds, elapsed=None):
+    """Percentiles in milliseconds. Throughput is measured over ``elapsed``
+    wall time when given (concurrent runs), otherwise as 1 / mean."""
+    if not seconds:
+        return {'count': 0}
+    values = np.asarray(seconds, dtype=np.float64)
+    throughput = len(values) / elapsed if elapsed else 1.0 / values.mean()
+    return {
+        'count': int(len(values)),
+        'p50_ms': round(float(np.percentile(values, 50)) * 1000, 3),
+        'p95_ms': round(float(np.percentile(values, 95)) * 1000, 3),
+        'p99_ms': round(float(np.percentile(values, 99)) * 1000, 3),
+        'mean_ms': round(float(values.mean()) * 1000, 3),
+        'max_ms': round(float(values.max()) * 1000, 3),
+        'throughput_per_second': round(float(throughput), 2),
+    }
+
+
+def peak_rss_mib(pid=None):
+    """Peak RSS of this process, or of ``pid`` (read from /proc, Linux only)."""
+    if pid is None:
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def run_metadata(**extra):
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        **extra,
+    }
+
+
+def stub_classifier(batch):
+    """Deterministic stand-in for the classifier, so the pipeline and the
+    serving path can be measured without the model weights."""
+    batch = np.asarray(batch, dtype=np.float32)
+    yellowness = batch[..., 0].mean(axis=(1, 2)) - batch[..., 2].mean(axis=(1, 2))
+    return (1 / (1 + np.exp(-yellowness / 10)))[:, None].astype(np.float32)
+
+
+def _latency_leaves(report, path=()):
+    if isinstance(report, dict):
+        for key, value in report.items():
+            if key.endswith('_ms') and key.startswith('p') and isinstance(value, (int, float)):
+                yield path + (key,), value
+            else:
+                yield from _latency_leaves(value, path + (key,))
+
+
+def compare_reports(current, previous, threshold):
+    """Percentile latencies in ``current`` that are more than ``threshold``
+    (a fraction) slower than the same entry in ``previous``."""
+    before = dict(_latency_leaves(previous.get('results', {})))
+    regressions = []
+    for path, value in _latency_leaves(current.get('results', {})):
+        old = before.get(path)
+        if old and value > old * (1 + threshold):
+            regressions.append({
+                'metric': "/".join(path),
+                'previous_ms': old,
+                'current_ms': value,
+                'change': round(value / old - 1, 3),
+            })
+    return regressions
+
+
+def write_report(report, output=None, compare=None, threshold=0.2):
+    """Print (and optionally save) the report. With ``compare``, regressions
+    against that earlier report are added and the exit status is 1 if any
+    were found."""
+    status = 0
+    if compare:
+        with open(compare) as f:
+            regressions = compare_reports(report, json.load(f), threshold)
+        report['regressions'] = regressions
+        for regression in regressions:
+            print(f"REGRESSION {regression['metric']}: {regression['previous_ms']}ms -> "
+                  f"{regression['current_ms']}ms (+{regression['change'] * 100:.0f}%)", file=sys.stderr)
+        status = 1 if regressions else 0
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
+    print(text)
+    return status
@@ -0,0 +1,166 @@
+"""Compare background removal backends on a folder of sample images.
+
+Each backend runs in a fresh process so its memory can be measured on its
+own. The process reports:
+
+- RSS after import, RSS after loading the backend and peak RSS
+- per-image latency of background removal alone and of the whole
+  preprocessing pipeline (p50/p95/mean)
+
+Every backend's preprocessed images are then classified with the same
+classifier. The report gives Milk vs Milk+Oil agreement with the first
+backend (u2net by default) and the mean probability difference, printed as
+JSON.
+
+Usage:
+    python scripts/benchmark_bg_backends.py --images samples/
+    python scripts/benchmark_bg_backends.py --images samples/ --backends u2net silueta threshold
+
+Set LOCAL_MODEL_DIR to load u2net.onnx / u2netp.onnx / silueta.onnx from a
+folder; otherwise rembg downloads them.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import multiprocessing
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+
+
+def rss_mib():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    return 0.0
+
+
+def find_images(directory):
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in sorted(files)
+                     if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+    return paths
+
+
+def summarize(seconds):
+    return {
+        'p50_ms': round(float(np.percentile(seconds, 50)) * 1000, 2),
+        'p95_ms': round(float(np.percentile(seconds, 95)) * 1000, 2),
+        'mean_ms': round(float(np.mean(seconds)) * 1000, 2),
+    }
+
+
+def _run_backend(backend, paths, config, results):
+    from app.config import Config
+    from app.models.sessions import create_bg_session, session_options
+    from app.services.image_processing import pipeline_options, open_image, remove_background, preprocess_image
+
+    import_rss = rss_mib()
+    local_dir = config.get('LOCAL_MODEL_DIR')
+    model_path = os.path.join(local_dir, f"{backend}.onnx") if local_dir else None
+    if model_path and not os.path.exists(model_path):
+        model_path = None
+
+    started = time.perf_counter()
+    session = create_bg_session(backend, model_path, session_options(config), config['BG_GRABCUT_ITERATIONS'])
+    load_seconds = time.perf_counter() - started
+    loaded_rss = rss_mib()
+
+    options = pipeline_options(config, Config.MODEL_INPUT_SIZE)
+    bg_seconds, pipeline_seconds, arrays = [], [], []
+    for path in paths:
+        with open(path, 'rb') as f:
+            image_data = f.read()
+
+        image = open_image(image_data, options['max_pixels'], options['decode_min_side'])
+        started = time.perf_counter()
+        remove_background(image.convert("RGB"), session, options['bg_removal_mode'], options['bg_working_size'])
+        bg_seconds.append(time.perf_counter() - started)
+
+        image = open_image(image_data, options['max_pixels'], options['decode_min_side'])
+        started = time.perf_counter()
+        processed = preprocess_image(image, session, options)
+        pipeline_seconds.append(time.perf_counter() - started)
+        arrays.append(np.asarray(processed.convert("RGB"), dtype=np.uint8))
+
+    results.put({
+        'backend': backend,
+        'model_path': model_path,
+        'load_seconds': round(load_seconds, 3),
+        'rss_after_import_mib': import_rss,
+        'rss_after_load_mib': loaded_rss,
+        'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'background_removal': summarize(bg_seconds),
+        'pipeline': summarize(pipeline_seconds),
+        'images': np.stack(arrays),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', required=True, help="Folder of sample images (searched recursively)")
+    parser.add_argument('--backends', nargs='+', default=['u2net', 'u2netp', 'silueta', 'threshold', 'grabcut'],
+                        help="Backends to compare; agreement is measured against the first")
+    parser.add_argument('--no-classify', action='store_true', help="Skip the classification agreement")
+    args = parser.parse_args()
+
+    from flask import Flask
+    from app.config import Config
+
+    app = Flask('app')
+    app.config.from_object(Config)
+    # Plain dict so it can be sent to the spawned processes
+    config = dict(app.config)
+
+    paths = find_images(args.images)
+    if not paths:
+        print(f"No images found in {args.images}", file=sys.stderr)
+        return 1
+
+    ctx = multiprocessing.get_context('spawn')
+    runs = []
+    for backend in args.backends:
+        results = ctx.Queue()
+        process = ctx.Process(target=_run_backend, args=(backend, paths, config, results))
+        process.start()
+        run = results.get()
+        process.join()
+        runs.append(run)
+        print(json.dumps({k: v for k, v in run.items() if k != 'images'}), file=sys.stderr)
+
+    if not args.no_classify:
+        from app.models.models import load_classifier
+        model = load_classifier(app)
+        class_names = app.config['CLASS_NAMES']
+
+        reference = None
+        for run in runs:
+            probabilities = np.asarray(model.predict(run['images'].astype(np.float32), verbose=0)).reshape(-1)
+            predicted = np.where(probabilities > 0.5, class_names[1], class_names[0])
+            if reference is None:
+                reference = (probabilities, predicted)
+            run['classification'] = {
+                'counts': {name: int(np.sum(predicted == name)) for name in class_names},
+                'agreement_with_' + args.backends[0]: round(float(np.mean(predicted == reference[1])), 4),
+                'mean_abs_probability_diff': round(float(np.mean(np.abs(probabilities - reference[0]))), 5),
+            }
+
+    report = {
+        'images': len(paths),
+        'bg_removal_mode': app.config['BG_REMOVAL_MODE'],
+        'backends': [{k: v for k, v in run.items() if k != 'images'} for run in runs],
+    }
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""Per-stage benchmark of the prediction pipeline.
+
+Runs every stage of app/services/image_processing.py, the classifier and the
+response encoding on fixture images at several resolutions. For each
+resolution and stage it reports p50/p95/p99 latency and throughput, plus
+the process's peak RSS, as JSON. By default the fixtures are synthetic,
+deterministic captures; pass --images to use real ones instead. Models are
+loaded the way the app loads them, following the current environment
+(BG_REMOVAL_BACKEND, INFERENCE_ENGINE, quantization and so on).
+--stub-models swaps in the OpenCV threshold segmenter and a NumPy
+classifier, so pipeline code can be benchmarked without model weights.
+
+Usage:
+    python scripts/benchmark_pipeline.py --output baseline.json
+    python scripts/benchmark_pipeline.py --compare baseline.json --threshold 0.15
+    python scripts/benchmark_pipeline.py --stub-models --resolutions 640x480 4032x3024
+
+With --compare the exit status is 1 if any percentile regressed by more than
+--threshold, so the script can gate a deploy.
+"""
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from bench_common import (
+    DEFAULT_RESOLUTIONS, fixture_set, load_image_folder, latency_summary, peak_rss_mib,
+    run_metadata, stub_classifier, write_report
+)
+
+
+def timed(samples, stage, fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    samples.setdefault(stage, []).append(time.perf_counter() - started)
+    return result
+
+
+def load_models(app, stub):
+    if stub:
+        from app.models.sessions import ThresholdSession
+        return ThresholdSession(), stub_classifier
+
+    from app.models.models import initialize_models
+    u2net_session, _, infer = initialize_models(app)
+    return u2net_session, infer
+
+
+def benchmark_image(image_data, session, infer, options, samples):
+    import tensorflow as tf
+    from app.services import image_processing as ip
+    from app.services.prediction import encode_processed_image
+
+    image = timed(samples, 'open_image', ip.open_image, image_data, options['max_pixels'], options['decode_min_side'])
+    image = timed(samples, 'decode', lambda: image.convert("RGB"))
+    no_bg = timed(samples, 'remove_background', ip.remove_background,
+                  image, session, options['bg_removal_mode'], options['bg_working_size'])
+
+    if options['pipeline'] == 'fused':
+        processed = timed(samples, 'fused_preprocess', ip.fused_preprocess,
+                          no_bg, options['output_size'], options['working_size'])
+    else:
+        cropped = timed(samples, 'crop_foreground', ip.crop_foreground, no_bg)
+        flattened = timed(samples, 'flatten_on_white', ip.flatten_on_white, cropped)
+        corrected = timed(samples, 'correct_blue_tint', ip.correct_blue_tint, flattened)
+        gamma = timed(samples, 'gamma_correction', ip.gamma_correction, corrected)
+        contrast = timed(samples, 'adaptive_histogram', ip.adaptive_histogram, gamma)
+        processed = timed(samples, 'resize', contrast.resize, options['output_size'], ip.Image.Resampling.LANCZOS)
+
+    batch = tf.keras.preprocessing.image.img_to_array(processed)[np.newaxis]
+    timed(samples, 'classify', infer, batch)
+    timed(samples, 'encode_response_image', encode_processed_image, processed)
+
+    def end_to_end():
+        result = ip.preprocess_image_bytes(image_data, session, options)
+        infer(tf.keras.preprocessing.image.img_to_array(result)[np.newaxis])
+        encode_processed_image(result)
+
+    timed(samples, 'end_to_end', end_to_end)
+
+
+def benchmark_batches(infer, output_size, batch_sizes, repeat):
+    """Classifier throughput at several batch sizes, in images per second."""
+    rng = np.random.default_rng(0)
+    results = {}
+    for batch_size in batch_sizes:
+        batch = rng.uniform(0, 255, size=(batch_size, *output_size, 3)).astype(np.float32)
+        infer(batch)
+        seconds = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            infer(batch)
+            seconds.append(time.perf_counter() - started)
+        summary = latency_summary(seconds)
+        summary['images_per_second'] = round(batch_size / float(np.mean(seconds)), 2)
+        results[f"batch_{batch_size}"] = summary
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resolutions', nargs='+', default=DEFAULT_RESOLUTIONS, help="Fixture sizes, WIDTHxHEIGHT")
+    parser.add_argument('--images', help="Folder of real images to use instead of the synthetic fixtures")
+    parser.add_argument('--variants', type=int, default=3, help="Synthetic images per resolution")
+    parser.add_argument('--repeat', type=int, default=5, help="Measured runs per image")
+    parser.add_argument('--warmup', type=int, default=1, help="Unmeasured runs per image")
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 4, 8])
+    parser.add_argument('--stub-models', action='store_true', help="Benchmark without model weights")
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    parser.add_argument('--compare', help="Previous report to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Allowed slowdown as a fraction")
+    args = parser.parse_args()
+
+    from flask import Flask
+    from app.config import Config
+    from app.utils.logging_config import setup_logging
+    from app.services.image_processing import pipeline_options
+
+    app = Flask('app')
+    app.config.from_object(Config)
+    app.config['INFERENCE_SERVER_ADDRESS'] = None
+    setup_logging(app)
+
+    started = time.perf_counter()
+    session, infer = load_models(app, args.stub_models)
+    load_seconds = time.perf_counter() - started
+    options = pipeline_options(app.config, app.config['MODEL_INPUT_SIZE'])
+
+    fixtures = load_image_folder(args.images) if args.images else fixture_set(args.resolutions, args.variants)
+
+    results = {}
+    with app.app_context():
+        for label, images in fixtures.items():
+            samples = {}
+            for image_data in images:
+                for _ in range(args.warmup):
+                    benchmark_image(image_data, session, infer, options, {})
+                for _ in range(args.repeat):
+                    benchmark_image(image_data, session, infer, options, samples)
+            results[label] = {stage: latency_summary(seconds) for stage, seconds in samples.items()}
+            print(f"{label}: end_to_end p50 {results[label]['end_to_end']['p50_ms']}ms", file=sys.stderr)
+
+        results['classifier_batches'] = benchmark_batches(infer, options['output_size'], args.batch_sizes, args.repeat * 4)
+
+    report = {
+        'benchmark': 'pipeline',
+        'metadata': run_metadata(
+            stub_models=args.stub_models,
+            model_load_seconds=round(load_seconds, 3),
+            pipeline_options={key: value for key, value in options.items() if key != 'output_size'},
+            bg_removal_backend=app.config['BG_REMOVAL_BACKEND'],
+            inference_engine=app.config['INFERENCE_ENGINE'],
+        ),
+        'results': results,
+        'peak_rss_mib': peak_rss_mib(),
+    }
+    return write_report(report, args.output, args.compare, args.threshold)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
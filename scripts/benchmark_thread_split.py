@@ -0,0 +1,152 @@
+"""Compare model throughput at different worker/thread splits.
+
+For each split ``WORKERSxTHREADS`` the script starts WORKERS processes, the
+way gunicorn workers would run. Each process builds its own u2net session
+(and, with --classifier, loads the classifier) limited to THREADS intra-op
+threads. All of them then run inference concurrently for --duration seconds.
+The script reports the aggregate throughput and the per-call latency
+percentiles as JSON, so a split can be chosen for a host before setting
+WEB_CONCURRENCY, ORT_INTRA_OP_THREADS and TF_INTRA_OP_THREADS.
+
+Usage:
+    python scripts/benchmark_thread_split.py --model ~/.u2net/u2net.onnx
+    python scripts/benchmark_thread_split.py --model ~/.u2net/u2net.onnx \\
+        --classifier milk_adulterant_detector_model_v7.keras --splits 1x4 2x2 4x1
+
+Without --splits, every split whose WORKERS x THREADS equals the core count
+is tried, plus the untuned baseline (one process with runtime defaults,
+THREADS=0).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def default_splits(cores):
+    splits = [(1, 0)]
+    for workers in range(1, cores + 1):
+        if cores % workers == 0:
+            splits.append((workers, cores // workers))
+    return splits
+
+
+def parse_split(value):
+    workers, threads = value.lower().split('x')
+    return int(workers), int(threads)
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)) * 1000, 2) if values else 0.0
+
+
+def _worker(args, threads, start_event, results):
+    from PIL import Image
+    from app.models.sessions import create_u2net_session
+
+    options = None
+    if threads:
+        options = {
+            'intra_op_num_threads': threads,
+            'inter_op_num_threads': 1,
+            'graph_optimization_level': args.graph_optimization_level,
+            'enable_cpu_mem_arena': True,
+            'enable_mem_pattern': True,
+        }
+    session = create_u2net_session(args.model, options)
+
+    classify = None
+    if args.classifier:
+        import tensorflow as tf
+        if threads:
+            tf.config.threading.set_intra_op_parallelism_threads(threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        model = tf.keras.models.load_model(args.classifier, safe_mode=False)
+        batch = np.random.default_rng(1).uniform(0, 255, size=(1, 224, 224, 3)).astype(np.float32)
+        classify = lambda: model(batch, training=False)
+
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 255, size=(480, 640, 3), dtype=np.uint8))
+
+    def step():
+        session.predict(image)
+        if classify is not None:
+            classify()
+
+    for _ in range(args.warmup):
+        step()
+
+    start_event.wait()
+    latencies = []
+    deadline = time.perf_counter() + args.duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        step()
+        latencies.append(time.perf_counter() - started)
+    results.put(latencies)
+
+
+def run_split(args, workers, threads):
+    ctx = multiprocessing.get_context('spawn')
+    start_event = ctx.Event()
+    results = ctx.Queue()
+    processes = [ctx.Process(target=_worker, args=(args, threads, start_event, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+
+    # Give every process time to load and warm up before measuring together
+    time.sleep(args.startup)
+    start_event.set()
+
+    latencies = []
+    for _ in processes:
+        latencies.extend(results.get())
+    for process in processes:
+        process.join()
+
+    return {
+        'workers': workers,
+        'threads_per_worker': threads,
+        'calls': len(latencies),
+        'throughput_per_second': round(len(latencies) / args.duration, 2),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=os.path.expanduser("~/.u2net/u2net.onnx"), help="u2net ONNX file")
+    parser.add_argument('--classifier', help="Keras classifier to run after u2net in every step")
+    parser.add_argument('--splits', nargs='+', type=parse_split, help="WORKERSxTHREADS, e.g. 2x2")
+    parser.add_argument('--cores', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--duration', type=float, default=20.0, help="Measured seconds per split")
+    parser.add_argument('--warmup', type=int, default=3, help="Unmeasured calls per process")
+    parser.add_argument('--startup', type=float, default=15.0, help="Seconds to wait for processes to load")
+    parser.add_argument('--graph-optimization-level', default='all')
+    args = parser.parse_args()
+
+    report = {
+        'cores': args.cores,
+        'model': args.model,
+        'classifier': args.classifier,
+        'duration_seconds': args.duration,
+        'splits': [],
+    }
+    for workers, threads in args.splits or default_splits(args.cores):
+        result = run_split(args, workers, threads)
+        report['splits'].append(result)
+        print(json.dumps(result), file=sys.stderr)
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
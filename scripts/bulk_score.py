@@ -0,0 +1,369 @@
+"""Offline bulk scoring of past captures, without the web app or Firebase.
+
+Reads images from a directory, a zip file or a tar archive (optionally
+compressed). Entries are streamed one at a time, so the archive is never
+unpacked or held in memory. Images are preprocessed in a pool of worker
+processes with the same pipeline as /predict (app/services/image_processing.py)
+and classified in large batches. Models are loaded with ``initialize_models``
+and follow the same environment variables as the app
+(CLASSIFICATION_MODEL_NAME, BG_REMOVAL_BACKEND, INFERENCE_ENGINE,
+quantization and so on).
+
+Results are appended to a CSV or JSONL file (by extension) after every
+batch, and ``<output>.checkpoint.json`` records progress and the model
+version. Rerunning the same command resumes: entries already in the output
+are skipped. A resume with a different model version is refused unless
+--restart is given, which starts a fresh output.
+
+Usage:
+    python scripts/bulk_score.py captures/ --output scores.csv
+    python scripts/bulk_score.py captures-2024.tar.gz --output scores.jsonl --workers 8 --batch-size 128
+"""
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import zipfile
+import tarfile
+import argparse
+from collections import deque, defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+FIELDS = ['path', 'status', 'predicted_class', 'probability', 'error']
+
+logger = logging.getLogger('bulk_score')
+
+
+class OfflineApp:
+    """The parts of a Flask app that model loading uses: ``config`` and
+    ``logger``."""
+
+    def __init__(self, overrides=None):
+        from app.config import Config
+        self.config = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+        self.config.update(overrides or {})
+        self.logger = logger
+
+
+def is_image(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def iter_images(source):
+    """Yield ``(path, bytes)`` for every image in a directory, zip or tar, in
+    a stable order. Paths are relative to the source."""
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if is_image(name):
+                    full_path = os.path.join(root, name)
+                    with open(full_path, 'rb') as f:
+                        yield os.path.relpath(full_path, source).replace(os.sep, '/'), f.read()
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and is_image(info.filename):
+                    yield info.filename, archive.read(info)
+    elif tarfile.is_tarfile(source):
+        # Stream mode reads members in archive order without seeking
+        with tarfile.open(source, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and is_image(member.name):
+                    yield member.name, archive.extractfile(member).read()
+    else:
+        raise SystemExit(f"{source} is not a directory, zip file or tar archive")
+
+
+class ResultWriter:
+    """Appends result rows to CSV or JSONL and flushes after every batch."""
+
+    def __init__(self, path):
+        self.path = path
+        self.format = 'jsonl' if path.endswith(('.jsonl', '.json')) else 'csv'
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self._file = open(path, 'a', newline='')
+        if self.format == 'csv':
+            self._writer = csv.DictWriter(self._file, fieldnames=FIELDS)
+            if not exists:
+                self._writer.writeheader()
+
+    def write(self, rows):
+        for row in rows:
+            if self.format == 'csv':
+                self._writer.writerow(row)
+            else:
+                self._file.write(json.dumps(row) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def completed_paths(path):
+    """Paths already in an output file. A partly written last line (from an
+    interrupted run) is cut off so the file can be appended to."""
+    if not os.path.exists(path):
+        return set()
+
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    lines = data[:end].decode('utf-8').splitlines()
+
+    if path.endswith(('.jsonl', '.json')):
+        return {json.loads(line)['path'] for line in lines if line.strip()}
+    return {row['path'] for row in csv.DictReader(lines)}
+
+
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path, checkpoint):
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(temp_path, path)
+
+
+class Stats:
+    def __init__(self, resumed):
+        self.started = time.perf_counter()
+        self.resumed = resumed
+        self.scored = 0
+        self.errors = 0
+        self.classify_seconds = 0.0
+        self.batches = 0
+        self.stage_seconds = defaultdict(float)
+        self.classes = defaultdict(int)
+        self._last_report = self.started
+
+    def add_timings(self, timings):
+        for stage, seconds in timings.items():
+            self.stage_seconds[stage] += seconds
+
+    def progress(self, every_seconds=10):
+        now = time.perf_counter()
+        if now - self._last_report >= every_seconds:
+            self._last_report = now
+            done = self.scored + self.errors
+            logger.info(f"{done} images in {now - self.started:.0f}s ({done / (now - self.started):.1f}/s), "
+                        f"{self.errors} errors")
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        done = self.scored + self.errors
+        return {
+            'images_scored': self.scored,
+            'errors': self.errors,
+            'skipped_from_checkpoint': self.resumed,
+            'elapsed_seconds': round(elapsed, 2),
+            'images_per_second': round(done / elapsed, 2) if elapsed else None,
+            'batches': self.batches,
+            'classify_seconds': round(self.classify_seconds, 2),
+            'classify_images_per_second': round(self.scored / self.classify_seconds, 1) if self.classify_seconds else None,
+            # Summed over all workers, so they can exceed the wall time
+            'preprocess_stage_seconds': {stage: round(seconds, 2) for stage, seconds in self.stage_seconds.items()},
+            'predicted_classes': dict(self.classes),
+        }
+
+
+class Scorer:
+    """Preprocessing in flight in submission order, and the batch waiting
+    for the classifier."""
+
+    def __init__(self, app, u2net_session, infer, workers, window):
+        from app.services.image_processing import pipeline_options
+        self.app = app
+        self.u2net_session = u2net_session
+        self.infer = infer
+        self.options = pipeline_options(app.config, app.config['MODEL_INPUT_SIZE'])
+        self.pool = None
+        if workers > 0:
+            from app.services.preprocess_pool import PreprocessPool
+            from app.models.sessions import OPENCV_BACKENDS, session_options
+            send_session = app.config['BG_REMOVAL_BACKEND'] in OPENCV_BACKENDS
+            self.pool = PreprocessPool(
+                workers, window,
+                u2net_model_path=app.config.get('U2NET_MODEL_PATH'),
+                u2net_session=u2net_session if send_session else None,
+                session_options=session_options(app.config),
+                bg_backend=app.config['BG_REMOVAL_BACKEND'],
+            )
+        self.window = window
+        self.pending = deque()
+
+    def submit(self, path, image_data):
+        if self.pool is not None:
+            self.pending.append((path, self.pool.submit(image_data, self.options)))
+        else:
+            self.pending.append((path, (image_data, self.options)))
+
+    def full(self):
+        return len(self.pending) >= self.window
+
+    def next_preprocessed(self, stats):
+        """``(path, image or None, error or None)`` for the oldest job."""
+        from app.services.image_processing import preprocess_image_bytes
+        path, job = self.pending.popleft()
+        try:
+            if self.pool is not None:
+                processed = job.result()
+                stats.add_timings(getattr(job, 'timings', {}))
+            else:
+                timings = {}
+                processed = preprocess_image_bytes(job[0], self.u2net_session, job[1], timings)
+                stats.add_timings(timings)
+            return path, processed, None
+        except Exception as e:
+            return path, None, f"{type(e).__name__}: {str(e)}"
+
+    def classify(self, batch, stats):
+        class_names = self.app.config['CLASS_NAMES']
+        start = time.perf_counter()
+        arrays = np.stack([np.asarray(image, dtype=np.float32) for _, image in batch])
+        probabilities = np.asarray(self.infer(arrays)).reshape(len(batch), -1)[:, 0]
+        stats.classify_seconds += time.perf_counter() - start
+        stats.batches += 1
+
+        rows = []
+        for (path, _), probability in zip(batch, probabilities):
+            predicted_class = class_names[1 if probability > 0.5 else 0]
+            stats.classes[predicted_class] += 1
+            rows.append({'path': path, 'status': 'success', 'predicted_class': predicted_class,
+                         'probability': round(float(probability), 6), 'error': ''})
+        stats.scored += len(rows)
+        return rows
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help="Directory, .zip or .tar[.gz|.bz2|.xz] of images")
+    parser.add_argument('--output', required=True, help="Results file, .csv or .jsonl")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="Preprocessing processes (0 preprocesses in this process)")
+    parser.add_argument('--batch-size', type=int, default=64, help="Images per classifier call")
+    parser.add_argument('--restart', action='store_true', help="Discard an existing output and checkpoint")
+    parser.add_argument('--report', help="Also write the throughput report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s', stream=sys.stderr)
+
+    from app.models.models import initialize_models
+    from app.services.result_cache import model_version_tag
+
+    # No inference server and no web request path: batching and the per-request
+    # pool are not used, but the thread split still accounts for the workers
+    app = OfflineApp({
+        'INFERENCE_SERVER_ADDRESS': None,
+        'INFERENCE_SERVER_MODE': 'per-worker',
+        'WEB_CONCURRENCY': 1,
+        'PREPROCESS_WORKERS': args.workers,
+    })
+    version = model_version_tag(app.config)
+
+    checkpoint_path = args.output + ".checkpoint.json"
+    checkpoint = load_checkpoint(checkpoint_path)
+    if args.restart:
+        for path in (args.output, checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+        checkpoint = None
+    elif checkpoint is not None and checkpoint['model_version'] != version:
+        raise SystemExit(
+            f"{args.output} was scored with a different model configuration:\n  {checkpoint['model_version']}\n"
+            f"now:\n  {version}\nUse --restart to score again from scratch, or write to another --output."
+        )
+
+    done = completed_paths(args.output)
+    if done:
+        logger.info(f"Resuming: {len(done)} images already scored in {args.output}")
+
+    load_start = time.perf_counter()
+    u2net_session, _, infer = initialize_models(app)
+    logger.info(f"Models loaded in {time.perf_counter() - load_start:.1f}s")
+
+    scorer = Scorer(app, u2net_session, infer, args.workers, window=max(args.batch_size, args.workers * 4))
+    writer = ResultWriter(args.output)
+    stats = Stats(resumed=len(done))
+    checkpoint = checkpoint or {'source': os.path.abspath(args.source), 'model_version': version, 'runs': []}
+    checkpoint['runs'].append({'started': time.strftime('%Y-%m-%dT%H:%M:%S%z')})
+    batch = []
+
+    def flush():
+        rows = scorer.classify(batch, stats) if batch else []
+        batch.clear()
+        return rows
+
+    def drain_one():
+        path, processed, error = scorer.next_preprocessed(stats)
+        if error is not None:
+            stats.errors += 1
+            logger.warning(f"{path}: {error}")
+            return [{'path': path, 'status': 'error', 'predicted_class': '', 'probability': '', 'error': error}]
+        batch.append((path, processed))
+        return flush() if len(batch) >= args.batch_size else []
+
+    def write(rows):
+        if rows:
+            writer.write(rows)
+            checkpoint['completed'] = len(done) + stats.scored + stats.errors
+            checkpoint['runs'][-1].update(stats.report())
+            save_checkpoint(checkpoint_path, checkpoint)
+            stats.progress()
+
+    try:
+        for path, image_data in iter_images(args.source):
+            if path in done:
+                continue
+            while scorer.full():
+                write(drain_one())
+            scorer.submit(path, image_data)
+
+        while scorer.pending:
+            write(drain_one())
+        write(flush())
+    finally:
+        writer.close()
+        scorer.shutdown()
+
+    report = {
+        'source': args.source,
+        'output': args.output,
+        'workers': args.workers,
+        'batch_size': args.batch_size,
+        'model_version': version,
+        **stats.report(),
+    }
+    checkpoint['runs'][-1].update(stats.report())
+    checkpoint['completed'] = len(done) + stats.scored + stats.errors
+    save_checkpoint(checkpoint_path, checkpoint)
+
+    text = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, 'w') as f:
+            f.write(text)
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
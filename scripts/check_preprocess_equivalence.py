@@ -0,0 +1,70 @@
+"""Numerical equivalence check between the fused and legacy preprocessing.
+
+Runs ``fused_preprocess`` and ``legacy_preprocess`` on the same RGBA inputs
+(background-removed PNGs from a folder, or synthetic samples when no folder
+is given) and fails if any output pixel differs by more than the tolerance.
+
+Usage:
+    python scripts/check_preprocess_equivalence.py [--images DIR] [--tolerance 2]
+"""
+import os
+import sys
+import argparse
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.image_processing import fused_preprocess, legacy_preprocess
+
+
+def synthetic_samples(count=8, seed=0):
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        height, width = rng.integers(200, 1600, size=2)
+        rgb = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        # Smooth gradient so CLAHE sees realistic structure, not only noise
+        rgb = ((rgb.astype(np.uint16) + np.linspace(0, 255, width, dtype=np.uint16)[np.newaxis, :, np.newaxis]) // 2).astype(np.uint8)
+
+        alpha = np.zeros((height, width), dtype=np.uint8)
+        y0, x0 = rng.integers(0, height // 3), rng.integers(0, width // 3)
+        y1, x1 = rng.integers(2 * height // 3, height), rng.integers(2 * width // 3, width)
+        alpha[y0:y1, x0:x1] = 255
+        alpha[y0:y1, x0:x0 + 8] = np.linspace(0, 255, 8, dtype=np.uint8)  # soft edge
+
+        yield f"synthetic-{i}", Image.fromarray(np.dstack([rgb, alpha]), "RGBA")
+
+
+def folder_samples(directory):
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith((".png", ".webp")):
+            yield name, Image.open(os.path.join(directory, name)).convert("RGBA")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="Folder of background-removed RGBA images")
+    parser.add_argument("--tolerance", type=int, default=2, help="Maximum allowed per-pixel difference")
+    parser.add_argument("--working-size", type=int, default=0, help="Working size passed to the fused pipeline")
+    args = parser.parse_args()
+
+    samples = folder_samples(args.images) if args.images else synthetic_samples()
+    worst = 0
+    for name, image in samples:
+        legacy = np.asarray(legacy_preprocess(image), dtype=np.int16)
+        fused = np.asarray(fused_preprocess(image, working_size=args.working_size), dtype=np.int16)
+        diff = np.abs(legacy - fused)
+        worst = max(worst, int(diff.max()))
+        print(f"{name}: max abs diff {int(diff.max())}, mean abs diff {diff.mean():.4f}")
+
+    if worst > args.tolerance:
+        print(f"FAILED: max abs diff {worst} exceeds tolerance {args.tolerance}")
+        return 1
+
+    print(f"OK: max abs diff {worst} within tolerance {args.tolerance}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
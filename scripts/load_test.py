@@ -0,0 +1,254 @@
+"""Load generator for /predict.
+
+Two targets:
+
+- ``test-client`` (default): builds the app in this process with
+  ``create_app`` and drives it through Flask test clients, one per
+  concurrent user. Firebase initialisation is stubbed out and every client
+  gets a signed-in session, so no credentials are needed. With
+  --stub-models the OpenCV threshold segmenter and a NumPy classifier
+  replace the real models.
+- ``http``: sends real HTTP requests to a running server, e.g. a local
+  gunicorn. The login is stubbed by signing a session cookie with the
+  server's SECRET_KEY (--secret-key, or the SECRET_KEY environment
+  variable).
+
+The report gives status counts, throughput and p50/p95/p99 latency as JSON,
+plus peak RSS: of this process for test-client, or of --server-pid and its
+children for http. Requests cycle through several distinct fixture images
+per resolution. To measure the pipeline rather than the result cache, run
+the server with RESULT_CACHE_BACKEND=none; test-client does this unless
+--allow-cache is given.
+
+Usage:
+    python scripts/load_test.py --stub-models --concurrency 8 --requests 400
+    SECRET_KEY=... gunicorn -c gunicorn.conf.py run:app &
+    SECRET_KEY=... python scripts/load_test.py --target http --url http://127.0.0.1:7860 \\
+        --server-pid $(pgrep -of gunicorn) --duration 60 --output run.json
+"""
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from collections import Counter
+
+from bench_common import (
+    DEFAULT_RESOLUTIONS, fixture_set, load_image_folder, latency_summary, peak_rss_mib,
+    run_metadata, stub_classifier, write_report
+)
+
+LOAD_TEST_USER = {'user_id': 'load-test', 'email': 'load-test@example.com'}
+
+
+class RequestSource:
+    """Hands out (label, image bytes) round-robin until the request budget or
+    the deadline runs out."""
+
+    def __init__(self, fixtures, total=None, duration=None):
+        self.items = [(label, image) for label, images in fixtures.items() for image in images]
+        self.total = total
+        self.deadline = time.perf_counter() + duration if duration else None
+        self._issued = 0
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            if self.total is not None and self._issued >= self.total:
+                return None
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                return None
+            item = self.items[self._issued % len(self.items)]
+            self._issued += 1
+            return item
+
+
+def build_body(image_data, payload):
+    if payload == 'json':
+        data_url = "data:image/jpeg;base64," + base64.b64encode(image_data).decode('ascii')
+        return json.dumps({'image': data_url}).encode('utf-8'), 'application/json'
+    return image_data, 'image/jpeg'
+
+
+def predict_path(args):
+    path = f"/predict?image={args.image_mode}"
+    if args.image_format:
+        path += f"&image_format={args.image_format}"
+    return path
+
+
+def test_client_sender(args):
+    """Return ``(send, app)`` where ``send(body, content_type)`` posts to an
+    in-process app through a per-thread, signed-in test client."""
+    if not args.allow_cache:
+        os.environ['RESULT_CACHE_BACKEND'] = 'none'
+    os.environ.setdefault('MODEL_LOAD_MODE', 'eager')
+
+    from app.services import firebase_service
+    firebase_service.initialize_firebase = lambda app: app.logger.info("Firebase initialization skipped (load test)")
+
+    if args.stub_models:
+        from app.models import models
+        from app.models.sessions import ThresholdSession
+
+        def stub_models(app, timings=None):
+            app.logger.info("Using stub models (load test)")
+            return ThresholdSession(), None, stub_classifier
+
+        models.initialize_models = stub_models
+
+    from app import create_app
+    app = create_app()
+    local = threading.local()
+
+    def send(body, content_type):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app.test_client()
+            with client.session_transaction() as session:
+                session.update(LOAD_TEST_USER)
+        response = client.post(predict_path(args), data=body, content_type=content_type)
+        return response.status_code
+
+    return send, app
+
+
+def http_sender(args):
+    from flask import Flask
+    from flask.sessions import SecureCookieSessionInterface
+
+    secret_key = args.secret_key or os.environ.get('SECRET_KEY')
+    if not secret_key:
+        raise SystemExit("--target http needs --secret-key or SECRET_KEY to sign a session cookie")
+
+    signer = Flask('load_test')
+    signer.secret_key = secret_key
+    cookie = SecureCookieSessionInterface().get_signing_serializer(signer).dumps(dict(LOAD_TEST_USER))
+    url = args.url.rstrip('/') + predict_path(args)
+
+    def send(body, content_type):
+        request = urllib.request.Request(url, data=body, method='POST', headers={
+            'Content-Type': content_type,
+            'Cookie': f"session={cookie}",
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=args.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    return send
+
+
+def server_peak_rss(pid):
+    """Peak RSS of a server process and its direct children."""
+    if pid is None:
+        return None
+    pids = [pid]
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return {str(p): peak_rss_mib(p) for p in pids}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=('test-client', 'http'), default='test-client')
+    parser.add_argument('--url', default='http://127.0.0.1:7860')
+    parser.add_argument('--secret-key', help="SECRET_KEY of the server (http target)")
+    parser.add_argument('--server-pid', type=int, help="Server process to report peak RSS for (http target)")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200, help="Total requests (ignored with --duration)")
+    parser.add_argument('--duration', type=float, help="Run for this many seconds instead")
+    parser.add_argument('--resolutions', nargs='+', default=DEFAULT_RESOLUTIONS[:2])
+    parser.add_argument('--images', help="Folder of real images to send instead of the synthetic fixtures")
+    parser.add_argument('--variants', type=int, default=8, help="Distinct synthetic images per resolution")
+    parser.add_argument('--payload', choices=('binary', 'json'), default='binary')
+    parser.add_argument('--image-mode', choices=('inline', 'url', 'bytes', 'none'), default='none',
+                        help="?image= response mode")
+    parser.add_argument('--image-format', choices=('jpeg', 'webp', 'thumbnail', 'none'),
+                        help="?image_format= response image (server default when omitted)")
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--stub-models', action='store_true', help="Stub models (test-client target)")
+    parser.add_argument('--allow-cache', action='store_true', help="Keep the result cache on (test-client target)")
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    parser.add_argument('--compare', help="Previous report to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Allowed slowdown as a fraction")
+    args = parser.parse_args()
+
+    if args.target == 'test-client':
+        send, _ = test_client_sender(args)
+    else:
+        send = http_sender(args)
+
+    fixtures = load_image_folder(args.images) if args.images else fixture_set(args.resolutions, args.variants)
+    bodies = {label: [build_body(image, args.payload) for image in images] for label, images in fixtures.items()}
+
+    # One unmeasured request per resolution so first-call costs are excluded
+    for label, items in bodies.items():
+        send(*items[0])
+
+    source = RequestSource(bodies, total=None if args.duration else args.requests, duration=args.duration)
+    latencies = {label: [] for label in bodies}
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def user():
+        while True:
+            item = source.next()
+            if item is None:
+                return
+            label, (body, content_type) = item
+            started = time.perf_counter()
+            try:
+                status = send(body, content_type)
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            with lock:
+                statuses[str(status)] += 1
+                if status == 200:
+                    latencies[label].append(elapsed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user, daemon=True) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    report = {
+        'benchmark': 'load_test',
+        'metadata': run_metadata(
+            target=args.target,
+            url=args.url if args.target == 'http' else None,
+            concurrency=args.concurrency,
+            payload=args.payload,
+            image_mode=args.image_mode,
+            image_format=args.image_format,
+            stub_models=args.stub_models,
+        ),
+        'elapsed_seconds': round(elapsed, 3),
+        'requests': sum(statuses.values()),
+        'statuses': dict(statuses),
+        'results': {
+            'overall': latency_summary(all_latencies, elapsed),
+            **{label: latency_summary(values, elapsed) for label, values in latencies.items()},
+        },
+        'peak_rss_mib': peak_rss_mib() if args.target == 'test-client' else server_peak_rss(args.server_pid),
+    }
+    return write_report(report, args.output, args.compare, args.threshold)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""Local stand-in for Firebase's signing keys, for tests and load tests.
+
+``generate`` writes an RSA private key and a public key set in the format
+AUTH_PUBLIC_KEYS_FILE expects (``{kid: PEM}``). ``mint`` signs an ID token
+or a session cookie with that key, with the claims Firebase would set.
+Point the app at the key set and it will accept the minted tokens on
+/auth/login, /auth/sessionLogin and as the session cookie, without Firebase.
+
+Usage:
+    python scripts/make_test_auth_keys.py generate --out-dir test-keys
+    AUTH_PUBLIC_KEYS_FILE=test-keys/public_keys.json FIREBASE_PROJECT_ID=demo-project ...
+    python scripts/make_test_auth_keys.py mint --out-dir test-keys --project demo-project \\
+        --uid user-1 --email user-1@example.com [--session-cookie]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+
+import rsa
+from google.auth import crypt, jwt
+
+ID_TOKEN_ISSUER = 'https://securetoken.google.com/{project_id}'
+SESSION_COOKIE_ISSUER = 'https://session.firebase.google.com/{project_id}'
+
+
+def generate(out_dir, bits):
+    os.makedirs(out_dir, exist_ok=True)
+    public_key, private_key = rsa.newkeys(bits)
+    key_id = uuid.uuid4().hex
+    with open(os.path.join(out_dir, 'private_key.pem'), 'wb') as f:
+        f.write(private_key.save_pkcs1())
+    with open(os.path.join(out_dir, 'key_id'), 'w') as f:
+        f.write(key_id)
+    with open(os.path.join(out_dir, 'public_keys.json'), 'w') as f:
+        json.dump({key_id: public_key.save_pkcs1().decode('ascii')}, f, indent=2)
+    print(os.path.join(out_dir, 'public_keys.json'))
+
+
+def mint(out_dir, project_id, uid, email, session_cookie, lifetime):
+    with open(os.path.join(out_dir, 'private_key.pem')) as f:
+        private_key = f.read()
+    with open(os.path.join(out_dir, 'key_id')) as f:
+        key_id = f.read().strip()
+
+    now = int(time.time())
+    issuer = SESSION_COOKIE_ISSUER if session_cookie else ID_TOKEN_ISSUER
+    payload = {
+        'iss': issuer.format(project_id=project_id),
+        'aud': project_id,
+        'auth_time': now,
+        'iat': now,
+        'exp': now + lifetime,
+        'sub': uid,
+        'user_id': uid,
+        'email': email,
+        'email_verified': True,
+        'firebase': {'identities': {'email': [email]}, 'sign_in_provider': 'password'},
+    }
+    signer = crypt.RSASigner.from_string(private_key, key_id=key_id)
+    print(jwt.encode(signer, payload).decode('ascii'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = subparsers.add_parser('generate', help="Write a private key and public key set")
+    generate_parser.add_argument('--out-dir', default='test-keys')
+    generate_parser.add_argument('--bits', type=int, default=2048)
+
+    mint_parser = subparsers.add_parser('mint', help="Print a signed ID token or session cookie")
+    mint_parser.add_argument('--out-dir', default='test-keys')
+    mint_parser.add_argument('--project', required=True, help="FIREBASE_PROJECT_ID the app uses")
+    mint_parser.add_argument('--uid', default='test-user')
+    mint_parser.add_argument('--email', default='test-user@example.com')
+    mint_parser.add_argument('--session-cookie', action='store_true', help="Mint a session cookie, not an ID token")
+    mint_parser.add_argument('--lifetime', type=int, default=3600, help="Seconds until expiry")
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        generate(args.out_dir, args.bits)
+    else:
+        mint(args.out_dir, args.project, args.uid, args.email, args.session_cookie, args.lifetime)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""Report the memory used by a running gunicorn deployment.
+
+Reads RSS and PSS (proportional set size, which splits shared pages between
+the processes that map them) for the gunicorn master, its workers and the
+shared inference server from /proc (Linux only), and prints them as JSON.
+Run it once with INFERENCE_SERVER_MODE=per-worker and once with
+INFERENCE_SERVER_MODE=shared, under the same load, to compare memory per
+worker.
+
+Usage:
+    python scripts/measure_worker_rss.py <gunicorn-master-pid>
+"""
+import os
+import sys
+import json
+
+
+def read_kib(path, field):
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def children(pid):
+    result = []
+    task_dir = f"/proc/{pid}/task"
+    for tid in os.listdir(task_dir):
+        try:
+            with open(f"{task_dir}/{tid}/children") as f:
+                result.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return result
+
+
+def process_info(pid):
+    with open(f"/proc/{pid}/cmdline", "rb") as f:
+        cmdline = f.read().replace(b"\0", b" ").decode(errors="replace").strip()
+    return {
+        'pid': pid,
+        'cmdline': cmdline[:120],
+        'rss_mib': round(read_kib(f"/proc/{pid}/status", "VmRSS") / 1024, 1),
+        'pss_mib': round(read_kib(f"/proc/{pid}/smaps_rollup", "Pss") / 1024, 1),
+    }
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(__doc__)
+        return 1
+
+    master = int(sys.argv[1])
+    processes = [process_info(master)] + [process_info(pid) for pid in children(master)]
+    # Spawned children (the inference server, resource tracker) run multiprocessing's bootstrap
+    workers = [p for p in processes[1:] if 'multiprocessing' not in p['cmdline']]
+
+    report = {
+        'processes': processes,
+        'worker_count': len(workers),
+        'total_rss_mib': round(sum(p['rss_mib'] for p in processes), 1),
+        'total_pss_mib': round(sum(p['pss_mib'] for p in processes), 1),
+        'mean_worker_pss_mib': round(sum(p['pss_mib'] for p in workers) / len(workers), 1) if workers else 0.0,
+    }
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,273 @@
+"""Build INT8 variants of u2net and the classifier and report their accuracy.
+
+Runs every sample image through the real preprocessing pipeline with the
+float models, recording the exact u2net inputs and classifier inputs. These
+recordings are the calibration data for:
+
+- u2net: ONNX Runtime dynamic quantization (``u2net.int8-dynamic.onnx``) and
+  static QDQ quantization calibrated on the recorded inputs
+  (``u2net.int8-static.onnx``)
+- classifier: TFLite dynamic-range quantization (``*.int8-dynamic.tflite``)
+  and full integer quantization with a representative dataset
+  (``*.int8-static.tflite``)
+
+Every u2net/classifier combination is then evaluated on the same images. The
+report gives Milk vs Milk+Oil agreement with the float models, probability
+drift, per-stage latency and, when images sit in folders named after a
+class (``Milk/``, ``Milk+Oil/``), accuracy against those labels. Use
+U2NET_QUANTIZATION / CLASSIFIER_QUANTIZATION to serve a variant.
+
+Usage:
+    python scripts/quantize_models.py --images samples/
+    python scripts/quantize_models.py --images samples/ --skip-quantize
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+VARIANTS = ('float', 'dynamic', 'static')
+
+# rembg's u2net normalisation, used to record calibration inputs
+U2NET_MEAN = (0.485, 0.456, 0.406)
+U2NET_STD = (0.229, 0.224, 0.225)
+U2NET_SIZE = (320, 320)
+
+
+class RecordingSession:
+    """Wraps a u2net session and keeps the normalised input of every call."""
+
+    def __init__(self, session):
+        self.session = session
+        self.inputs = []
+
+    def predict(self, img, *args, **kwargs):
+        self.inputs.append(self.session.normalize(img, U2NET_MEAN, U2NET_STD, U2NET_SIZE))
+        return self.session.predict(img, *args, **kwargs)
+
+
+def find_images(directory, class_names):
+    samples = []
+    for root, _, files in os.walk(directory):
+        label = os.path.basename(root)
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                samples.append((os.path.join(root, name), label if label in class_names else None))
+    return samples
+
+
+def preprocess_all(samples, session, options, config):
+    """Return the classifier input batch and the mean u2net+preprocess time."""
+    import tensorflow as tf
+    from app.services.image_processing import open_image, preprocess_image
+
+    arrays = []
+    started = time.perf_counter()
+    for path, _ in samples:
+        with open(path, 'rb') as f:
+            image = open_image(f.read(), config['MAX_IMAGE_PIXELS'], config['DECODE_MIN_SIDE'])
+        arrays.append(tf.keras.preprocessing.image.img_to_array(preprocess_image(image, session, options)))
+    elapsed = time.perf_counter() - started
+    return np.stack(arrays), elapsed / max(len(samples), 1)
+
+
+def quantize_u2net(float_path, output_dir, calibration_inputs, calibrate_method):
+    from onnxruntime.quantization import (
+        CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quantize_dynamic, quantize_static
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    class Reader(CalibrationDataReader):
+        def __init__(self, inputs):
+            self._inputs = iter(inputs)
+
+        def get_next(self):
+            return next(self._inputs, None)
+
+    base_name = os.path.splitext(os.path.basename(float_path))[0]
+    dynamic_path = os.path.join(output_dir, f"{base_name}.int8-dynamic.onnx")
+    static_path = os.path.join(output_dir, f"{base_name}.int8-static.onnx")
+    prepared_path = os.path.join(output_dir, f"{base_name}.prepared.onnx")
+
+    quantize_dynamic(float_path, dynamic_path, weight_type=QuantType.QUInt8)
+    print(f"Wrote {dynamic_path}", file=sys.stderr)
+
+    # Shape inference and graph cleanup give static quantization more to work with
+    quant_pre_process(float_path, prepared_path)
+    quantize_static(
+        prepared_path,
+        static_path,
+        Reader(calibration_inputs),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        calibrate_method={
+            'minmax': CalibrationMethod.MinMax,
+            'entropy': CalibrationMethod.Entropy,
+            'percentile': CalibrationMethod.Percentile,
+        }[calibrate_method]
+    )
+    os.remove(prepared_path)
+    print(f"Wrote {static_path}", file=sys.stderr)
+
+
+def quantize_classifier(model, app, representative_batch):
+    import tensorflow as tf
+    from app.models.models import quantized_model_path
+
+    height, width = app.config['MODEL_INPUT_SIZE']
+
+    @tf.function(input_signature=[tf.TensorSpec(shape=[1, height, width, 3], dtype=tf.float32)])
+    def serve(images):
+        return model(images, training=False)
+
+    def representative_dataset():
+        for row in representative_batch:
+            yield [row[np.newaxis].astype(np.float32)]
+
+    for variant in ('dynamic', 'static'):
+        converter = tf.lite.TFLiteConverter.from_concrete_functions([serve.get_concrete_function()], model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if variant == 'static':
+            # Integer kernels throughout; float input and output are kept so
+            # the serving code does not change
+            converter.representative_dataset = representative_dataset
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+        output_path = quantized_model_path(app.config, app.config['CLASSIFICATION_MODEL_NAME'], variant, 'tflite')
+        with open(output_path, 'wb') as f:
+            f.write(converter.convert())
+        print(f"Wrote {output_path}", file=sys.stderr)
+
+
+def classify_all(infer, batch):
+    started = time.perf_counter()
+    probabilities = np.concatenate([np.asarray(infer(batch[i:i + 8])).reshape(-1) for i in range(0, len(batch), 8)])
+    return probabilities, (time.perf_counter() - started) / max(len(batch), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', required=True, help="Folder of sample images (searched recursively)")
+    parser.add_argument('--output-dir', help="Where to write the models (default: QUANTIZED_MODEL_DIR)")
+    parser.add_argument('--calibration-images', type=int, default=100, help="Images used for calibration")
+    parser.add_argument('--calibrate-method', choices=('minmax', 'entropy', 'percentile'), default='minmax')
+    parser.add_argument('--skip-quantize', action='store_true', help="Only evaluate existing INT8 files")
+    args = parser.parse_args()
+
+    from flask import Flask
+    from app.config import Config
+    from app.models.models import load_u2net_session, load_classifier, quantized_model_path, _build_tflite_infer
+    from app.models.sessions import create_u2net_session, session_options
+    from app.services.image_processing import pipeline_options
+
+    app = Flask('app')
+    app.config.from_object(Config)
+    app.config.update(U2NET_QUANTIZATION='none', CLASSIFIER_QUANTIZATION='none', INFERENCE_SERVER_ADDRESS=None)
+    if args.output_dir:
+        app.config['QUANTIZED_MODEL_DIR'] = args.output_dir
+    os.makedirs(app.config['QUANTIZED_MODEL_DIR'], exist_ok=True)
+
+    class_names = app.config['CLASS_NAMES']
+    samples = find_images(args.images, class_names)
+    if not samples:
+        print(f"No images found in {args.images}", file=sys.stderr)
+        return 1
+
+    with app.app_context():
+        float_session = load_u2net_session(app)
+        float_u2net_path = app.config['U2NET_MODEL_PATH'] or os.path.join(
+            os.environ.get('U2NET_HOME', os.path.expanduser("~/.u2net")), "u2net.onnx"
+        )
+        model = load_classifier(app)
+        options = pipeline_options(app.config, app.config['MODEL_INPUT_SIZE'])
+
+        if not args.skip_quantize:
+            calibration = samples[:args.calibration_images]
+            recorder = RecordingSession(float_session)
+            calibration_batch, _ = preprocess_all(calibration, recorder, options, app.config)
+            print(f"Recorded {len(recorder.inputs)} u2net and {len(calibration_batch)} classifier inputs", file=sys.stderr)
+
+            quantize_u2net(float_u2net_path, app.config['QUANTIZED_MODEL_DIR'], recorder.inputs, args.calibrate_method)
+            quantize_classifier(model, app, calibration_batch)
+
+        u2net_sessions = {'float': float_session}
+        classifiers = {'float': lambda batch: model.predict(batch, verbose=0)}
+        files = {'u2net': {'float': float_u2net_path}, 'classifier': {}}
+        for variant in ('dynamic', 'static'):
+            u2net_path = quantized_model_path(app.config, app.config['BG_REMOVAL_MODEL_NAME'], variant, 'onnx')
+            if os.path.exists(u2net_path):
+                u2net_sessions[variant] = create_u2net_session(u2net_path, session_options(app.config))
+                files['u2net'][variant] = u2net_path
+
+            app.config['CLASSIFIER_QUANTIZATION'] = variant
+            infer = _build_tflite_infer(app)
+            if infer is not None:
+                classifiers[variant] = infer
+                files['classifier'][variant] = quantized_model_path(
+                    app.config, app.config['CLASSIFICATION_MODEL_NAME'], variant, 'tflite'
+                )
+
+        labels = np.array([label for _, label in samples], dtype=object)
+        labelled = labels != None  # noqa: E711 - elementwise comparison
+
+        report = {
+            'images': len(samples),
+            'labelled_images': int(labelled.sum()),
+            'model_sizes_mib': {
+                stage: {variant: round(os.path.getsize(path) / 1024 / 1024, 2) for variant, path in paths.items()}
+                for stage, paths in files.items()
+            },
+            'u2net_ms_per_image': {},
+            'combinations': [],
+        }
+
+        reference = None
+        for u2net_variant in VARIANTS:
+            if u2net_variant not in u2net_sessions:
+                continue
+            batch, seconds = preprocess_all(samples, u2net_sessions[u2net_variant], options, app.config)
+            report['u2net_ms_per_image'][u2net_variant] = round(seconds * 1000, 2)
+
+            for classifier_variant in VARIANTS:
+                if classifier_variant not in classifiers:
+                    continue
+                probabilities, seconds = classify_all(classifiers[classifier_variant], batch)
+                predicted = np.where(probabilities > 0.5, class_names[1], class_names[0])
+                if reference is None:
+                    reference = (probabilities, predicted)
+
+                result = {
+                    'u2net': u2net_variant,
+                    'classifier': classifier_variant,
+                    'classifier_ms_per_image': round(seconds * 1000, 3),
+                    'agreement_with_float': round(float(np.mean(predicted == reference[1])), 4),
+                    'flips': {
+                        f"{a}->{b}": int(np.sum((reference[1] == a) & (predicted == b)))
+                        for a in class_names for b in class_names if a != b
+                    },
+                    'mean_abs_probability_diff': round(float(np.mean(np.abs(probabilities - reference[0]))), 5),
+                    'max_abs_probability_diff': round(float(np.max(np.abs(probabilities - reference[0]))), 5),
+                }
+                if labelled.any():
+                    result['accuracy'] = round(float(np.mean(predicted[labelled] == labels[labelled])), 4)
+                report['combinations'].append(result)
+                print(json.dumps(result), file=sys.stderr)
+
+    report_path = os.path.join(app.config['QUANTIZED_MODEL_DIR'], "quantization_report.json")
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Report written to {report_path}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -19,15 +19,28 @@ const captureBtn = document.getElementById('captureBtn');
 const uploadInput = document.getElementById('uploadInput');
 const imagePreview = document.getElementById('imagePreview');
 const switchCameraBtn = document.getElementById('switchCameraBtn');
+const liveScanBtn = document.getElementById('liveScanBtn');
+
+// 'binary' sends the image as a multipart Blob, 'base64' sends a JSON data URL
+const UPLOAD_MODE = 'binary';
+
+// Live scan: frames sent without waiting for earlier answers, at most this
+// many at once; the server drops the stale ones
+const LIVE_MAX_IN_FLIGHT = 2;
+const LIVE_FRAME_WIDTH = 640;
+const LIVE_MIN_FRAME_INTERVAL_MS = 100;
 
 let currentFacingMode = 'environment'; // Default to back camera
 let currentStream = null;
 let isCameraActive = false; // Track if camera is on
+let liveStream = null; // Open /predict/stream session while live scanning
 
 switchCameraBtn.disabled = true;
+liveScanBtn.disabled = true;
 
 startCameraBtn.addEventListener('click', toggleCamera);
 switchCameraBtn.addEventListener('click', switchCamera);
+liveScanBtn.addEventListener('click', toggleLiveScan);
 
 // On/Off function of camera
 async function toggleCamera() {
@@ -43,9 +56,11 @@ async function toggleCamera() {
     cameraControlIcon.className = 'fas fa-stop text-xs'; // Change icon to stop
     cameraControlText.textContent = 'Stop Camera';
     switchCameraBtn.disabled = false; // Enable Switch Camera button
+    liveScanBtn.disabled = false;
   } else {
     // Stop camera
     // stopCamera();
+    stopLiveScan();
     if (currentStream) {
       currentStream.getTracks().forEach(track => track.stop());
     }
@@ -55,6 +70,7 @@ async function toggleCamera() {
     cameraControlIcon.className = 'fas fa-play text-xs';
     cameraControlText.textContent = 'Start Camera';
     switchCameraBtn.disabled = true; // Disable Switch Camera button when camera is stopped
+    liveScanBtn.disabled = true;
     showToast('Camera stopped', true);
   }
 }
@@ -130,10 +146,30 @@ function switchCamera() {
   startCamera(newFacingMode);
 }
 
-// Send image data to Flask for prediction and handle UI updates
-async function sendPrediction(base64Image) {
+// Build the /predict request for either upload mode
+function buildPredictRequest(image) {
+  if (image instanceof Blob) {
+    const formData = new FormData();
+    formData.append('image', image, 'capture.jpg');
+    // The processed image comes back as a short-lived URL instead of base64
+    return { url: '/predict?image=url', options: { method: 'POST', body: formData } };
+  }
+
+  return {
+    url: '/predict',
+    options: {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ image: image })
+    }
+  };
+}
+
+// Send image data (Blob or base64 data URL) to Flask for prediction and handle UI updates
+async function sendPrediction(image) {
   // Update image preview
-  imagePreview.src = base64Image;
+  if (imagePreview.src.startsWith('blob:')) URL.revokeObjectURL(imagePreview.src);
+  imagePreview.src = image instanceof Blob ? URL.createObjectURL(image) : image;
   imagePreview.style.display = 'block';
 
   // Disable capture button and show loading
@@ -150,11 +186,8 @@ async function sendPrediction(base64Image) {
   );
 
   try {
-    const res = await fetch('/predict', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ image: base64Image })
-    });
+    const request = buildPredictRequest(image);
+    const res = await fetch(request.url, request.options);
 
     const data = await res.json();
 
@@ -174,7 +207,7 @@ async function sendPrediction(base64Image) {
 
       // Display cropped image
       const croppedImagePreview = document.getElementById('croppedImagePreview');
-      croppedImagePreview.src = data.cropped_image;  // Set base64 string as the source
+      croppedImagePreview.src = data.cropped_image_url || data.cropped_image;  // URL or base64 string
       croppedImagePreview.style.display = 'block';  // Make it visible
 
       showToast('Prediction complete', true);
@@ -198,9 +231,139 @@ function capture() {
   canvas.width = video.videoWidth;
   canvas.height = video.videoHeight;
   context.drawImage(video, 0, 0, canvas.width, canvas.height);
-  const base64Image = canvas.toDataURL('image/jpeg');
+  sendCanvas();
+}
+
+// Encode the canvas in the configured upload mode and predict
+function sendCanvas() {
+  if (UPLOAD_MODE === 'binary') {
+    canvas.toBlob(blob => sendPrediction(blob), 'image/jpeg', 0.92);
+  } else {
+    sendPrediction(canvas.toDataURL('image/jpeg'));
+  }
+}
+
+// Start or stop continuous classification of the camera feed
+async function toggleLiveScan() {
+  if (liveStream) {
+    stopLiveScan();
+    return;
+  }
+  if (!currentStream) {
+    showToast('Camera not available', false);
+    return;
+  }
+
+  try {
+    const res = await fetch('/predict/stream', { method: 'POST' });
+    const data = await res.json();
+    if (!res.ok) {
+      showToast('Live scan error: ' + data.error, false);
+      return;
+    }
+
+    const stream = {
+      framesUrl: data.frames_url, streamUrl: data.stream_url, lastFrame: 0, nextSeq: 1, inFlight: new Map()
+    };
+    liveStream = stream;
+    document.getElementById('liveScanText').textContent = 'Stop Live Scan';
+    if (captureBtn) captureBtn.disabled = true;
+    for (let i = 0; i < LIVE_MAX_IN_FLIGHT; i++) {
+      setTimeout(() => liveFrameLoop(stream), i * LIVE_MIN_FRAME_INTERVAL_MS);
+    }
+  } catch (err) {
+    showToast('Connection error: ' + err.message, false);
+  }
+}
 
-  sendPrediction(base64Image);
+function stopLiveScan() {
+  if (!liveStream) return;
+  const stream = liveStream;
+  liveStream = null;
+  for (const controller of stream.inFlight.values()) controller.abort();
+  fetch(stream.streamUrl, { method: 'DELETE' }).catch(() => {});
+  document.getElementById('liveScanText').textContent = 'Live Scan';
+  if (captureBtn) captureBtn.disabled = false;
+}
+
+// One of LIVE_MAX_IN_FLIGHT loops that each send a frame, wait for its answer and repeat
+async function liveFrameLoop(stream) {
+  while (liveStream === stream) {
+    const started = performance.now();
+    const blob = await captureFrameBlob(LIVE_FRAME_WIDTH);
+    if (!blob) return;
+    const seq = stream.nextSeq++;
+    const controller = new AbortController();
+    stream.inFlight.set(seq, controller);
+
+    try {
+      const res = await fetch(stream.framesUrl, {
+        method: 'POST',
+        headers: { 'Content-Type': 'image/jpeg', 'X-Frame-Seq': String(seq) },
+        body: blob,
+        signal: controller.signal
+      });
+      const data = await res.json();
+      if (liveStream !== stream) return;
+      // Busy or rate limited: back off as told and keep scanning
+      if (res.status === 429 || res.status === 503) {
+        const retryAfter = Number(res.headers.get('Retry-After')) || 1;
+        await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+        continue;
+      }
+      if (!res.ok) {
+        showToast('Live scan error: ' + (data.error || res.status), false);
+        stopLiveScan();
+        return;
+      }
+      // Answers can arrive out of order; only show newer frames, and give
+      // up on older ones still in flight
+      if (data.status === 'success' && data.frame > stream.lastFrame) {
+        stream.lastFrame = data.frame;
+        showLiveResult(data);
+        for (const [pending, pendingController] of stream.inFlight) {
+          if (pending < data.frame) pendingController.abort();
+        }
+      }
+    } catch (err) {
+      if (err.name !== 'AbortError') {
+        showToast('Connection error: ' + err.message, false);
+        stopLiveScan();
+        return;
+      }
+    } finally {
+      stream.inFlight.delete(seq);
+    }
+
+    const wait = LIVE_MIN_FRAME_INTERVAL_MS - (performance.now() - started);
+    if (wait > 0) await new Promise(resolve => setTimeout(resolve, wait));
+  }
+}
+
+// Current video frame, scaled down to the given width, as a JPEG Blob
+function captureFrameBlob(width) {
+  if (!currentStream || !video.videoWidth) return Promise.resolve(null);
+  const scale = Math.min(1, width / video.videoWidth);
+  const frameCanvas = document.createElement('canvas');
+  frameCanvas.width = Math.round(video.videoWidth * scale);
+  frameCanvas.height = Math.round(video.videoHeight * scale);
+  frameCanvas.getContext('2d').drawImage(video, 0, 0, frameCanvas.width, frameCanvas.height);
+  return new Promise(resolve => frameCanvas.toBlob(resolve, 'image/jpeg', 0.85));
+}
+
+// Show the smoothed class and confidence of a live frame
+function showLiveResult(data) {
+  predictionText.classList.remove(
+    'text-green-600', 'dark:text-green-400',
+    'text-red-600', 'dark:text-red-400',
+    'text-indigo-600', 'dark:text-indigo-400'
+  );
+  predictionText.innerHTML = `Live: <strong>${data.predicted_class}</strong> (${Math.round(data.confidence * 100)}%)`;
+  if (data.predicted_class === "Milk") {
+    predictionText.classList.add('text-green-600', 'dark:text-green-400');
+  } else {
+    predictionText.classList.add('text-red-600', 'dark:text-red-400');
+  }
 }
 
 // Handle file uploads and predict
@@ -228,9 +391,7 @@ function handleUpload(event) {
       canvas.width = img.width;
       canvas.height = img.height;
       context.drawImage(img, 0, 0);
-      const base64Image = canvas.toDataURL('image/jpeg');
-
-      sendPrediction(base64Image);
+      sendCanvas();
     };
     img.src = e.target.result;
   };
@@ -283,8 +444,17 @@ document.addEventListener('DOMContentLoaded', () => {
       try {
         await signOut(auth); // Sign out from Firebase
 
-        // Then, clear Flask session by hitting /logout
-        window.location.href = "/auth/logout";
+        // Then end the server session; logout is a POST with the CSRF token
+        const form = document.createElement('form');
+        form.method = 'POST';
+        form.action = '/auth/logout';
+        const token = document.createElement('input');
+        token.type = 'hidden';
+        token.name = 'csrf_token';
+        token.value = document.querySelector('meta[name="csrf-token"]').content;
+        form.appendChild(token);
+        document.body.appendChild(form);
+        form.submit();
       } catch (error) {
         console.error("Logout failed:", error);
         alert("Logout failed: " + error.message);
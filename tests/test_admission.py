@@ -0,0 +1,128 @@
+"""Admission control: leases shared through the store, per-user token
+buckets, and the controller's 429/503 decisions."""
+import threading
+import time
+
+import pytest
+
+from app.services.admission import (
+    AdmissionController, AdmissionRejected, MemoryAdmissionStore, SQLiteAdmissionStore, GLOBAL_KEY,
+)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryAdmissionStore()
+    return SQLiteAdmissionStore(str(tmp_path / "admission.sqlite3"))
+
+
+def test_acquire_takes_a_slot_under_every_key(store):
+    limits = {'global': 2, 'user:a': 1}
+
+    lease_id, full = store.acquire(limits, 60)
+    assert lease_id is not None and full is None
+    assert store.in_flight('global') == 1 and store.in_flight('user:a') == 1
+
+    # The user key is full, so nothing is taken from the global one either
+    assert store.acquire(limits, 60) == (None, 'user:a')
+    assert store.in_flight('global') == 1
+
+    store.release(lease_id)
+    assert store.in_flight('global') == 0 and store.in_flight('user:a') == 0
+
+
+def test_release_of_unknown_lease_is_harmless(store):
+    store.release('no-such-lease')
+    assert store.in_flight('global') == 0
+
+
+def test_sqlite_lease_of_a_dead_worker_expires(tmp_path):
+    store = SQLiteAdmissionStore(str(tmp_path / "admission.sqlite3"))
+    limits = {'global': 1}
+
+    lease_id, _ = store.acquire(limits, lease_seconds=0.05)
+    assert store.acquire(limits, 60) == (None, 'global')
+
+    # Never released, as if the worker was killed mid-request
+    time.sleep(0.1)
+    assert store.in_flight('global') == 0
+    assert store.acquire(limits, 60)[0] is not None
+
+
+def test_sqlite_leases_are_shared_between_store_instances(tmp_path):
+    path = str(tmp_path / "admission.sqlite3")
+    first, second = SQLiteAdmissionStore(path), SQLiteAdmissionStore(path)
+
+    lease_id, _ = first.acquire({'global': 1}, 60)
+    assert second.acquire({'global': 1}, 60) == (None, 'global')
+    second.release(lease_id)
+    assert first.in_flight('global') == 0
+
+
+def test_token_bucket_empties_and_refills(store):
+    assert all(store.take_token('rate:a', rate=10, burst=3) == 0 for _ in range(3))
+
+    wait = store.take_token('rate:a', rate=10, burst=3)
+    assert 0 < wait <= 0.1
+    # Other users have their own bucket
+    assert store.take_token('rate:b', rate=10, burst=3) == 0
+
+    time.sleep(0.15)
+    assert store.take_token('rate:a', rate=10, burst=3) == 0
+
+
+def test_controller_rate_limits_with_429(store):
+    controller = AdmissionController(store, user_rate=1, user_burst=2)
+    for _ in range(2):
+        controller.release(controller.admit('a'), 0.01)
+
+    with pytest.raises(AdmissionRejected) as excinfo:
+        controller.admit('a')
+    assert excinfo.value.status == 429 and excinfo.value.reason == 'rate_limited'
+    assert excinfo.value.retry_after > 0
+    # Unless the route is exempt from the bucket
+    controller.release(controller.admit('a', rate_limited=False), 0.01)
+
+
+def test_controller_rejects_a_users_extra_requests_with_429(store):
+    controller = AdmissionController(store, max_in_flight=4, user_max_in_flight=1, user_rate=0)
+    lease_id = controller.admit('a')
+
+    with pytest.raises(AdmissionRejected) as excinfo:
+        controller.admit('a')
+    assert excinfo.value.status == 429 and excinfo.value.reason == 'user_concurrency'
+
+    controller.admit('b')
+    controller.release(lease_id, 0.01)
+    controller.admit('a')
+
+
+def test_controller_queues_until_a_slot_frees(store):
+    controller = AdmissionController(store, max_in_flight=1, user_rate=0, poll_interval=0.01)
+    lease_id = controller.admit('a')
+    threading.Timer(0.05, controller.release, args=(lease_id, 0.05)).start()
+
+    second = controller.admit('b', timeout=2)
+
+    assert second is not None
+    assert controller.stats()['decisions'] == {'admitted': 1, 'queued': 1}
+    assert store.in_flight(GLOBAL_KEY) == 1
+
+
+def test_controller_gives_up_at_the_deadline_with_503(store):
+    controller = AdmissionController(store, max_in_flight=1, user_rate=0, poll_interval=0.01)
+    controller.admit('a')
+
+    with pytest.raises(AdmissionRejected) as excinfo:
+        controller.admit('b', timeout=0.05)
+    assert excinfo.value.status == 503 and excinfo.value.reason == 'deadline'
+
+
+def test_controller_rejects_when_the_queue_is_full(store):
+    controller = AdmissionController(store, max_in_flight=1, user_rate=0, max_queue=0)
+    controller.admit('a')
+
+    with pytest.raises(AdmissionRejected) as excinfo:
+        controller.admit('b')
+    assert excinfo.value.status == 503 and excinfo.value.reason == 'queue_full'
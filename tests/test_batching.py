@@ -0,0 +1,103 @@
+"""BatchingPredictor: flushing on size and on wait, row routing, errors
+and close()."""
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from app.services.batching import BatchingPredictor
+
+
+class RecordingModel:
+    """Returns each input's first pixel as its output row and records the
+    size of every batch it is called with."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batch_sizes = []
+
+    def __call__(self, batch):
+        self.batch_sizes.append(len(batch))
+        time.sleep(self.delay)
+        return batch[:, 0, 0, :1]
+
+
+def image(value):
+    return np.full((4, 4, 3), value, dtype=np.float32)
+
+
+def test_flushes_when_batch_is_full():
+    model = RecordingModel()
+    predictor = BatchingPredictor(model, max_batch_size=4, max_wait_ms=5000)
+    start = time.monotonic()
+    futures = [predictor.submit(image(i)) for i in range(4)]
+
+    results = [future.result(timeout=2) for future in futures]
+
+    # Far sooner than the 5 s window: the fourth request filled the batch
+    assert time.monotonic() - start < 2
+    assert model.batch_sizes == [4]
+    assert [float(row[0]) for row in results] == [0.0, 1.0, 2.0, 3.0]
+    predictor.close()
+
+
+def test_flushes_partial_batch_after_max_wait():
+    model = RecordingModel()
+    predictor = BatchingPredictor(model, max_batch_size=8, max_wait_ms=50)
+    start = time.monotonic()
+
+    result = predictor.predict(image(7), timeout=2)
+
+    assert time.monotonic() - start >= 0.04
+    assert float(result[0]) == 7.0
+    assert model.batch_sizes == [1]
+    predictor.close()
+
+
+def test_concurrent_callers_get_their_own_rows():
+    model = RecordingModel(delay=0.01)
+    predictor = BatchingPredictor(model, max_batch_size=4, max_wait_ms=20)
+    results = {}
+
+    def call(value):
+        results[value] = float(predictor.predict(image(value), timeout=5)[0])
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {i: float(i) for i in range(16)}
+    assert sum(model.batch_sizes) == 16
+    assert max(model.batch_sizes) <= 4
+    assert predictor.stats()['requests'] == 16
+    predictor.close()
+
+
+def test_model_error_fails_every_request_in_the_batch():
+    def broken(batch):
+        raise RuntimeError("model exploded")
+
+    predictor = BatchingPredictor(broken, max_batch_size=2, max_wait_ms=1000)
+    futures = [predictor.submit(image(i)) for i in range(2)]
+
+    for future in futures:
+        with pytest.raises(RuntimeError, match="model exploded"):
+            future.result(timeout=2)
+    predictor.close()
+
+
+def test_close_finishes_queued_requests_and_refuses_new_ones():
+    model = RecordingModel(delay=0.05)
+    predictor = BatchingPredictor(model, max_batch_size=1, max_wait_ms=0)
+    futures = [predictor.submit(image(i)) for i in range(3)]
+
+    predictor.close()
+
+    assert [float(future.result(timeout=2)[0]) for future in futures] == [0.0, 1.0, 2.0]
+    with pytest.raises(RuntimeError):
+        predictor.submit(image(0))
+    predictor._thread.join(timeout=2)
+    assert not predictor._thread.is_alive()
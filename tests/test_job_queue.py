@@ -0,0 +1,109 @@
+"""Job queues: depth limit, ownership, and recovery of jobs whose worker
+died while running them."""
+import threading
+
+import pytest
+
+from app.services.job_queue import SQLiteJobQueue, MemoryJobQueue, QueueFullError, QUEUED, RUNNING, DONE, FAILED
+
+
+@pytest.fixture
+def sqlite_queue(tmp_path):
+    return SQLiteJobQueue(str(tmp_path / "jobs.sqlite3"), max_depth=3, poll_interval=0.01,
+                          running_timeout=60, max_attempts=2)
+
+
+def backdate_start(job_queue, job_id, seconds):
+    """Pretend the job has been running for ``seconds``."""
+    job_queue._connect().execute("UPDATE jobs SET started_at = started_at - ? WHERE id = ?", (seconds, job_id))
+
+
+def status(job_queue, job_id):
+    return job_queue._connect().execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+
+
+def test_sqlite_round_trip(sqlite_queue):
+    job_id = sqlite_queue.enqueue(b"image", "image/png", owner="alice")
+
+    job = sqlite_queue.claim(timeout=0)
+    assert job['id'] == job_id and job['status'] == RUNNING and job['attempts'] == 1
+    assert job['image_data'] == b"image"
+
+    sqlite_queue.complete(job_id, {'predicted_class': 'Milk'})
+    assert sqlite_queue.get(job_id, owner="alice")['result'] == {'predicted_class': 'Milk'}
+    assert sqlite_queue.get(job_id, owner="bob") is None
+
+
+def test_sqlite_depth_limit(sqlite_queue):
+    for _ in range(3):
+        sqlite_queue.enqueue(b"x")
+    with pytest.raises(QueueFullError):
+        sqlite_queue.enqueue(b"x")
+
+
+def test_sqlite_requeues_a_job_lost_with_its_worker(sqlite_queue):
+    job_id = sqlite_queue.enqueue(b"image")
+    sqlite_queue.claim(timeout=0)
+    assert sqlite_queue.claim(timeout=0) is None
+
+    # The worker died; once the running timeout has passed the job is retried
+    backdate_start(sqlite_queue, job_id, 61)
+    job = sqlite_queue.claim(timeout=0)
+
+    assert job['id'] == job_id
+    assert job['attempts'] == 2
+    assert job['image_data'] == b"image"
+
+
+def test_sqlite_fails_a_job_after_max_attempts(sqlite_queue):
+    job_id = sqlite_queue.enqueue(b"image")
+    sqlite_queue.claim(timeout=0)
+    backdate_start(sqlite_queue, job_id, 61)
+    sqlite_queue.claim(timeout=0)
+    backdate_start(sqlite_queue, job_id, 61)
+
+    assert sqlite_queue.claim(timeout=0) is None
+    assert status(sqlite_queue, job_id) == FAILED
+    assert sqlite_queue.get(job_id)['error']
+
+
+def test_sqlite_leaves_recent_running_jobs_alone(sqlite_queue):
+    job_id = sqlite_queue.enqueue(b"image")
+    sqlite_queue.claim(timeout=0)
+    backdate_start(sqlite_queue, job_id, 30)
+
+    assert sqlite_queue.claim(timeout=0) is None
+    assert status(sqlite_queue, job_id) == RUNNING
+
+
+def test_sqlite_queues_in_several_processes_share_jobs(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    first, second = SQLiteJobQueue(path), SQLiteJobQueue(path)
+
+    job_id = first.enqueue(b"image")
+    assert second.claim(timeout=0)['id'] == job_id
+    second.complete(job_id, {'ok': True})
+    assert first.get(job_id)['status'] == DONE
+
+
+def test_memory_depth_limit_holds_under_concurrent_enqueues():
+    job_queue = MemoryJobQueue(max_depth=5)
+    accepted, rejected = [], []
+    barrier = threading.Barrier(20)
+
+    def enqueue():
+        barrier.wait()
+        try:
+            accepted.append(job_queue.enqueue(b"x"))
+        except QueueFullError:
+            rejected.append(True)
+
+    threads = [threading.Thread(target=enqueue) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(accepted) == 5 and len(rejected) == 15
+    assert job_queue.stats()['depth'] == 5
+    assert all(job_queue._jobs[job_id]['status'] == QUEUED for job_id in accepted)
@@ -0,0 +1,44 @@
+"""The fused preprocessing pipeline must match the legacy one on the same
+background-removed image (see scripts/check_preprocess_equivalence.py for
+the same check on a folder of real images)."""
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.services.image_processing import fused_preprocess, legacy_preprocess
+
+TOLERANCE = 2
+
+
+def synthetic_image(seed):
+    rng = np.random.default_rng(seed)
+    height, width = (int(side) for side in rng.integers(200, 900, size=2))
+    rgb = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    # Smooth gradient so CLAHE sees realistic structure, not only noise
+    gradient = np.linspace(0, 255, width, dtype=np.uint16)[np.newaxis, :, np.newaxis]
+    rgb = ((rgb.astype(np.uint16) + gradient) // 2).astype(np.uint8)
+
+    alpha = np.zeros((height, width), dtype=np.uint8)
+    y0, x0 = rng.integers(0, height // 3), rng.integers(0, width // 3)
+    y1, x1 = rng.integers(2 * height // 3, height), rng.integers(2 * width // 3, width)
+    alpha[y0:y1, x0:x1] = 255
+    alpha[y0:y1, x0:x0 + 8] = np.linspace(0, 255, 8, dtype=np.uint8)  # soft edge
+    return Image.fromarray(np.dstack([rgb, alpha]), "RGBA")
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_fused_matches_legacy(seed):
+    image = synthetic_image(seed)
+    legacy = np.asarray(legacy_preprocess(image), dtype=np.int16)
+    fused = np.asarray(fused_preprocess(image), dtype=np.int16)
+
+    assert fused.shape == legacy.shape
+    assert np.abs(legacy - fused).max() <= TOLERANCE
+
+
+def test_fully_transparent_image():
+    image = Image.new("RGBA", (320, 240), (0, 0, 0, 0))
+    legacy = np.asarray(legacy_preprocess(image), dtype=np.int16)
+    fused = np.asarray(fused_preprocess(image), dtype=np.int16)
+
+    assert np.abs(legacy - fused).max() <= TOLERANCE
@@ -0,0 +1,84 @@
+"""PublicKeyCache: refetching on Cache-Control max-age and on unknown key
+ids."""
+import pytest
+
+from app.auth import verification
+from app.auth.verification import PublicKeyCache
+
+
+class FakeResponse:
+    def __init__(self, keys, cache_control):
+        self._keys = keys
+        self.headers = {'Cache-Control': cache_control} if cache_control else {}
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._keys
+
+
+@pytest.fixture
+def key_server(monkeypatch):
+    """Serves the ``keys``/``cache_control`` set on it and counts fetches."""
+    server = type('KeyServer', (), {'keys': {'k1': 'cert1'}, 'cache_control': 'public, max-age=100', 'fetches': 0})()
+
+    def get(url, timeout):
+        server.fetches += 1
+        return FakeResponse(dict(server.keys), server.cache_control)
+
+    monkeypatch.setattr(verification.requests, 'get', get)
+    return server
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(verification.time, 'time', lambda: now[0])
+    return now
+
+
+def test_keys_are_reused_until_max_age(key_server, clock):
+    cache = PublicKeyCache("https://keys.example", "test")
+
+    assert cache.get('k1') == {'k1': 'cert1'}
+    clock[0] += 99
+    cache.get('k1')
+    assert key_server.fetches == 1
+
+    key_server.keys = {'k2': 'cert2'}
+    clock[0] += 2
+    assert cache.get() == {'k2': 'cert2'}
+    assert key_server.fetches == 2
+
+
+def test_default_max_age_without_cache_control(key_server, clock):
+    key_server.cache_control = None
+    cache = PublicKeyCache("https://keys.example", "test", default_max_age=10)
+
+    cache.get()
+    clock[0] += 9
+    cache.get()
+    assert key_server.fetches == 1
+    clock[0] += 2
+    cache.get()
+    assert key_server.fetches == 2
+
+
+def test_unknown_kid_refetches_at_most_once_per_interval(key_server, clock):
+    cache = PublicKeyCache("https://keys.example", "test", min_refetch_seconds=60)
+    cache.get('k1')
+
+    # Keys rotated early: the first unknown kid after the interval refetches
+    key_server.keys = {'k2': 'cert2'}
+    clock[0] += 30
+    assert 'k2' not in cache.get('k2')
+    assert key_server.fetches == 1
+
+    clock[0] += 31
+    assert cache.get('k2') == {'k2': 'cert2'}
+    assert key_server.fetches == 2
+
+    # A bogus kid cannot make every request refetch
+    cache.get('bogus')
+    assert key_server.fetches == 2
@@ -0,0 +1,72 @@
+"""Result caches: LRU eviction under the size cap and TTL expiry."""
+import os
+import time
+
+from app.services.result_cache import DiskResultCache, MemoryResultCache
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryResultCache(max_bytes=30)
+    cache.set("a", b"x" * 10)
+    cache.set("b", b"x" * 10)
+    cache.set("c", b"x" * 10)
+    assert cache.get("a") is not None  # "b" is now the oldest
+
+    cache.set("d", b"x" * 10)
+
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in ("a", "c", "d"))
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['bytes'] == 30
+
+
+def test_memory_cache_replaces_and_skips_oversized_values():
+    cache = MemoryResultCache(max_bytes=10)
+    cache.set("a", b"x" * 4)
+    cache.set("a", b"y" * 6)
+    cache.set("b", b"z" * 11)
+
+    assert cache.get("a") == b"y" * 6
+    assert cache.get("b") is None
+    assert cache.stats()['bytes'] == 6
+
+
+def test_memory_cache_expires_entries():
+    cache = MemoryResultCache(max_bytes=100, ttl_seconds=0.05)
+    cache.set("a", b"value")
+    assert cache.get("a") == b"value"
+
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_disk_cache_round_trip_between_instances(tmp_path):
+    DiskResultCache(str(tmp_path), max_bytes=1000).set("ab12", b"value")
+
+    assert DiskResultCache(str(tmp_path), max_bytes=1000).get("ab12") == b"value"
+
+
+def test_disk_cache_evicts_oldest_entries_to_below_the_cap(tmp_path):
+    cache = DiskResultCache(str(tmp_path), max_bytes=200)
+    for i, key in enumerate(("aa01", "aa02", "aa03")):
+        cache.set(key, b"x" * 52)  # 60 bytes with the header
+        os.utime(cache._path(key), (1000 + i, 1000 + i))
+    cache.get("aa01")  # a hit makes it the newest
+
+    cache.set("aa04", b"x" * 52)
+
+    # 240 bytes is over the cap; trimming to 90% (180) drops only "aa02"
+    assert cache.get("aa02") is None
+    assert all(cache.get(key) is not None for key in ("aa01", "aa03", "aa04"))
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['bytes'] == 180
+
+
+def test_disk_cache_expires_entries(tmp_path):
+    cache = DiskResultCache(str(tmp_path), max_bytes=1000, ttl_seconds=0.05)
+    cache.set("ab12", b"value")
+
+    time.sleep(0.1)
+    assert cache.get("ab12") is None
+    assert not os.path.exists(cache._path("ab12"))
@@ -0,0 +1,103 @@
+"""Stream registry: opening, ownership, per-owner and global eviction and
+stale-frame detection, against both stores."""
+import time
+
+import pytest
+
+from app.services.streaming import MemoryStreamStore, SQLiteStreamStore, StreamNotFoundError, StreamRegistry
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryStreamStore()
+    return SQLiteStreamStore(str(tmp_path / "streams.sqlite3"))
+
+
+def open_streams(registry, owner, stream_ids):
+    for stream_id in stream_ids:
+        registry.open(stream_id, owner)
+        time.sleep(0.002)  # distinct last_seen, so eviction order is defined
+
+
+def test_frames_need_an_opened_stream_of_the_same_owner(store):
+    registry = StreamRegistry(store)
+    with pytest.raises(StreamNotFoundError):
+        registry.get("never-opened", "alice")
+
+    registry.open("s1", "alice")
+    with pytest.raises(StreamNotFoundError):
+        registry.get("s1", "bob")
+    state, seq = registry.get("s1", "alice")
+    assert state.owner == "alice" and seq == 1
+
+
+def test_sequence_numbers_mark_older_frames_stale(store):
+    registry = StreamRegistry(store)
+    registry.open("s1", "alice")
+
+    assert registry.get("s1", "alice", seq=5)[1] == 5
+    assert registry.get("s1", "alice", seq=3)[1] == 3  # arrived late
+    assert registry.is_stale("s1", 3)
+    assert not registry.is_stale("s1", 5)
+    assert registry.get("s1", "alice")[1] == 6
+
+
+def test_a_user_over_the_limit_closes_their_own_oldest_stream(store):
+    registry = StreamRegistry(store, max_streams=10, max_per_owner=2)
+    open_streams(registry, "bob", ["b1"])
+    open_streams(registry, "alice", ["a1", "a2", "a3"])
+
+    with pytest.raises(StreamNotFoundError):
+        registry.get("a1", "alice")
+    registry.get("a2", "alice")
+    registry.get("a3", "alice")
+    registry.get("b1", "bob")
+    assert registry.stats()['streams'] == 3
+
+
+def test_global_limit_closes_the_least_recently_used_stream(store):
+    registry = StreamRegistry(store, max_streams=2, max_per_owner=2)
+    open_streams(registry, "alice", ["a1"])
+    open_streams(registry, "bob", ["b1"])
+    registry.get("a1", "alice")  # a1 is now more recent than b1
+    time.sleep(0.002)
+
+    open_streams(registry, "carol", ["c1"])
+
+    with pytest.raises(StreamNotFoundError):
+        registry.get("b1", "bob")
+    registry.get("a1", "alice")
+    registry.get("c1", "carol")
+
+
+def test_idle_streams_expire(store):
+    registry = StreamRegistry(store, idle_seconds=0.05)
+    registry.open("s1", "alice")
+
+    time.sleep(0.1)
+    with pytest.raises(StreamNotFoundError):
+        registry.get("s1", "alice")
+
+
+def test_close_returns_counters_and_forgets_the_stream(store):
+    registry = StreamRegistry(store)
+    registry.open("s1", "alice")
+    registry.get("s1", "alice")
+    registry.record("s1", "frames")
+    registry.record("s1", "dropped")
+
+    with pytest.raises(StreamNotFoundError):
+        registry.close("s1", "bob")
+    assert registry.close("s1", "alice") == {'stream_id': "s1", 'frames': 1, 'dropped': 1, 'mask_reused': 0}
+    with pytest.raises(StreamNotFoundError):
+        registry.get("s1", "alice")
+
+
+def test_sqlite_stream_is_visible_to_other_workers(tmp_path):
+    path = str(tmp_path / "streams.sqlite3")
+    first, second = StreamRegistry(SQLiteStreamStore(path)), StreamRegistry(SQLiteStreamStore(path))
+
+    first.open("s1", "alice")
+    second.get("s1", "alice", seq=4)
+    assert first.is_stale("s1", 2)